@@ -90,6 +90,18 @@ class MaliciousFileException(APIException):
     default_detail = _("Malware detected.")
 
 
+class AttachmentNotScannedException(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_code = "ATTACHMENT_NOT_SCANNED"
+    default_detail = _("The attachment hasn't been virus scanned yet")
+
+
+class AttachmentScanFailedException(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_code = "ATTACHMENT_SCAN_FAILED"
+    default_detail = _("The virus scan of the attachment failed")
+
+
 class UserWithServiceApiKeyDeleteError(APIException):
     """Exception raised when GDPR deletion fails."""
 
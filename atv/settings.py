@@ -64,6 +64,25 @@ env = environ.Env(
     TOKEN_AUTH_REQUIRE_SCOPE=(bool, False),
     TOKEN_AUTH_AUTHSERVER_URL=(list, []),
     CLAMAV_HOST=(str, "atv-clamav"),
+    CLAMAV_PORT=(int, 3310),
+    CLAMAV_TIMEOUT=(float, 60),
+    CLAMAV_POOL_SIZE=(int, 4),
+    CLAMAV_POOL_WAIT_TIMEOUT=(float, 30),
+    SCAN_VERDICT_CACHE_TIMEOUT=(int, 7 * 24 * 60 * 60),
+    ATTACHMENT_SCAN_DEFERRED=(bool, False),
+    ATTACHMENT_SCAN_MAX_ATTEMPTS=(int, 5),
+    ATTACHMENT_SCAN_RETRY_DELAY=(int, 10 * 60),
+    ATTACHMENT_DEDUPLICATION=(bool, False),
+    ENCRYPTION_COMPRESSION=(bool, False),
+    JSON_ENGINE=(str, "auto"),
+    PAGINATION_COUNT_LIMIT=(int, 10000),
+    ATTACHMENT_STORAGE=(str, "filesystem"),
+    ATTACHMENT_S3_BUCKET=(str, ""),
+    ATTACHMENT_S3_ENDPOINT_URL=(str, ""),
+    ATTACHMENT_S3_REGION=(str, ""),
+    ATTACHMENT_S3_ACCESS_KEY_ID=(str, ""),
+    ATTACHMENT_S3_SECRET_ACCESS_KEY=(str, ""),
+    ATTACHMENT_S3_LOCATION=(str, ""),
     SOCIAL_AUTH_TUNNISTAMO_KEY=(str, ""),
     SOCIAL_AUTH_TUNNISTAMO_SECRET=(str, ""),
     SOCIAL_AUTH_TUNNISTAMO_OIDC_ENDPOINT=(str, ""),
@@ -134,6 +153,11 @@ MEDIA_URL = env("MEDIA_URL")
 STATIC_URL = env("STATIC_URL")
 
 FILE_UPLOAD_PERMISSIONS = None
+# The uploaded files are hashed while they're received for the scan verdict cache
+FILE_UPLOAD_HANDLERS = [
+    "utils.files.HashingMemoryFileUploadHandler",
+    "utils.files.HashingTemporaryFileUploadHandler",
+]
 
 ROOT_URLCONF = "atv.urls"
 WSGI_APPLICATION = "atv.wsgi.application"
@@ -158,6 +182,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "rest_framework_api_key",
     "django_filters",
@@ -219,6 +244,15 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "utils.json.JSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "utils.json.JSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
     "DEFAULT_FILTER_BACKENDS": [
         "django_filters.rest_framework.DjangoFilterBackend",
     ],
@@ -228,13 +262,48 @@ REST_FRAMEWORK = {
     "DEFAULT_PARENT_LOOKUP_KWARG_NAME_PREFIX": "",
     "EXCEPTION_HANDLER": "utils.exceptions.custom_exception_handler",
 }
+# Number of results above which paginated results can be counted with an estimate
+# or capped to this number when it's requested with the count parameter
+PAGINATION_COUNT_LIMIT = env("PAGINATION_COUNT_LIMIT")
+# JSON codec of the encrypted content and the API: "orjson", "json" (the standard
+# library) or "auto" for orjson if it's installed
+JSON_ENGINE = env("JSON_ENGINE")
+
+# Attachment files are stored on the local filesystem under MEDIA_ROOT, or with
+# "s3" in a bucket of an S3 compatible object storage, which requires boto3
+if env("ATTACHMENT_STORAGE") == "s3":
+    ATTACHMENT_STORAGE = {
+        "BACKEND": "utils.storage.S3Storage",
+        "OPTIONS": {
+            "bucket_name": env("ATTACHMENT_S3_BUCKET"),
+            "endpoint_url": env("ATTACHMENT_S3_ENDPOINT_URL"),
+            "region_name": env("ATTACHMENT_S3_REGION"),
+            "access_key_id": env("ATTACHMENT_S3_ACCESS_KEY_ID"),
+            "secret_access_key": env("ATTACHMENT_S3_SECRET_ACCESS_KEY"),
+            "location": env("ATTACHMENT_S3_LOCATION"),
+        },
+    }
+elif env("ATTACHMENT_STORAGE") == "filesystem":
+    ATTACHMENT_STORAGE = {"BACKEND": "django.core.files.storage.FileSystemStorage"}
+else:
+    raise ImproperlyConfigured(
+        f"Unknown ATTACHMENT_STORAGE: {env('ATTACHMENT_STORAGE')}"
+    )
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    "attachments": ATTACHMENT_STORAGE,
+}
 
 ATTACHMENT_MEDIA_DIR = "attachments"
+ATTACHMENT_BLOB_MEDIA_DIR = "attachment_blobs"
 ENABLE_AUTOMATIC_ATTACHMENT_FILE_DELETION = env.bool(
     "ENABLE_AUTOMATIC_ATTACHMENT_FILE_DELETION"
 )
 MAX_FILE_SIZE = 20971520  # 20 MiB
 MAX_FILE_UPLOAD_ALLOWED = 10
+# Size of the plaintext segments attachments are encrypted in
+ATTACHMENT_ENCRYPTION_SEGMENT_SIZE = 65536  # 64 KiB
 
 # Authentication
 
@@ -327,6 +396,46 @@ LOGGING = {
 
 # Malware Protection
 CLAMAV_HOST = env("CLAMAV_HOST")
+CLAMAV_PORT = env("CLAMAV_PORT")
+# Timeout of the clamd socket operations in seconds
+CLAMAV_TIMEOUT = env("CLAMAV_TIMEOUT")
+# Max number of concurrent clamd connections per process and the time to wait for
+# a free one
+CLAMAV_POOL_SIZE = env("CLAMAV_POOL_SIZE")
+CLAMAV_POOL_WAIT_TIMEOUT = env("CLAMAV_POOL_WAIT_TIMEOUT")
+# How long clean virus scan verdicts of file contents are cached in seconds. The
+# verdicts are invalidated anyway when the signature database is updated.
+SCAN_VERDICT_CACHE_TIMEOUT = env("SCAN_VERDICT_CACHE_TIMEOUT")
+# Store uploaded attachments without scanning them and leave them pending for the
+# scan_pending_attachments command. Attachments are only served once they're clean.
+ATTACHMENT_SCAN_DEFERRED = env("ATTACHMENT_SCAN_DEFERRED")
+# Pending attachments whose scan fails are retried after a delay in seconds, and
+# marked failed after the maximum number of attempts so they don't block the queue
+ATTACHMENT_SCAN_MAX_ATTEMPTS = env("ATTACHMENT_SCAN_MAX_ATTEMPTS")
+ATTACHMENT_SCAN_RETRY_DELAY = env("ATTACHMENT_SCAN_RETRY_DELAY")
+# Store identical attachment files only once as content-addressed blobs
+ATTACHMENT_DEDUPLICATION = env("ATTACHMENT_DEDUPLICATION")
+# Compress document content and attachment files before encrypting them
+ENCRYPTION_COMPRESSION = env("ENCRYPTION_COMPRESSION")
+# Smaller content would only grow when compressed
+ENCRYPTION_COMPRESSION_MIN_SIZE = 256
+# Media types which are compressed already. Types ending with a slash match all the
+# subtypes.
+INCOMPRESSIBLE_MEDIA_TYPES = [
+    "image/",
+    "audio/",
+    "video/",
+    "application/gzip",
+    "application/pdf",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "application/vnd.oasis.opendocument.presentation",
+    "application/vnd.oasis.opendocument.spreadsheet",
+    "application/vnd.oasis.opendocument.text",
+    "application/x-7z-compressed",
+    "application/zip",
+]
 
 HELUSERS_BACK_CHANNEL_LOGOUT_ENABLED = True
 HELUSERS_PASSWORD_LOGIN_DISABLED = env("HELUSERS_PASSWORD_LOGIN_DISABLED")
@@ -120,9 +120,11 @@ class AuditLoggingModelViewSet(ModelViewSet):
         target = None
         lookup_value = self.kwargs.get(self.lookup_field, None)
         if lookup_value is not None:
+            model = self.get_queryset().model
+            # Only the ID of the target is logged, so the rest isn't loaded
             target = (
-                self.get_queryset()
-                .model.objects.filter(**{self.lookup_field: lookup_value})
+                model.objects.filter(**{self.lookup_field: lookup_value})
+                .only(getattr(model, "audit_log_id_field", "pk"))
                 .first()
             )
         return target or self.created_instance or self.get_queryset().model
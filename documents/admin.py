@@ -35,6 +35,7 @@ class AttachmentAdmin(admin.ModelAdmin):
         "media_type",
         "get_size_in_mb",
         "get_document",
+        "scan_status",
         "created_at",
         "updated_at",
     )
@@ -42,12 +43,13 @@ class AttachmentAdmin(admin.ModelAdmin):
         "filename",
         "document__id",
     )
-    list_filter = ("media_type",)
+    list_filter = ("media_type", "scan_status")
     autocomplete_fields = ("document",)
     readonly_fields = (
         "filename",
         "media_type",
         "size",
+        "scan_status",
     )
 
     @admin.display(description=_("size"), ordering="size")
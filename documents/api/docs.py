@@ -8,6 +8,7 @@ from drf_spectacular.utils import (
 )
 from rest_framework import serializers, status
 
+from documents.enums import LookforMode
 from documents.serializers import AttachmentSerializer, DocumentSerializer
 from documents.serializers.document import DocumentMetadataSerializer, GDPRSerializer
 from documents.serializers.status_history import (
@@ -57,6 +58,7 @@ example_attachment = OpenApiExample(
         "filename": "high-school-diploma.pdf",
         "mediaType": "application/pdf",
         "size": 123223,
+        "scanStatus": "clean",
         "href": "https://transactions-storage.com/api/v1/documents/97c0b7a5-0b4c-4470-9a41-48d79454f233/"
         "attachments/12994",
     },
@@ -170,6 +172,7 @@ example_document = OpenApiExample(
                 "filename": "high-school-diploma.pdf",
                 "mediaType": "application/pdf",
                 "size": 123223,
+                "scanStatus": "clean",
                 "href": "https://transactions-storage.com/api/v1/documents/97c0b7a5-0b4c-4470-9a41-48d79454f233/"
                 "attachments/12994",
             },
@@ -180,6 +183,7 @@ example_document = OpenApiExample(
                 "filename": "my-face.jpeg",
                 "mediaType": "image/jpeg",
                 "size": 512884,
+                "scanStatus": "clean",
                 "href": "https://transactions-storage.com/api/v1/documents/97c0b7a5-0b4c-4470-9a41-48d79454f233/"
                 "attachments/12995",
             },
@@ -430,6 +434,16 @@ attachment_viewset_docs = {
             (status.HTTP_200_OK, "application/octet-stream"): OpenApiResponse(
                 description="Returns the attachment as a downloadable file.",
             ),
+            (status.HTTP_206_PARTIAL_CONTENT, "application/octet-stream"): (
+                OpenApiResponse(
+                    description=(
+                        "Returns the part of the attachment requested with a single"
+                        " byte range in the `Range` header. If the `If-Range` header"
+                        " doesn't match the current `ETag` or `Last-Modified` of the"
+                        " attachment, the whole file is returned instead."
+                    ),
+                )
+            ),
             (status.HTTP_400_BAD_REQUEST, "application/json"): _base_400_response(),
             status.HTTP_401_UNAUTHORIZED: _base_401_response(),
             status.HTTP_403_FORBIDDEN: OpenApiResponse(
@@ -449,10 +463,58 @@ attachment_viewset_docs = {
                     " have an attachment `attachmentId`."
                 )
             ),
+            status.HTTP_409_CONFLICT: OpenApiResponse(
+                description=(
+                    "The attachment is still waiting for its virus scan, or its scan"
+                    " failed (`ATTACHMENT_SCAN_FAILED`). Attachments found to be"
+                    " infected are refused with `400`."
+                )
+            ),
+            status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE: OpenApiResponse(
+                description=(
+                    "The byte range in the `Range` header doesn't overlap the"
+                    " attachment."
+                )
+            ),
             status.HTTP_500_INTERNAL_SERVER_ERROR: _base_500_response(),
         },
         examples=[example_attachment, example_error],
     ),
+    "download_zip": extend_schema(
+        summary="Download all the attachments of a document as a ZIP archive",
+        description=(
+            "The attachments are decrypted into an uncompressed ZIP archive while"
+            " it's being sent, so the response has no `Content-Length`. Repeated"
+            " filenames are numbered, e.g. `file (1).txt`.\n\n"
+            "Permission to access the document is checked the same way as when"
+            " downloading a single attachment. The download is recorded in the audit"
+            " log once for the whole document."
+        ),
+        responses={
+            (status.HTTP_200_OK, "application/zip"): OpenApiResponse(
+                description="Returns the attachments as a ZIP archive.",
+            ),
+            status.HTTP_401_UNAUTHORIZED: _base_401_response(),
+            status.HTTP_403_FORBIDDEN: OpenApiResponse(
+                description=(
+                    "The authenticated user lacks the proper permissions to access the"
+                    " attachments of the document."
+                )
+            ),
+            status.HTTP_404_NOT_FOUND: OpenApiResponse(
+                description="No document was found with `documentId`."
+            ),
+            status.HTTP_409_CONFLICT: OpenApiResponse(
+                description=(
+                    "An attachment is still waiting for its virus scan, or its scan"
+                    " failed (`ATTACHMENT_SCAN_FAILED`). Documents with an infected"
+                    " attachment are refused with `400`."
+                )
+            ),
+            status.HTTP_500_INTERNAL_SERVER_ERROR: _base_500_response(),
+        },
+        examples=[example_error],
+    ),
     "create": extend_schema(
         summary="Upload a new attachment to a document",
         description=(
@@ -550,6 +612,23 @@ attachment_viewset_docs = {
     "partial_update": extend_schema(exclude=True),
 }
 
+sparse_fieldset_parameters = [
+    OpenApiParameter(
+        "fields",
+        OpenApiTypes.STR,
+        description=(
+            "Comma separated names of the fields to return, e.g."
+            " `id,status,metadata`. The documents are fetched faster when e.g. the"
+            " content, attachments or status histories aren't needed."
+        ),
+    ),
+    OpenApiParameter(
+        "omit",
+        OpenApiTypes.STR,
+        description="Comma separated names of the fields not to return",
+    ),
+]
+
 document_viewset_docs = {
     "list": extend_schema(
         summary="Search for documents",
@@ -617,6 +696,17 @@ document_viewset_docs = {
                     " value is 'iexact', key must be exact and is case sensitive."
                 ),
             ),
+            OpenApiParameter(
+                "lookfor_mode",
+                OpenApiTypes.STR,
+                enum=LookforMode.values,
+                description=(
+                    "How the values of `lookfor` are matched. `iexact` by default."
+                    " With `exact` the values must be equal strings, which is the"
+                    " fastest way to search large services."
+                ),
+            ),
+            *sparse_fieldset_parameters,
         ],
         responses={
             (status.HTTP_200_OK, "application/json"): OpenApiResponse(
@@ -651,6 +741,7 @@ document_viewset_docs = {
             # " owner of the document or the document is owned by an organization and"
             # " the user has permission to act on behalf of that organization."
         ),
+        parameters=sparse_fieldset_parameters,
         responses={
             (status.HTTP_200_OK, "application/json"): OpenApiResponse(
                 response=DocumentSerializer,
@@ -689,6 +780,7 @@ document_viewset_docs = {
             # " the user has permission to act on behalf of that organization."
         ),
         request=serializers.JSONField(),
+        parameters=sparse_fieldset_parameters,
         responses={
             (status.HTTP_200_OK, "application/json"): OpenApiResponse(
                 response=DocumentSerializer,
@@ -1,13 +1,28 @@
+import json
+
+from django.db.models import Value
 from django_filters import BaseInFilter, CharFilter, Filter
 from django_filters import rest_framework as filters
 from django_filters.constants import EMPTY_VALUES
 from rest_framework.exceptions import ValidationError
 
+from services.utils import get_service_from_request
 from utils import uuid
+from utils.models import CaseFoldedJSON
 
+from ..enums import LookforMode
+from ..metadata_indexes import get_indexed_metadata_keys
 from ..models import Document
 
 
+def is_scalar(value: str) -> bool:
+    """Check whether a value is a number, a boolean or null in JSON."""
+    try:
+        return not isinstance(json.loads(value), (str, list, dict))
+    except ValueError:
+        return False
+
+
 class UserUUIDFilter(CharFilter):
     """
     Allows filtering for null values in addition to valid UUID
@@ -32,18 +47,20 @@ class MetadataJSONFilter(Filter):
     """
     Custom filter for metadata field.
     Query can be made with key value pairs like "key:value, ..." without quotes
+
+    The pairs are matched with a single containment query, which a GIN index
+    serves. By default the values are case-insensitive: the case folded metadata
+    is searched with an expression index and the matches are rechecked with the
+    exact keys. With `lookfor_mode=exact` the values have to be equal strings.
+    The keys registered as indexed metadata keys of the service are looked up with
+    their own indexes instead.
     """
 
-    def filter(self, qs, value):
-        if value in EMPTY_VALUES:
-            return qs
-        query_parts = [val.strip() for val in value.split(",")]
-        for part in query_parts:
+    def parse(self, value: str) -> list[tuple[str, str]]:
+        pairs = []
+        for part in (val.strip() for val in value.split(",")):
             try:
                 key, value = part.split(":", maxsplit=1)
-                qs = qs.filter(
-                    metadata__has_key=key, **{"metadata__" + key + "__iexact": value}
-                )
             except ValueError:
                 raise ValidationError(
                     detail={
@@ -53,6 +70,51 @@ class MetadataJSONFilter(Filter):
                         ]
                     }
                 )
+            pairs.append((key, value))
+        return pairs
+
+    def get_indexed_keys(self) -> set[str]:
+        request = getattr(self.parent, "request", None)
+        if request is None:
+            return set()
+        return get_indexed_metadata_keys(
+            get_service_from_request(request, raise_exception=False)
+        )
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        pairs = self.parse(value)
+        # The iexact lookups of the keys with indexes of their own are served by
+        # the partial indexes of the service's documents
+        indexed_keys = self.get_indexed_keys()
+        if self.parent.form.cleaned_data.get("lookfor_mode") == LookforMode.EXACT:
+            contained = dict(pairs)
+            if len(contained) < len(set(pairs)):
+                # A key can't be equal to different values
+                return qs.none()
+            for key, value in pairs:
+                if key in indexed_keys:
+                    qs = qs.filter(**{"metadata__" + key + "__iexact": value})
+            return qs.filter(metadata__contains=contained)
+
+        # Numbers and booleans of the metadata match as text, so they're left to
+        # the recheck
+        strings = {
+            key: value
+            for key, value in pairs
+            if key not in indexed_keys and not is_scalar(value)
+        }
+        if strings:
+            # Non-ASCII characters are folded only when they aren't escaped
+            contained = json.dumps(strings, ensure_ascii=False)
+            qs = qs.alias(metadata_folded=CaseFoldedJSON("metadata")).filter(
+                metadata_folded__contains=CaseFoldedJSON(Value(contained))
+            )
+        for key, value in pairs:
+            qs = qs.filter(
+                metadata__has_key=key, **{"metadata__" + key + "__iexact": value}
+            )
         return qs
 
 
@@ -107,6 +169,11 @@ class DocumentMetadataFilterSet(filters.FilterSet):
 class DocumentFilterSet(DocumentMetadataFilterSet):
     user_id = UserUUIDFilter(field_name="user__uuid")
     lookfor = MetadataJSONFilter(field_name="metadata", label="Look for")
+    lookfor_mode = filters.ChoiceFilter(
+        choices=LookforMode.choices,
+        method="filter_lookfor_mode",
+        label="Look for mode",
+    )
 
     class Meta:
         model = Document
@@ -116,3 +183,7 @@ class DocumentFilterSet(DocumentMetadataFilterSet):
             "business_id",
             "transaction_id",
         ]
+
+    def filter_lookfor_mode(self, queryset, name, value):
+        # Applied by the lookfor filter
+        return queryset
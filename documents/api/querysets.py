@@ -6,6 +6,7 @@ from services.models import Service, ServiceAPIKey
 from users.models import User
 
 from ..models import Activity, Attachment, Document, StatusHistory
+from ..serializers import DocumentSerializer
 
 
 def get_document_statistics_queryset(user: User, service: Service) -> QuerySet:
@@ -189,3 +190,51 @@ def get_attachment_queryset(
         qs_filters["document__user_id"] = user.id
 
     return Attachment.objects.filter(**qs_filters)
+
+
+# Fields of the representation of a document and the relations they need
+SPARSE_FIELDSET_PREFETCHES = {
+    "attachments": "attachments",
+    "status_histories": "status_histories__activities",
+}
+SPARSE_FIELDSET_SELECTS = {
+    "user_id": "user",
+    "service": "service",
+}
+
+
+def get_sparse_document_queryset(queryset: QuerySet, fields: set[str]) -> QuerySet:
+    """Adapt a document queryset to a sparse fieldset, see
+    DocumentSerializer.get_sparse_fieldset.
+
+    The columns and relations which aren't needed for the given fields aren't
+    loaded. The encrypted content isn't even read from the database unless it's
+    needed.
+    """
+    fields = DocumentSerializer.get_source_fields(fields)
+    deferred = [
+        field.name
+        for field in Document._meta.concrete_fields
+        if field.name in DocumentSerializer.Meta.fields and field.name not in fields
+    ]
+    if "content" not in fields:
+        deferred.append("data_key")
+    return (
+        queryset.select_related(None)
+        .select_related(
+            *(
+                related
+                for name, related in SPARSE_FIELDSET_SELECTS.items()
+                if name in fields
+            )
+        )
+        .prefetch_related(None)
+        .prefetch_related(
+            *(
+                prefetch
+                for name, prefetch in SPARSE_FIELDSET_PREFETCHES.items()
+                if name in fields
+            )
+        )
+        .defer(*deferred)
+    )
@@ -1,8 +1,11 @@
+from typing import Iterator, Optional
+
 import sentry_sdk
 from django.db import transaction
-from django.http import FileResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.utils.http import content_disposition_header, http_date, quote_etag
 from django.utils.timezone import now
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema, extend_schema_view
@@ -15,15 +18,18 @@ from rest_framework.exceptions import (
     NotFound,
     PermissionDenied,
 )
-from rest_framework.parsers import FileUploadParser, JSONParser, MultiPartParser
+from rest_framework.parsers import FileUploadParser, MultiPartParser
 from rest_framework.response import Response
 from rest_framework.utils import json
 from rest_framework_extensions.mixins import NestedViewSetMixin
 
 from atv.decorators import not_allowed, service_required
 from atv.exceptions import (
+    AttachmentNotScannedException,
+    AttachmentScanFailedException,
     DocumentLockedException,
     InvalidFieldException,
+    MaliciousFileException,
     MissingParameterException,
     UserWithServiceApiKeyDeleteError,
 )
@@ -32,9 +38,14 @@ from services.enums import ServicePermissions
 from services.utils import get_service_api_key_from_request, get_service_from_request
 from users.models import User
 from utils.api import PageNumberPagination
+from utils.files import guess_content_type
+from utils.http import RangeNotSatisfiableError, get_byte_range
+from utils.json import JSONParser
 from utils.uuid import is_valid_uuid
+from utils.zipstream import ZipEntry, iter_zip, unique_entry_names
 
 from ..consts import VALID_OWNER_PATCH_FIELDS
+from ..enums import ScanStatus
 from ..models import Attachment, Document, StatusHistory
 from ..serializers import (
     AttachmentSerializer,
@@ -42,6 +53,7 @@ from ..serializers import (
     CreateAttachmentSerializer,
     DocumentSerializer,
 )
+from ..serializers.attachment import create_document_attachments
 from ..serializers.document import (
     DocumentMetadataSerializer,
     DocumentStatisticsSerializer,
@@ -51,7 +63,7 @@ from ..serializers.status_history import (
     CreateStatusHistorySerializer,
     StatusHistorySerializer,
 )
-from ..utils import get_decrypted_file
+from ..utils import iter_decrypted_file
 from .docs import (
     attachment_viewset_docs,
     document_gdpr_viewset,
@@ -71,6 +83,7 @@ from .querysets import (
     get_document_metadata_queryset,
     get_document_queryset,
     get_document_statistics_queryset,
+    get_sparse_document_queryset,
 )
 
 
@@ -171,6 +184,7 @@ class DocumentStatisticsViewSet(AuditLoggingModelViewSet):
     serializer_class = DocumentStatisticsSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = DocumentStatisticsFilterSet
+    keyset_ordering_fields = ("created_at",)
 
     def get_queryset(self):
         user = self.request.user
@@ -289,6 +303,7 @@ class DocumentMetadataViewSet(AuditLoggingModelViewSet):
     lookup_field = "user__uuid"
     pagination_class = PageNumberPagination
     filterset_class = DocumentMetadataFilterSet
+    keyset_ordering_fields = ("status_timestamp",)
 
     def get_queryset(self):
         user = self.request.user
@@ -334,6 +349,21 @@ class DocumentMetadataViewSet(AuditLoggingModelViewSet):
         """Method not allowed"""
 
 
+def _iter_lazily(function, *args) -> Iterator:
+    """Call a function returning an iterator only when it's iterated."""
+    yield from function(*args)
+
+
+def _check_attachment_scanned(attachment: Attachment):
+    """Files are only served once they're known to be clean."""
+    if attachment.scan_status == ScanStatus.INFECTED:
+        raise MaliciousFileException()
+    if attachment.scan_status == ScanStatus.FAILED:
+        raise AttachmentScanFailedException()
+    if attachment.scan_status != ScanStatus.CLEAN:
+        raise AttachmentNotScannedException()
+
+
 @extend_schema_view(**attachment_viewset_docs)
 class AttachmentViewSet(AuditLoggingModelViewSet, NestedViewSetMixin):
     serializer_class = AttachmentSerializer
@@ -351,13 +381,94 @@ class AttachmentViewSet(AuditLoggingModelViewSet, NestedViewSetMixin):
 
     def retrieve(self, request, *args, **kwargs):
         attachment: Attachment = self.get_object()
-        decrypted_file = get_decrypted_file(attachment.file.read(), attachment.filename)
-        attachment.file.close()
+        last_modified = int(attachment.updated_at.timestamp())
+        etag = quote_etag(f"{attachment.pk}-{last_modified}")
+
         with self.record_action():
-            return FileResponse(
-                decrypted_file,
-                as_attachment=True,
+            _check_attachment_scanned(attachment)
+
+            try:
+                byte_range = get_byte_range(
+                    request, attachment.size, etag, last_modified
+                )
+            except RangeNotSatisfiableError:
+                response = HttpResponse(
+                    status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+                )
+                response.headers["Content-Range"] = f"bytes */{attachment.size}"
+                return response
+
+            # Decrypt the file segment by segment while it's being sent, so the
+            # memory usage doesn't depend on the size of the attachment. Only the
+            # segments covering the requested range are decrypted.
+            response = StreamingHttpResponse(
+                iter_decrypted_file(attachment.file, byte_range),
+                content_type=guess_content_type(attachment.filename),
+                status=(
+                    status.HTTP_206_PARTIAL_CONTENT
+                    if byte_range
+                    else status.HTTP_200_OK
+                ),
+            )
+            if byte_range:
+                start, end = byte_range
+                response.headers["Content-Range"] = (
+                    f"bytes {start}-{end - 1}/{attachment.size}"
+                )
+                response.headers["Content-Length"] = end - start
+            else:
+                response.headers["Content-Length"] = attachment.size
+            response.headers["Accept-Ranges"] = "bytes"
+            response.headers["ETag"] = etag
+            response.headers["Last-Modified"] = http_date(last_modified)
+            response.headers["Content-Disposition"] = content_disposition_header(
+                True, attachment.filename
             )
+            return response
+
+    @action(detail=False, methods=["GET"], url_path="zip")
+    def download_zip(self, request, *args, **kwargs):
+        """Download all the attachments of a document as a ZIP archive. The files
+        are decrypted into the archive while it's being sent."""
+        # Return 404 if user has no access to document or if it doesn't exist
+        document = get_object_or_404(
+            get_document_queryset(
+                request.user,
+                get_service_from_request(request),
+                get_service_api_key_from_request(request),
+            ),
+            id=kwargs.get("document_id"),
+        )
+
+        with self.record_action(document):
+            attachments = list(
+                self.get_queryset()
+                .filter(document=document)
+                .select_related("blob")
+                .order_by("created_at", "id")
+            )
+            for attachment in attachments:
+                _check_attachment_scanned(attachment)
+                attachment.document = document
+
+            names = unique_entry_names(a.filename for a in attachments)
+            entries = (
+                ZipEntry(
+                    name,
+                    timezone.localtime(attachment.updated_at),
+                    attachment.size,
+                    # Decrypted only when the archive reaches the attachment
+                    _iter_lazily(iter_decrypted_file, attachment.file),
+                )
+                for name, attachment in zip(names, attachments)
+            )
+            response = StreamingHttpResponse(
+                iter_zip(entries), content_type="application/zip"
+            )
+            response.headers["Content-Disposition"] = content_disposition_header(
+                True, f"{document.id}.zip"
+            )
+            return response
 
     def destroy(self, request, *args, **kwargs):
         attachment = self.get_object()
@@ -464,6 +575,7 @@ class DocumentViewSet(AuditLoggingModelViewSet):
     ]
     ordering_fields = ["created_at", "updated_at"]
     ordering = ["-updated_at"]
+    keyset_ordering_fields = ("created_at", "updated_at")
     search_fields = ["metadata"]
     filterset_class = DocumentFilterSet
     queryset = Document.objects.none()
@@ -472,11 +584,25 @@ class DocumentViewSet(AuditLoggingModelViewSet):
         super().__init__(**kwargs)
         self.request_data_extra_fields = {}
 
+    # Actions whose responses can be limited with the fields and omit parameters
+    sparse_fieldset_actions = ("list", "retrieve", "batch_list")
+
+    def get_sparse_fieldset(self) -> Optional[set[str]]:
+        if self.action not in self.sparse_fieldset_actions:
+            return None
+        return DocumentSerializer.get_sparse_fieldset(
+            self.request.query_params.get("fields"),
+            self.request.query_params.get("omit"),
+        )
+
     def get_queryset(self):
         user = self.request.user
         service = get_service_from_request(self.request)
         service_api_key = get_service_api_key_from_request(self.request)
-        return get_document_queryset(user, service, service_api_key)
+        queryset = get_document_queryset(user, service, service_api_key)
+        if (fields := self.get_sparse_fieldset()) is not None:
+            queryset = get_sparse_document_queryset(queryset, fields)
+        return queryset
 
     @action(detail=False, methods=["POST"], url_path="batch-list")
     def batch_list(self, request, *args, **kwargs):
@@ -584,17 +710,9 @@ class DocumentViewSet(AuditLoggingModelViewSet):
 
         attachments = request.FILES.getlist("attachments", [])
 
-        for attached_file in attachments:
-            if is_staff and not staff_can_add_attachments:
-                raise PermissionDenied()
-            data = {
-                "document": document.id,
-                "file": attached_file,
-                "media_type": attached_file.content_type,
-            }
-            attachment_serializer = CreateAttachmentSerializer(data=data)
-            attachment_serializer.is_valid(raise_exception=True)
-            attachment_serializer.save()
+        if attachments and is_staff and not staff_can_add_attachments:
+            raise PermissionDenied()
+        create_document_attachments(document, attachments)
         # Update history only if status changed.
         request_data_status = request.data.get("status")
         if request_data_status and request_data_status != document.status:
@@ -622,6 +740,8 @@ class DocumentViewSet(AuditLoggingModelViewSet):
             data = kwargs["data"].copy()
             data.update(self.request_data_extra_fields)
             kwargs["data"] = data
+        if (fields := self.get_sparse_fieldset()) is not None:
+            kwargs["fields"] = fields
         return super().get_serializer(*args, **kwargs)
 
     def update(self, request, *args, **kwargs):
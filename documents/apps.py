@@ -9,3 +9,7 @@ class DocumentsConfig(AppConfig):
 
     def ready(self):
         import documents.signals  # noqa
+        from documents.keys import get_key_registry
+
+        # Parse the encryption keys once at startup
+        get_key_registry()
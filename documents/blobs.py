@@ -0,0 +1,98 @@
+"""Content-addressed storage for the files of attachments.
+
+With ATTACHMENT_DEDUPLICATION enabled, the files of new attachments are stored as
+blobs keyed by a keyed hash of their content, so identical files are encrypted and
+stored only once. An attachment references its blob and its file points to the
+file of the blob, so reading the attachment works the same way either way.
+
+Blobs count the attachments referencing them and are deleted with their file when
+the last one goes away.
+"""
+
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import AttachmentBlob
+from .utils import get_content_digest, get_upload_sha256
+
+
+def blob_digest(file) -> str:
+    """Get the digest of the content of an uploaded file.
+
+    The digest is derived from the SHA-256 of the upload handlers, so the file isn't
+    read again for it.
+    """
+    return get_content_digest(get_upload_sha256(file))
+
+
+def assign_blobs(attachments) -> list[AttachmentBlob]:
+    """Assign blobs to new attachments by the content of their uploaded files.
+
+    Attachments whose content is already stored get the existing blob, which is
+    locked until the end of the transaction so it isn't garbage collected meanwhile.
+    The others get a new unsaved blob holding the upload, shared by the attachments
+    with the same content. Returns the new blobs, whose files have to be stored.
+
+    :type attachments: list[documents.models.Attachment]
+    """
+    digests = [blob_digest(attachment.file.file) for attachment in attachments]
+    blobs = {
+        blob.digest: blob
+        for blob in AttachmentBlob.objects.select_for_update().filter(
+            digest__in=digests
+        )
+    }
+    new_blobs = []
+    for attachment, digest in zip(attachments, digests):
+        if digest not in blobs:
+            blobs[digest] = AttachmentBlob(
+                digest=digest, size=attachment.size, file=attachment.file.file
+            )
+            new_blobs.append(blobs[digest])
+        attachment.blob = blobs[digest]
+    return new_blobs
+
+
+def save_blobs(attachments, new_blobs):
+    """Save the new blobs and the references of the attachments to their blobs.
+
+    The files of the attachments are pointed to the files of the blobs. If another
+    upload has stored the same content meanwhile, its blob is used instead and the
+    file stored for the new blob, which has a name of its own, is deleted.
+
+    :type attachments: list[documents.models.Attachment]
+    """
+    for blob in new_blobs:
+        try:
+            with transaction.atomic():
+                blob.save()
+        except IntegrityError:
+            existing = AttachmentBlob.objects.select_for_update().get(
+                digest=blob.digest
+            )
+            # Never delete the file of the blob which was saved
+            if blob.file.name != existing.file.name:
+                blob.file.delete(save=False)
+            for attachment in attachments:
+                if attachment.blob is blob:
+                    attachment.blob = existing
+
+    references = Counter(attachment.blob.pk for attachment in attachments)
+    for pk, count in references.items():
+        AttachmentBlob.objects.filter(pk=pk).update(ref_count=F("ref_count") + count)
+    for attachment in attachments:
+        attachment.file = attachment.blob.file.name
+
+
+def release_blob(blob_id):
+    """Remove a reference to a blob and delete the blob if it was the last one."""
+    blob = AttachmentBlob.objects.select_for_update().filter(pk=blob_id).first()
+    if blob is None:
+        return
+    blob.ref_count -= 1
+    if blob.ref_count > 0:
+        blob.save(update_fields=["ref_count"])
+    else:
+        blob.delete()
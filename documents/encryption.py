@@ -0,0 +1,405 @@
+"""Segmented AES-GCM container format for encrypted attachment files and field values.
+
+A container consists of a header followed by the encrypted segments::
+
+    header: magic (6) | version (1) | flags (1) | key ID (4) | segment size (4)
+            | nonce prefix (7)
+    segment 0: cypher text (<= segment size) + tag (16)
+    segment 1: ...
+
+The key ID tells which of the configured keys the data was encrypted with, so the
+right key is found without trial decryption. Version 1 headers don't have the key
+ID, and the key of such data is found by trying the keys on the first segment.
+
+Every segment is encrypted separately with a nonce derived from the nonce prefix,
+the index of the segment and a flag telling whether the segment is the last one of
+the file. The header is authenticated as associated data of every segment, so
+segments cannot be reordered, dropped, truncated or moved between files without the
+decryption failing.
+
+If the compressed flag is set, the plaintext was compressed with zlib before it was
+split into segments. The segments then don't map to fixed plaintext offsets, so
+ranges of compressed data are decrypted and decompressed from the beginning.
+
+Documents and attachment blobs have their own random data keys, which are stored
+wrapped, i.e. encrypted in this same format, with the current master key. Rotating
+the master keys only requires rewrapping the data keys.
+
+Data written before the segmented format was introduced is a single AES-GCM blob
+(``nonce (16) | tag (16) | cypher text``). It's recognized by the lack of the magic
+bytes and can still be decrypted with :func:`decrypt_legacy`.
+"""
+
+import os
+import struct
+import zlib
+from io import BytesIO
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+from Crypto.Cipher import AES
+
+from .keys import EncryptionKey, KeyRegistry
+
+MAGIC = b"ATVENC"
+VERSION = 2
+
+HEADER_PREFIX_FORMAT = f"!{len(MAGIC)}sB"
+HEADER_PREFIX_SIZE = struct.calcsize(HEADER_PREFIX_FORMAT)
+HEADER_FORMATS = {
+    # flags, segment size, nonce prefix
+    1: "!BI7s",
+    # flags, key ID, segment size, nonce prefix
+    2: "!B4sI7s",
+}
+HEADER_MAX_SIZE = HEADER_PREFIX_SIZE + max(
+    struct.calcsize(header_format) for header_format in HEADER_FORMATS.values()
+)
+NONCE_PREFIX_SIZE = 7
+TAG_SIZE = 16
+
+FLAG_COMPRESSED = 0x01
+COMPRESSION_LEVEL = 6
+
+LEGACY_NONCE_SIZE = 16
+
+DATA_KEY_SIZE = 32
+
+
+class Header:
+    def __init__(
+        self,
+        segment_size: int,
+        nonce_prefix: bytes,
+        key_id: Optional[bytes] = None,
+        flags: int = 0,
+        version: int = VERSION,
+    ):
+        self.segment_size = segment_size
+        self.nonce_prefix = nonce_prefix
+        self.key_id = key_id
+        self.flags = flags
+        self.version = version
+
+    @property
+    def size(self) -> int:
+        return HEADER_PREFIX_SIZE + struct.calcsize(HEADER_FORMATS[self.version])
+
+    def to_bytes(self) -> bytes:
+        return struct.pack(
+            HEADER_PREFIX_FORMAT + HEADER_FORMATS[VERSION][1:],
+            MAGIC,
+            VERSION,
+            self.flags,
+            self.key_id,
+            self.segment_size,
+            self.nonce_prefix,
+        )
+
+    @classmethod
+    def read(cls, file: BinaryIO) -> tuple["Header", bytes]:
+        """Read the header from the beginning of a file.
+
+        Returns the parsed header and its raw bytes.
+        """
+        prefix = file.read(HEADER_PREFIX_SIZE)
+        if len(prefix) < HEADER_PREFIX_SIZE:
+            raise ValueError("Data is corrupted.")
+        magic, version = struct.unpack(HEADER_PREFIX_FORMAT, prefix)
+        if magic != MAGIC:
+            raise ValueError("Data is not in the segmented format.")
+        if version not in HEADER_FORMATS:
+            raise ValueError(f"Unsupported format version: {version}")
+
+        header_format = HEADER_FORMATS[version]
+        data = file.read(struct.calcsize(header_format))
+        if len(data) < struct.calcsize(header_format):
+            raise ValueError("Data is corrupted.")
+        if version == 1:
+            flags, segment_size, nonce_prefix = struct.unpack(header_format, data)
+            key_id = None
+        else:
+            flags, key_id, segment_size, nonce_prefix = struct.unpack(
+                header_format, data
+            )
+        if segment_size <= 0:
+            raise ValueError("Data is corrupted.")
+        return cls(segment_size, nonce_prefix, key_id, flags, version), prefix + data
+
+    def segment_nonce(self, index: int, final: bool) -> bytes:
+        return self.nonce_prefix + struct.pack("!IB", index, int(final))
+
+
+def is_segmented(data: bytes) -> bool:
+    """Sniff whether the given (beginning of) file is in the segmented format."""
+    return data[: len(MAGIC)] == MAGIC
+
+
+def get_key_id(data: bytes) -> Optional[bytes]:
+    """Get the ID of the key the data was encrypted with, if its header tells it."""
+    data = bytes(data)
+    if not is_segmented(data):
+        return None
+    header, _ = Header.read(BytesIO(data))
+    return header.key_id
+
+
+class CompressingReader:
+    """File-like object reading the zlib compressed content of another file."""
+
+    def __init__(self, file: BinaryIO, level: int = COMPRESSION_LEVEL):
+        self.file = file
+        self.compressor = zlib.compressobj(level)
+        self.buffer = b""
+        self.eof = False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            chunk = self.file.read(size if size > 0 else -1)
+            if chunk:
+                self.buffer += self.compressor.compress(chunk)
+            else:
+                self.buffer += self.compressor.flush()
+                self.eof = True
+        if size < 0:
+            data, self.buffer = self.buffer, b""
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def _decompress(segments: Iterator[bytes], max_size: int) -> Iterator[bytes]:
+    """Decompress the plaintext segments of compressed data, yielding at most
+    max_size bytes at a time."""
+    decompressor = zlib.decompressobj()
+    for segment in segments:
+        data = segment
+        while data:
+            if chunk := decompressor.decompress(data, max_size):
+                yield chunk
+            data = decompressor.unconsumed_tail
+    if not decompressor.eof:
+        raise ValueError("Data is corrupted.")
+
+
+def _segment_cipher(key: bytes, header: Header, header_bytes: bytes, index, final):
+    cipher = AES.new(key, AES.MODE_GCM, nonce=header.segment_nonce(index, final))
+    cipher.update(header_bytes)
+    return cipher
+
+
+def _decrypt_segment(key, header, header_bytes, index, final, segment) -> bytes:
+    if len(segment) < TAG_SIZE:
+        raise ValueError("Data is corrupted.")
+    cipher = _segment_cipher(key, header, header_bytes, index, final)
+    return cipher.decrypt_and_verify(segment[:-TAG_SIZE], segment[-TAG_SIZE:])
+
+
+def encrypt_stream(
+    file: BinaryIO, key: EncryptionKey, segment_size: int, compress: bool = False
+) -> Iterator[bytes]:
+    """Encrypt a file-like object segment by segment, optionally compressing it
+    first.
+
+    Yields the header and then one encrypted segment at a time, so at most two
+    plaintext segments are held in memory regardless of the size of the file.
+    """
+    header = Header(
+        segment_size,
+        AES.get_random_bytes(NONCE_PREFIX_SIZE),
+        key.key_id,
+        FLAG_COMPRESSED if compress else 0,
+    )
+    if compress:
+        file = CompressingReader(file)
+    header_bytes = header.to_bytes()
+    yield header_bytes
+
+    index = 0
+    segment = file.read(segment_size)
+    while True:
+        # Read ahead one segment to know whether the current one is the last one.
+        # An empty file produces a single empty final segment.
+        next_segment = file.read(segment_size)
+        final = not next_segment
+        cipher = _segment_cipher(key.key, header, header_bytes, index, final)
+        cypher_text, tag = cipher.encrypt_and_digest(segment)
+        yield cypher_text + tag
+        if final:
+            return
+        segment = next_segment
+        index += 1
+
+
+def encrypt_bytes(data: bytes, key: EncryptionKey, compress: bool = False) -> bytes:
+    """Encrypt a value held in memory as a single segment."""
+    if compress:
+        data = zlib.compress(data, COMPRESSION_LEVEL)
+        flags = FLAG_COMPRESSED
+    else:
+        flags = 0
+    header = Header(
+        max(len(data), 1), AES.get_random_bytes(NONCE_PREFIX_SIZE), key.key_id, flags
+    )
+    header_bytes = header.to_bytes()
+    cipher = _segment_cipher(key.key, header, header_bytes, 0, True)
+    cypher_text, tag = cipher.encrypt_and_digest(data)
+    return header_bytes + cypher_text + tag
+
+
+def _candidate_keys(header: Header, keys: KeyRegistry) -> Iterable[EncryptionKey]:
+    if header.key_id is None:
+        return keys
+    if key := keys.get(header.key_id):
+        return [key]
+    raise ValueError("Data is encrypted with an unknown key.")
+
+
+def _resolve_key(header, header_bytes, keys, index, final, segment):
+    """Find the key of the data by decrypting the first segment read from it.
+
+    Returns the key and the plaintext of the segment.
+    """
+    for key in _candidate_keys(header, keys):
+        try:
+            return key, _decrypt_segment(
+                key.key, header, header_bytes, index, final, segment
+            )
+        except ValueError:
+            continue
+    raise ValueError("AES Key incorrect or data is corrupted")
+
+
+def decrypt_stream(file: BinaryIO, keys: KeyRegistry) -> Iterator[bytes]:
+    """Decrypt and verify a segmented file, yielding one plaintext segment at a time.
+
+    Compressed data is decompressed on the fly.
+
+    Raises ValueError if the key is unknown or incorrect or the data has been
+    tampered with. Nothing is yielded from a segment before its tag has been
+    verified.
+    """
+    header, header_bytes = Header.read(file)
+    segments = _decrypt_segments(file, keys, header, header_bytes)
+    if header.flags & FLAG_COMPRESSED:
+        return _decompress(segments, header.segment_size)
+    return segments
+
+
+def _decrypt_segments(file, keys, header, header_bytes) -> Iterator[bytes]:
+    encrypted_segment_size = header.segment_size + TAG_SIZE
+
+    segment = file.read(encrypted_segment_size)
+    next_segment = file.read(encrypted_segment_size)
+    final = not next_segment
+    key, plaintext = _resolve_key(header, header_bytes, keys, 0, final, segment)
+    yield plaintext
+
+    index = 1
+    while not final:
+        segment = next_segment
+        next_segment = file.read(encrypted_segment_size)
+        final = not next_segment
+        yield _decrypt_segment(key.key, header, header_bytes, index, final, segment)
+        index += 1
+
+
+def decrypt_range(
+    file: BinaryIO, keys: KeyRegistry, start: int, end: int
+) -> Iterator[bytes]:
+    """Decrypt the plaintext bytes from start up to but not including end from a
+    seekable segmented file.
+
+    Only the segments covering the range are read and decrypted. The index of the
+    last segment is calculated from the size of the file, so a truncated file still
+    fails to decrypt.
+
+    Compressed data is decrypted and decompressed from the beginning, because its
+    segments don't map to fixed plaintext offsets.
+    """
+    header, header_bytes = Header.read(file)
+    if header.flags & FLAG_COMPRESSED:
+        file.seek(0)
+        yield from _slice_stream(decrypt_stream(file, keys), start, end)
+        return
+
+    encrypted_segment_size = header.segment_size + TAG_SIZE
+    file.seek(0, os.SEEK_END)
+    body_size = file.tell() - header.size
+    last_index = max(0, -(-body_size // encrypted_segment_size) - 1)
+
+    first_index = start // header.segment_size
+    end_index = min((end - 1) // header.segment_size, last_index)
+    if start >= end or first_index > end_index:
+        return
+
+    file.seek(header.size + first_index * encrypted_segment_size)
+    key = None
+    for index in range(first_index, end_index + 1):
+        segment = file.read(encrypted_segment_size)
+        final = index == last_index
+        if key is None:
+            key, plaintext = _resolve_key(
+                header, header_bytes, keys, index, final, segment
+            )
+        else:
+            plaintext = _decrypt_segment(
+                key.key, header, header_bytes, index, final, segment
+            )
+        offset = index * header.segment_size
+        yield plaintext[max(start - offset, 0) : end - offset]
+
+
+def _slice_stream(chunks: Iterator[bytes], start: int, end: int) -> Iterator[bytes]:
+    offset = 0
+    for chunk in chunks:
+        if offset >= end:
+            return
+        if offset + len(chunk) > start:
+            yield chunk[max(start - offset, 0) : end - offset]
+        offset += len(chunk)
+
+
+def decrypt_segmented(data: bytes, keys: KeyRegistry) -> bytes:
+    """Decrypt a whole segmented file or value held in memory."""
+    return b"".join(decrypt_stream(BytesIO(data), keys))
+
+
+def decrypt_legacy(data: bytes, keys: KeyRegistry) -> bytes:
+    """Decrypt data encrypted as a single AES-GCM blob by trying all the keys."""
+    nonce = data[:LEGACY_NONCE_SIZE]
+    # Perform same nonce checks here as Pycryptodome, so we can raise a more
+    # user-friendly error message
+    if len(nonce) != LEGACY_NONCE_SIZE:
+        raise ValueError("Data is corrupted.")
+    tag = data[LEGACY_NONCE_SIZE : LEGACY_NONCE_SIZE + TAG_SIZE]
+    cypher_text = data[LEGACY_NONCE_SIZE + TAG_SIZE :]
+    for key in keys:
+        cipher = AES.new(key.key, AES.MODE_GCM, nonce=nonce)
+        try:
+            return cipher.decrypt_and_verify(cypher_text, tag)
+        except ValueError:
+            continue
+    raise ValueError("AES Key incorrect or data is corrupted")
+
+
+def decrypt_bytes(data: bytes, keys: KeyRegistry) -> bytes:
+    """Decrypt a file or value held in memory in either the segmented or the legacy
+    format."""
+    data = bytes(data)
+    if is_segmented(data):
+        return decrypt_segmented(data, keys)
+    return decrypt_legacy(data, keys)
+
+
+def generate_data_key() -> EncryptionKey:
+    return EncryptionKey(AES.get_random_bytes(DATA_KEY_SIZE))
+
+
+def wrap_data_key(data_key: EncryptionKey, master_key: EncryptionKey) -> bytes:
+    """Encrypt a data key with a master key for storing it."""
+    return encrypt_bytes(data_key.key, master_key)
+
+
+def unwrap_data_key(wrapped_key: bytes, keys: KeyRegistry) -> EncryptionKey:
+    """Decrypt a data key wrapped with one of the master keys."""
+    return EncryptionKey(decrypt_bytes(wrapped_key, keys))
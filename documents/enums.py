@@ -0,0 +1,14 @@
+from django.db.models import TextChoices
+from django.utils.translation import gettext_lazy as _
+
+
+class ScanStatus(TextChoices):
+    PENDING = "pending", _("Pending")
+    CLEAN = "clean", _("Clean")
+    INFECTED = "infected", _("Infected")
+    FAILED = "failed", _("Failed")
+
+
+class LookforMode(TextChoices):
+    IEXACT = "iexact", _("Case-insensitive")
+    EXACT = "exact", _("Exact")
@@ -1,19 +1,96 @@
-import json
-from io import BytesIO
+from io import UnsupportedOperation
+from typing import Optional
 
-from Crypto.Cipher import AES
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import storages
+from django.core.signals import setting_changed
 from django.db import models
+from django.db.models.fields.files import FieldFile
+from django.db.models.query_utils import DeferredAttribute
+from django.dispatch import receiver
+from django.utils.functional import LazyObject, empty
 from encrypted_fields.fields import EncryptedFieldMixin
 
-from atv.settings import FIELD_ENCRYPTION_KEYS
+from utils import json
+from utils.files import is_compressible
+
+from .encryption import decrypt_bytes, encrypt_bytes, encrypt_stream, get_key_id
+from .keys import EncryptionKey, KeyRegistry, get_key_registry
+
+
+class EncryptedValue(bytes):
+    """An encrypted value read from the database which hasn't been decrypted yet,
+    because the keys depend on the instance it belongs to."""
+
+
+class DecryptingAttribute(DeferredAttribute):
+    """Decrypts the value of an EncryptedJSONField the first time it's accessed, so
+    instances which are only loaded for e.g. a permission check never pay for it."""
+
+    def __get__(self, instance, cls=None):
+        value = super().__get__(instance, cls)
+        if isinstance(value, EncryptedValue):
+            keys = getattr(instance, "decryption_keys", None)
+            value = self.field.decrypt(value, keys)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        # Defining __set__ makes this a data descriptor, so __get__ is called even
+        # when the value is in the instance's __dict__
+        instance.__dict__[self.field.attname] = value
 
 
 class EncryptedJSONField(EncryptedFieldMixin, models.JSONField):
-    def decrypt(self, value):
-        text = super().decrypt(value)
-        return json.loads(text)
+    """JSON field encrypted with the keys of the model instance, see
+    :class:`documents.models.DataKeyModel`.
+
+    Values encrypted with a data key are kept encrypted when the instance is loaded
+    and decrypted when the field is accessed for the first time. They also stay
+    encrypted in e.g. ``QuerySet.values()``. Values saved without an instance, e.g.
+    with ``QuerySet.update()``, are encrypted with the current master key and
+    decrypted when they're read.
+    """
+
+    descriptor_class = DecryptingAttribute
+
+    def encrypt(self, data_to_encrypt: bytes, key: Optional[EncryptionKey] = None):
+        key = key or get_key_registry().current
+        data = data_to_encrypt
+        # Small values would only grow when compressed
+        compress = (
+            settings.ENCRYPTION_COMPRESSION
+            and len(data) >= settings.ENCRYPTION_COMPRESSION_MIN_SIZE
+        )
+        return encrypt_bytes(data, key, compress)
+
+    def decrypt(self, value, keys: Optional[KeyRegistry] = None):
+        return json.loads(decrypt_bytes(value, keys or get_key_registry()))
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        # Values encrypted with a data key are left for the model to decrypt
+        key_id = get_key_id(value)
+        keys = get_key_registry()
+        if key_id is None or keys.get(key_id):
+            return self.decrypt(value, keys)
+        return EncryptedValue(value)
+
+    def pre_save(self, model_instance, add):
+        value = model_instance.__dict__.get(self.attname)
+        if isinstance(value, EncryptedValue):
+            # Not accessed since it was loaded, so it's saved as it is
+            return value
+        value = super().pre_save(model_instance, add)
+        return EncryptedValue(
+            self.encrypt(json.dumps(value), model_instance.encryption_keys.current)
+        )
 
     def get_db_prep_save(self, value, connection):
+        if isinstance(value, EncryptedValue):
+            return connection.Database.Binary(value)
         if self.empty_strings_allowed and value == bytes():
             value = ""
         # Instead of using db_prep_value use json.dumps() to get a json formatted object
@@ -23,18 +100,118 @@ class EncryptedJSONField(EncryptedFieldMixin, models.JSONField):
             return connection.Database.Binary(encrypted_value)
 
 
+class EncryptedFile(File):
+    """File which is encrypted in the segmented format while it's being read in
+    chunks, e.g. when it's written to the storage.
+
+    Only one segment of the underlying file is encrypted at a time, so the memory
+    usage stays bounded regardless of the size of the file.
+    """
+
+    def __init__(self, file, key: EncryptionKey, name=None, compress=False):
+        super().__init__(file, name)
+        self.key = key
+        self.compress = compress
+
+    def chunks(self, chunk_size=None):
+        try:
+            self.seek(0)
+        except (AttributeError, UnsupportedOperation):
+            pass
+        yield from encrypt_stream(
+            self.file,
+            self.key,
+            settings.ATTACHMENT_ENCRYPTION_SEGMENT_SIZE,
+            self.compress,
+        )
+
+    def multiple_chunks(self, chunk_size=None):
+        return True
+
+
+def should_compress_file(file, media_type: str = "") -> bool:
+    """Check whether an uploaded file should be compressed before it's encrypted.
+
+    Files of media types which are already compressed, e.g. images, are not.
+    """
+    if not settings.ENCRYPTION_COMPRESSION:
+        return False
+    return is_compressible(getattr(file, "content_type", None) or media_type)
+
+
+class AttachmentStorage(LazyObject):
+    """The storage of the attachment files, configured with STORAGES["attachments"]."""
+
+    def _setup(self):
+        self._wrapped = storages["attachments"]
+
+
+attachment_storage = AttachmentStorage()
+
+
+@receiver(setting_changed)
+def reset_attachment_storage(setting, **kwargs):
+    if setting == "STORAGES":
+        attachment_storage._wrapped = empty
+
+
+class EncryptedFieldFile(FieldFile):
+    def open(self, mode="rb"):
+        try:
+            return super().open(mode)
+        except FileNotFoundError:
+            # The file may have been moved after the instance was loaded, e.g. by
+            # move_attachment_files or the key rotation, so retry with the name
+            # currently in the database
+            if not self._refresh_name():
+                raise
+            self._file = None
+            return super().open(mode)
+
+    def _refresh_name(self) -> bool:
+        if self.instance.pk is None:
+            return False
+        name = (
+            type(self.instance)
+            ._base_manager.filter(pk=self.instance.pk)
+            .values_list(self.field.attname, flat=True)
+            .first()
+        )
+        if not name or name == self.name:
+            return False
+        self.name = name
+        return True
+
+
 class EncryptedFileField(models.FileField):
+    attr_class = EncryptedFieldFile
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("storage", attachment_storage)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        # The storage is a setting, not a part of the schema
+        if kwargs.get("storage") is attachment_storage:
+            del kwargs["storage"]
+        return name, path, args, kwargs
+
     def pre_save(self, model_instance, add):
         file = getattr(model_instance, self.attname)
         if file and not file._committed:
             # Commit the file to storage prior to saving the model
-            file.save(file.name, self.encrypt_file(file.file), save=False)
+            key = model_instance.encryption_keys.current
+            compress = should_compress_file(
+                file.file, getattr(model_instance, "media_type", "")
+            )
+            file.save(
+                file.name, self.encrypt_file(file.file, key, compress), save=False
+            )
         return file
 
     @staticmethod
-    def encrypt_file(file):
-        data_to_encrypt = file.read()
-        cipher = AES.new(bytes.fromhex(FIELD_ENCRYPTION_KEYS[0]), AES.MODE_GCM)
-        nonce = cipher.nonce
-        cypher_text, tag = cipher.encrypt_and_digest(data_to_encrypt)
-        return BytesIO(nonce + tag + cypher_text)
+    def encrypt_file(file, key: EncryptionKey, compress: bool = False):
+        return EncryptedFile(
+            file, key, name=getattr(file, "name", None), compress=compress
+        )
@@ -0,0 +1,52 @@
+"""Moving the files of attachments from the legacy layout, where every document has
+a directory directly under ATTACHMENT_MEDIA_DIR, to the hashed fan-out layout
+ATTACHMENT_MEDIA_DIR/<ab>/<cd>/<document_id>/.
+
+The encrypted files are copied as they are. The old file is deleted once the new
+name has been committed, and readers which loaded the old name reopen the file with
+the new one, so the files can be moved while the API is in use.
+"""
+
+import posixpath
+import re
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Attachment
+from .utils import get_attachment_file_path
+
+
+def get_legacy_layout_attachments():
+    """Attachments whose files are still in the legacy directories. The files of
+    deduplicated attachments belong to their blobs, which are stored elsewhere."""
+    root_dir = re.escape(settings.ATTACHMENT_MEDIA_DIR)
+    return Attachment.objects.filter(
+        blob=None, file__regex=rf"^{root_dir}/[^/]+/[^/]+$"
+    )
+
+
+def move_attachment_file(pk) -> bool:
+    """Move the file of an attachment to the hashed layout. Returns whether the file
+    was moved."""
+    with transaction.atomic():
+        attachment = (
+            get_legacy_layout_attachments()
+            .select_for_update(of=("self",))
+            .select_related("document")
+            .filter(pk=pk)
+            .first()
+        )
+        if attachment is None:
+            return False
+
+        storage = attachment.file.storage
+        old_name = attachment.file.name
+        with storage.open(old_name, "rb") as f:
+            new_name = storage.save(
+                get_attachment_file_path(attachment, posixpath.basename(old_name)), f
+            )
+        Attachment.objects.filter(pk=pk).update(file=new_name)
+        transaction.on_commit(partial(storage.delete, old_name))
+    return True
@@ -0,0 +1,91 @@
+"""Moving the encrypted data onto the current master key, FIELD_ENCRYPTION_KEYS[0].
+
+The data of documents and attachment blobs is encrypted with their data keys, so in
+most cases only the wrapped data key is rewritten. Data which is still encrypted
+directly with a master key, i.e. written before the data keys were introduced or
+with ``QuerySet.update()``, is re-encrypted with the data key of its instance.
+
+Every row is rotated in a transaction of its own holding a lock on the row only, so
+the rotation can run while the API is in use.
+"""
+
+from django.db import models, transaction
+from django.db.models.functions import Cast
+
+from .encryption import get_key_id, unwrap_data_key, wrap_data_key
+from .keys import get_key_registry
+from .models import Attachment, AttachmentBlob, DataKeyModel, Document
+from .utils import read_file_header, reencrypt_file
+
+
+def _rotate_data_key(instance: DataKeyModel) -> bool:
+    """Wrap the data key of an instance with the current master key, or create the
+    data key if the instance doesn't have one yet."""
+    if instance.data_key is None:
+        instance.encryption_keys  # noqa: B018
+        return True
+
+    keys = get_key_registry()
+    if get_key_id(instance.data_key) == keys.current.key_id:
+        return False
+    wrapped_key = wrap_data_key(unwrap_data_key(instance.data_key, keys), keys.current)
+    type(instance).objects.filter(pk=instance.pk).update(data_key=wrapped_key)
+    instance.data_key = wrapped_key
+    return True
+
+
+def _rotate_file(field_file, *querysets) -> bool:
+    """Re-encrypt a stored file with the data key of its instance unless it's
+    already encrypted with it, and point the rows of the querysets to the new file."""
+    header = read_file_header(field_file)
+    key_id = header.key_id if header else None
+    if key_id == field_file.instance.encryption_keys.current.key_id:
+        return False
+    old_name = field_file.name
+    reencrypt_file(field_file)
+    for queryset in querysets:
+        queryset.filter(file=old_name).update(file=field_file.name)
+    return True
+
+
+def rotate_document(pk) -> bool:
+    """Rotate the keys of a document, its content and the files of its attachments
+    which aren't deduplicated. Returns whether anything was rewritten."""
+    with transaction.atomic():
+        document = (
+            Document.objects.select_for_update()
+            .annotate(encrypted_content=Cast("content", models.BinaryField()))
+            .filter(pk=pk)
+            .first()
+        )
+        if document is None:
+            return False
+
+        rotated = _rotate_data_key(document)
+        content_key_id = get_key_id(document.encrypted_content)
+        if content_key_id != document.encryption_keys.current.key_id:
+            document.save(update_fields=["content"])
+            rotated = True
+
+        for attachment in document.attachments.filter(blob=None):
+            attachment.document = document
+            rotated |= _rotate_file(
+                attachment.file, Attachment.objects.filter(pk=attachment.pk)
+            )
+    return rotated
+
+
+def rotate_blob(pk) -> bool:
+    """Rotate the keys of an attachment blob and its file. Returns whether anything
+    was rewritten."""
+    with transaction.atomic():
+        blob = AttachmentBlob.objects.select_for_update().filter(pk=pk).first()
+        if blob is None:
+            return False
+        rotated = _rotate_data_key(blob)
+        rotated |= _rotate_file(
+            blob.file,
+            AttachmentBlob.objects.filter(pk=pk),
+            Attachment.objects.filter(blob=blob),
+        )
+    return rotated
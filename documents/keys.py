@@ -0,0 +1,80 @@
+import copy
+import hashlib
+from functools import lru_cache
+from typing import Iterator, Optional
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+KEY_ID_SIZE = 4
+
+
+class EncryptionKey:
+    """An AES key and the short identifier which is stored in the headers of the
+    data encrypted with it."""
+
+    def __init__(self, key: bytes):
+        self.key = key
+        self.key_id = hashlib.sha256(b"atv-key-id:" + key).digest()[:KEY_ID_SIZE]
+
+    def __repr__(self):
+        return f"EncryptionKey({self.key_id.hex()})"
+
+
+class KeyRegistry:
+    """The configured encryption keys parsed once and indexed by their IDs.
+
+    The first key is the current one, which is used for encrypting. All the keys
+    are used for decrypting.
+    """
+
+    def __init__(self, hex_keys):
+        self._set_keys([EncryptionKey(bytes.fromhex(hex_key)) for hex_key in hex_keys])
+        if len(self.keys_by_id) != len(self.keys):
+            raise ImproperlyConfigured(
+                "FIELD_ENCRYPTION_KEYS contains duplicate keys or key IDs."
+            )
+
+    def _set_keys(self, keys: list[EncryptionKey]):
+        self.keys = keys
+        self.keys_by_id = {key.key_id: key for key in keys}
+
+    def with_key(self, key: EncryptionKey) -> "KeyRegistry":
+        """Get a registry where the given key, e.g. a data key, is the current one.
+
+        The keys of this registry are still available for decrypting data encrypted
+        before the key was taken into use.
+        """
+        registry = copy.copy(self)
+        registry._set_keys(
+            [key, *(other for other in self.keys if other.key_id != key.key_id)]
+        )
+        return registry
+
+    def __iter__(self) -> Iterator[EncryptionKey]:
+        return iter(self.keys)
+
+    @property
+    def current(self) -> EncryptionKey:
+        if not self.keys:
+            raise ImproperlyConfigured("FIELD_ENCRYPTION_KEYS is empty.")
+        return self.keys[0]
+
+    def get(self, key_id: bytes) -> Optional[EncryptionKey]:
+        return self.keys_by_id.get(key_id)
+
+
+@lru_cache(maxsize=1)
+def _build_key_registry(hex_keys: tuple) -> KeyRegistry:
+    return KeyRegistry(hex_keys)
+
+
+def get_key_registry() -> KeyRegistry:
+    """Get the registry of the keys in settings.FIELD_ENCRYPTION_KEYS.
+
+    The keys are only parsed again if the setting changes.
+    """
+    hex_keys = settings.FIELD_ENCRYPTION_KEYS
+    if not isinstance(hex_keys, (list, tuple)):
+        raise ImproperlyConfigured("FIELD_ENCRYPTION_KEYS should be a list.")
+    return _build_key_registry(tuple(hex_keys))
@@ -0,0 +1,77 @@
+import json
+import time
+
+from documents.encryption import decrypt_bytes, encrypt_bytes
+from documents.keys import get_key_registry
+from documents.models import Document
+from utils.commands import BaseCommand
+
+
+def generate_payload(size: int) -> bytes:
+    """Generate a form-like JSON payload truncated to the given size."""
+    answers = [
+        {"question": f"question_{i % 50}", "answer": f"Answer {i}", "valid": True}
+        for i in range(size // 40 + 1)
+    ]
+    return json.dumps({"answers": answers}).encode()[:size]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the storage saved by compressing document content before"
+        " encrypting it and the CPU time it costs"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="1024,16384,262144,1048576",
+            help="Comma separated sizes in bytes of the generated payloads",
+        )
+        parser.add_argument(
+            "--documents",
+            type=int,
+            default=0,
+            help="Also measure the content of this many of the latest documents",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Number of times each payload is encrypted and decrypted",
+        )
+
+    def measure(self, data: bytes, repeat: int, compress: bool) -> tuple[int, float]:
+        """Encrypt and decrypt the data. Returns the size of the encrypted data and
+        the average time of a round trip."""
+        keys = get_key_registry()
+        # Warm up, so the first measurement isn't skewed
+        decrypt_bytes(encrypt_bytes(data, keys.current, compress), keys)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            encrypted = encrypt_bytes(data, keys.current, compress)
+            decrypt_bytes(encrypted, keys)
+        return len(encrypted), (time.perf_counter() - started) / repeat
+
+    def report(self, name: str, data: bytes, repeat: int):
+        size, duration = self.measure(data, repeat, compress=False)
+        compressed_size, compressed_duration = self.measure(data, repeat, True)
+        self.logger.info(
+            f"{name}: {len(data)} bytes, encrypted {size} bytes in"
+            f" {duration * 1000:.2f} ms, compressed and encrypted {compressed_size}"
+            f" bytes ({1 - compressed_size / size:.0%} saved) in"
+            f" {compressed_duration * 1000:.2f} ms"
+            f" ({(compressed_duration - duration) * 1000:+.2f} ms)"
+        )
+
+    def handle(
+        self, sizes: str, documents: int, repeat: int, verbosity=0, *args, **kwargs
+    ):
+        self.setup_logging(verbosity)
+
+        for size in map(int, sizes.split(",")):
+            self.report("Generated payload", generate_payload(size), repeat)
+
+        for document in Document.objects.order_by("-created_at")[:documents]:
+            content = json.dumps(document.content).encode()
+            self.report(f"Document {document.pk}", content, repeat)
@@ -0,0 +1,58 @@
+import time
+
+from documents.file_layout import get_legacy_layout_attachments, move_attachment_file
+from utils.batches import iter_batches, process_batch
+from utils.commands import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the attachment files from the legacy per-document directories to the"
+        " hashed fan-out directories"
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of files looked up at a time",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of files moved concurrently",
+        )
+
+    def handle(
+        self,
+        batch_size: int,
+        workers: int,
+        dry_run: bool = False,
+        verbosity: int = 0,
+        *args,
+        **kwargs,
+    ):
+        self.setup_logging(verbosity)
+        queryset = get_legacy_layout_attachments()
+
+        if dry_run:
+            self.logger.info(f"Files to be moved: {queryset.count()}")
+            return
+
+        started = time.monotonic()
+        moved = failed = 0
+        for batch in iter_batches(queryset, batch_size):
+            results = process_batch(move_attachment_file, batch, workers)
+            moved += results.count(True)
+            failed += results.count(None)
+            elapsed = time.monotonic() - started
+            self.logger.debug(
+                f"Moved {moved} files, {moved / elapsed:.1f} files/s,"
+                f" last attachment {batch[-1]}"
+            )
+
+        elapsed = time.monotonic() - started
+        self.logger.info(f"Files moved: {moved}, failed: {failed} in {elapsed:.1f} s")
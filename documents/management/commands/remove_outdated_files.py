@@ -1,15 +1,33 @@
-import os
+import posixpath
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import chain, islice
+from typing import Iterator
 
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 
-from documents.models import Document
-from documents.utils import get_document_attachment_directory_path
+from documents.fields import attachment_storage
+from documents.models import Attachment, AttachmentBlob, Document
 from utils.commands import BaseCommand
-from utils.files import remove_directory, remove_file
+from utils.files import remove_storage_directory, remove_stored_file
+from utils.uuid import is_valid_uuid
+
+
+def batched(iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
 
 
 class Command(BaseCommand):
-    help = "Remove outdated files"
+    help = (
+        "Remove the attachment files and directories which don't belong to an"
+        " attachment or a document anymore, and the blobs without attachments and"
+        " the blob files which don't belong to a blob"
+    )
 
     directories_to_delete = 0
     files_to_delete = 0
@@ -17,54 +35,256 @@ class Command(BaseCommand):
     directories_deleted = 0
     files_deleted = 0
 
-    def remove_document_outdated_files(self, document: Document, path, dry_run):
-        """For a given document, remove the files that don't have an associated
-        Attachment"""
-        document_path = get_document_attachment_directory_path(document)
-
-        for filename in os.listdir(path):
-            # For each file on the Document directory, check if the instance
-            # still has the related Attachment.
-            # If there's no attachment, the file will be removed
-            if not document.attachments.filter(
-                file=os.path.join(document_path, filename)
-            ).exists():
-                if dry_run:
-                    self.files_to_delete += 1
+    blobs_to_delete = 0
+    blobs_deleted = 0
+
+    directories_scanned = 0
+    files_scanned = 0
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--older-than",
+            type=int,
+            default=0,
+            help="Grace period in minutes: files modified more recently are kept, as"
+            " they may belong to uploads which haven't been committed yet",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of document directories checked against the database with"
+            " one query",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="Number of directories listed or removed concurrently",
+        )
+
+    def list_document_directories(self, path: str) -> list[tuple[str, str]]:
+        """List the IDs and the paths of the documents' directories in a directory
+        of the first level of the hashed layout."""
+        directories = []
+        for subdirectory in self.storage.listdir(path)[0]:
+            subpath = posixpath.join(path, subdirectory)
+            for document_id in self.storage.listdir(subpath)[0]:
+                document_path = posixpath.join(subpath, document_id)
+                if is_valid_uuid(document_id):
+                    directories.append((document_id, document_path))
                 else:
-                    file_path = os.path.join(path, filename)
-                    remove_file(file_path)
-                    self.files_deleted += 1
-                    self.logger.debug(f"File removed: {file_path}")
-
-    def remove_outdated_document_directories(self, root_dir, dry_run):
-        for document_id in os.listdir(root_dir):
-            document_path = os.path.join(root_dir, document_id)
-
-            if document := Document.objects.filter(id=document_id).first():
-                self.logger.debug(f"Document {document_id} exists")
-                self.remove_document_outdated_files(document, document_path, dry_run)
-            elif dry_run:
-                self.directories_to_delete += 1
+                    self.logger.warning(f"Unknown directory {document_path}")
+        return directories
+
+    def iter_document_directories(self, root_dir, names) -> Iterator[tuple[str, str]]:
+        """Iterate the IDs and the paths of the documents' directories. They're
+        either spread to two levels of hashed directories, which are listed in
+        parallel, or directly in the root directory if they haven't been moved by
+        move_attachment_files yet."""
+        fan_out_directories = []
+        for name in names:
+            path = posixpath.join(root_dir, name)
+            if is_valid_uuid(name):
+                yield name, path
+            elif len(name) == 2:
+                fan_out_directories.append(path)
             else:
-                # If the document does not exist anymore, remove the whole directory
-                remove_directory(document_path)
-                self.directories_deleted += 1
-                self.logger.debug(f"Directory removed: {document_path}")
+                self.logger.warning(f"Unknown directory {path}")
+        yield from chain.from_iterable(
+            self.executor.map(self.list_document_directories, fan_out_directories)
+        )
 
-    def handle(self, dry_run: bool = False, verbosity: int = 0, *args, **kwargs):
-        self.setup_logging(verbosity)
+    def is_outdated(self, path: str, is_directory: bool = False) -> bool:
+        """Check whether a file, or every file in a directory, was modified before
+        the grace period."""
+        if self.cutoff is None:
+            return True
+        if not is_directory:
+            return self.storage.get_modified_time(path) < self.cutoff
+        _, filenames = self.storage.listdir(path)
+        if not filenames:
+            try:
+                return self.storage.get_modified_time(path) < self.cutoff
+            except (FileNotFoundError, NotImplementedError):
+                return True
+        return all(
+            self.is_outdated(posixpath.join(path, filename)) for filename in filenames
+        )
+
+    def list_files(self, path: str) -> list[str]:
+        return [posixpath.join(path, name) for name in self.storage.listdir(path)[1]]
+
+    def find_orphans(self, directories: list[tuple[str, str]]):
+        """Find the directories of missing documents and the files without an
+        attachment in a batch of documents' directories with a query each."""
+        existing_ids = {
+            str(pk)
+            for pk in Document.objects.filter(
+                id__in=[document_id for document_id, _ in directories]
+            ).values_list("id", flat=True)
+        }
+        orphan_directories = [
+            path for document_id, path in directories if document_id not in existing_ids
+        ]
+        existing_directories = [
+            path for document_id, path in directories if document_id in existing_ids
+        ]
+
+        files = set(
+            chain.from_iterable(
+                self.executor.map(self.list_files, existing_directories)
+            )
+        )
+        known_files = set(
+            Attachment.objects.filter(document_id__in=existing_ids).values_list(
+                "file", flat=True
+            )
+        )
+        self.files_scanned += len(files)
+        return orphan_directories, sorted(files - known_files)
 
-        root_dir = os.path.join(settings.MEDIA_ROOT, settings.ATTACHMENT_MEDIA_DIR)
+    def remove_directory(self, path: str) -> bool:
+        if not self.is_outdated(path, is_directory=True):
+            return False
+        if not self.dry_run:
+            remove_storage_directory(self.storage, path)
+            self.logger.debug(f"Directory removed: {path}")
+        return True
 
-        if os.path.exists(root_dir):
-            self.remove_outdated_document_directories(root_dir, dry_run)
+    def remove_file(self, path: str) -> bool:
+        if not self.is_outdated(path):
+            return False
+        if not self.dry_run:
+            remove_stored_file(self.storage, path)
+            self.logger.debug(f"File removed: {path}")
+        return True
+
+    def remove_orphans(self, directories: list[tuple[str, str]]):
+        orphan_directories, orphan_files = self.find_orphans(directories)
+        removed_directories = sum(
+            self.executor.map(self.remove_directory, orphan_directories)
+        )
+        removed_files = sum(self.executor.map(self.remove_file, orphan_files))
+        if self.dry_run:
+            self.directories_to_delete += removed_directories
+            self.files_to_delete += removed_files
         else:
+            self.directories_deleted += removed_directories
+            self.files_deleted += removed_files
+
+    def remove_blob(self, pk) -> bool:
+        with transaction.atomic():
+            # The blob may have been referenced again meanwhile
+            blob = (
+                AttachmentBlob.objects.select_for_update(of=("self",))
+                .filter(pk=pk, ref_count=0, attachments__isnull=True)
+                .first()
+            )
+            if blob is None:
+                return False
+            if not self.dry_run:
+                # The file is removed by the signal once the deletion is committed
+                blob.delete()
+                self.logger.debug(f"Blob removed: {blob.digest}")
+        return True
+
+    def remove_orphan_blobs(self):
+        """Remove the blobs which no attachment references, e.g. because releasing
+        them was interrupted."""
+        blobs = AttachmentBlob.objects.filter(ref_count=0, attachments__isnull=True)
+        if self.cutoff is not None:
+            blobs = blobs.filter(updated_at__lt=self.cutoff)
+        removed = sum(self.remove_blob(pk) for pk in blobs.values_list("pk", flat=True))
+        if self.dry_run:
+            self.blobs_to_delete += removed
+        else:
+            self.blobs_deleted += removed
+
+    def remove_orphan_blob_files(self, batch_size: int):
+        """Remove the files in the blob directory which don't belong to a blob, e.g.
+        the files stored for uploads which failed before their blob was saved."""
+        root_dir = settings.ATTACHMENT_BLOB_MEDIA_DIR
+        try:
+            directories, _ = self.storage.listdir(root_dir)
+        except FileNotFoundError:
+            return
+        paths = chain.from_iterable(
+            self.executor.map(
+                self.list_files,
+                [posixpath.join(root_dir, directory) for directory in directories],
+            )
+        )
+        for batch in batched(paths, batch_size):
+            known_files = set(
+                AttachmentBlob.objects.filter(file__in=batch).values_list(
+                    "file", flat=True
+                )
+            )
+            removed = sum(
+                self.executor.map(
+                    self.remove_file, [p for p in batch if p not in known_files]
+                )
+            )
+            self.files_scanned += len(batch)
+            if self.dry_run:
+                self.files_to_delete += removed
+            else:
+                self.files_deleted += removed
+
+    def handle(
+        self,
+        older_than: int = 0,
+        batch_size: int = 1000,
+        workers: int = 8,
+        dry_run: bool = False,
+        verbosity: int = 0,
+        *args,
+        **kwargs,
+    ):
+        self.setup_logging(verbosity)
+        self.storage = attachment_storage
+        self.dry_run = dry_run
+        self.cutoff = (
+            timezone.now() - timedelta(minutes=older_than) if older_than else None
+        )
+        root_dir = settings.ATTACHMENT_MEDIA_DIR
+        started = time.monotonic()
+
+        try:
+            names, _ = self.storage.listdir(root_dir)
+        except FileNotFoundError:
             self.logger.info(f"Directory {root_dir} does not exist!")
+            names = []
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as self.executor:
+            for batch in batched(
+                self.iter_document_directories(root_dir, names), batch_size
+            ):
+                self.remove_orphans(batch)
+                self.directories_scanned += len(batch)
+                elapsed = time.monotonic() - started
+                self.logger.debug(
+                    f"Scanned {self.directories_scanned} directories and"
+                    f" {self.files_scanned} files,"
+                    f" {self.directories_scanned / elapsed:.1f} directories/s"
+                )
+            self.remove_orphan_blobs()
+            self.remove_orphan_blob_files(batch_size)
 
+        elapsed = time.monotonic() - started
+        self.logger.info(
+            f"Scanned {self.directories_scanned} directories and"
+            f" {self.files_scanned} files in {elapsed:.1f} s"
+        )
+        if older_than:
+            self.logger.info(f"Kept files modified in the last {older_than} minutes")
         if dry_run:
             self.logger.info(f"Directories to be removed: {self.directories_to_delete}")
             self.logger.info(f"Files to be removed: {self.files_to_delete}")
+            self.logger.info(f"Blobs to be removed: {self.blobs_to_delete}")
         else:
             self.logger.info(f"Directories removed: {self.directories_deleted}")
             self.logger.info(f"Files removed: {self.files_deleted}")
+            self.logger.info(f"Blobs removed: {self.blobs_deleted}")
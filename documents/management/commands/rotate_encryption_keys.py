@@ -0,0 +1,127 @@
+import json
+import os
+import time
+from itertools import chain
+
+from documents.key_rotation import rotate_blob, rotate_document
+from documents.models import AttachmentBlob, Document
+from utils.batches import iter_batches, process_batch
+from utils.commands import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the encrypted documents and attachment files onto the current"
+        " encryption key, FIELD_ENCRYPTION_KEYS[0]"
+    )
+
+    targets = {
+        "documents": (Document, rotate_document),
+        "blobs": (AttachmentBlob, rotate_blob),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of rows rotated between checkpoints",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of rows rotated concurrently",
+        )
+        parser.add_argument(
+            "--max-rate",
+            type=float,
+            default=0,
+            help="Maximum number of rows rotated per second, 0 for no limit",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="File where the progress is saved after every batch. An existing"
+            " checkpoint is resumed from, retrying the rows which failed first.",
+        )
+
+    def load_checkpoint(self, path) -> dict:
+        if path and os.path.exists(path):
+            with open(path) as f:
+                checkpoint = json.load(f)
+            self.logger.info(f"Resuming from checkpoint {checkpoint}")
+            return checkpoint
+        return {}
+
+    def save_checkpoint(self, path, checkpoint: dict):
+        if not path:
+            return
+        # Write the checkpoint atomically, so an interrupted run can't corrupt it
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(f"{path}.tmp", path)
+
+    def handle(
+        self,
+        batch_size: int,
+        workers: int,
+        max_rate: float,
+        checkpoint: str = None,
+        verbosity: int = 0,
+        *args,
+        **kwargs,
+    ):
+        self.setup_logging(verbosity)
+        checkpoint_path = checkpoint
+        checkpoint = self.load_checkpoint(checkpoint_path)
+
+        started = time.monotonic()
+        total = rotated = failed = 0
+        for target, (model, rotate) in self.targets.items():
+            # Rows which failed before the checkpoint are retried first
+            retried = checkpoint.get("failed", {}).get(target, [])
+            retried_batches = [
+                retried[i : i + batch_size] for i in range(0, len(retried), batch_size)
+            ]
+            # The failed rows not retried yet stay in the checkpoint
+            not_retried = list(retried)
+            failures = []
+            for batch in chain(
+                retried_batches,
+                iter_batches(
+                    model.objects.all(), batch_size, after=checkpoint.get(target)
+                ),
+            ):
+                batch_started = time.monotonic()
+                results = process_batch(rotate, batch, workers)
+                total += len(results)
+                rotated += results.count(True)
+                failed += results.count(None)
+
+                # The checkpoint moves past the failed rows, which are saved in it
+                # to be retried when the rotation is resumed
+                failures += [
+                    str(pk) for pk, result in zip(batch, results) if result is None
+                ]
+                if not_retried:
+                    not_retried = not_retried[len(batch) :]
+                else:
+                    checkpoint[target] = str(batch[-1])
+                checkpoint.setdefault("failed", {})[target] = failures + not_retried
+                self.save_checkpoint(checkpoint_path, checkpoint)
+
+                if max_rate:
+                    # Throttle to keep the load on the database and the storage low
+                    elapsed = time.monotonic() - batch_started
+                    time.sleep(max(len(batch) / max_rate - elapsed, 0))
+                elapsed = time.monotonic() - started
+                self.logger.debug(
+                    f"Processed {total} rows, {total / elapsed:.1f} rows/s,"
+                    f" last {target} {batch[-1]}"
+                )
+
+        elapsed = time.monotonic() - started
+        self.logger.info(
+            f"Rows processed: {total}, rotated: {rotated}, failed: {failed}"
+            f" in {elapsed:.1f} s ({total / elapsed if elapsed else 0:.1f} rows/s)"
+        )
@@ -0,0 +1,67 @@
+import time
+
+from django.conf import settings
+
+from documents.tasks import requeue_failed_scans, scan_pending_attachments
+from utils.commands import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Virus scan the attachments left pending by deferred scanning"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=50,
+            help="Number of attachments locked and scanned at a time",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.CLAMAV_POOL_SIZE,
+            help="Number of files scanned concurrently",
+        )
+        parser.add_argument(
+            "--retry-failed",
+            action="store_true",
+            help="Queue the attachments whose scans have failed to be scanned again",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep waiting for new pending attachments instead of exiting once"
+            " the queue is empty",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5.0,
+            help="Seconds to wait before checking an empty queue again with --loop",
+        )
+
+    def handle(
+        self,
+        batch_size: int,
+        workers: int,
+        loop: bool,
+        interval: float,
+        retry_failed: bool = False,
+        verbosity: int = 0,
+        *args,
+        **kwargs,
+    ):
+        self.setup_logging(verbosity)
+        if retry_failed:
+            self.logger.info(f"Failed scans queued again: {requeue_failed_scans()}")
+
+        total = 0
+        while True:
+            while scanned := scan_pending_attachments(batch_size, workers):
+                total += scanned
+                self.logger.debug(f"Scanned {scanned} attachments")
+            if not loop:
+                break
+            time.sleep(interval)
+
+        self.logger.info(f"Attachments scanned: {total}")
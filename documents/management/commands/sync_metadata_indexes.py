@@ -0,0 +1,53 @@
+import time
+
+from documents.metadata_indexes import (
+    create_metadata_index,
+    drop_metadata_index,
+    get_existing_metadata_indexes,
+    get_wanted_metadata_indexes,
+)
+from utils.commands import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the indexes of the registered metadata keys of the services and"
+        " drop the indexes of the keys which aren't registered anymore. The indexes"
+        " are built concurrently without locking the documents against writes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Dry run, only list the indexes to be created and dropped without"
+            " creating or dropping any",
+        )
+
+    def handle(self, dry_run: bool = False, verbosity: int = 0, *args, **kwargs):
+        self.setup_logging(verbosity)
+        wanted = get_wanted_metadata_indexes()
+        existing = get_existing_metadata_indexes()
+        # Failed concurrent builds leave invalid indexes, which are built again
+        to_drop = [name for name, valid in existing.items() if not valid]
+        to_drop += [name for name in existing if name not in wanted]
+        to_create = [
+            index for name, index in wanted.items() if not existing.get(name, False)
+        ]
+
+        if dry_run:
+            self.logger.info(f"Indexes to be dropped: {', '.join(to_drop) or '-'}")
+            self.logger.info(
+                "Indexes to be created: "
+                + (", ".join(index.name for index in to_create) or "-")
+            )
+            return
+
+        for name in to_drop:
+            drop_metadata_index(name)
+            self.logger.info(f"Index dropped: {name}")
+        for index in to_create:
+            started = time.monotonic()
+            create_metadata_index(index)
+            elapsed = time.monotonic() - started
+            self.logger.info(f"Index created: {index.name} in {elapsed:.1f} s")
@@ -0,0 +1,80 @@
+"""Partial expression indexes of the metadata keys services filter documents by.
+
+The keys are registered per service with `IndexedMetadataKey`, and the indexes
+are created and dropped by the sync_metadata_indexes command. An index covers
+the documents of one service, and its expression is the one of the case
+insensitive lookups of the key, so the lookups filtered by the service use it.
+"""
+
+from hashlib import sha256
+
+from django.db import connection, models
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Cast, Upper
+
+from documents.models import Document
+from services.models import IndexedMetadataKey, Service
+
+INDEX_PREFIX = "document_metadata_key_"
+
+
+def get_metadata_key_expression(key: str):
+    """Expression of the key in the metadata, which the iexact lookups compile to."""
+    return Upper(Cast(KeyTextTransform(key, "metadata"), models.TextField()))
+
+
+def get_metadata_index_name(service_id: int, key: str) -> str:
+    digest = sha256(key.encode()).hexdigest()[:12]
+    return f"{INDEX_PREFIX}{service_id}_{digest}"
+
+
+def get_metadata_index(service_id: int, key: str) -> models.Index:
+    return models.Index(
+        get_metadata_key_expression(key),
+        condition=models.Q(service_id=service_id),
+        name=get_metadata_index_name(service_id, key),
+    )
+
+
+def get_indexed_metadata_keys(service: Service) -> set[str]:
+    if service is None:
+        return set()
+    return set(
+        IndexedMetadataKey.objects.filter(service=service).values_list("key", flat=True)
+    )
+
+
+def get_wanted_metadata_indexes() -> dict[str, models.Index]:
+    indexes = (
+        get_metadata_index(service_id, key)
+        for service_id, key in IndexedMetadataKey.objects.values_list(
+            "service_id", "key"
+        )
+    )
+    return {index.name: index for index in indexes}
+
+
+def get_existing_metadata_indexes() -> dict[str, bool]:
+    """Get the names of the metadata key indexes in the database, and whether
+    they're valid. An index whose concurrent build failed is left invalid."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT index.relname, pg_index.indisvalid"
+            " FROM pg_index"
+            " JOIN pg_class index ON index.oid = pg_index.indexrelid"
+            " WHERE pg_index.indrelid = %s::regclass AND index.relname LIKE %s",
+            [Document._meta.db_table, INDEX_PREFIX.replace("_", r"\_") + "%"],
+        )
+        return dict(cursor.fetchall())
+
+
+def create_metadata_index(index: models.Index):
+    with connection.schema_editor(atomic=False) as schema_editor:
+        schema_editor.add_index(Document, index, concurrently=True)
+
+
+def drop_metadata_index(name: str):
+    with connection.schema_editor(atomic=False) as schema_editor:
+        schema_editor.remove_index(
+            Document, models.Index(fields=["id"], name=name), concurrently=True
+        )
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.14 on 2026-10-18 03:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("documents", "0015_alter_document_service_alter_document_user"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="attachment",
+            name="scan_status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("clean", "Clean"),
+                    ("infected", "Infected"),
+                    ("failed", "Failed"),
+                ],
+                default="clean",
+                help_text="Status of the virus scan of the file. Only clean files are served.",
+                max_length=16,
+                verbose_name="scan status",
+            ),
+        ),
+        migrations.AddField(
+            model_name="attachment",
+            name="scan_attempts",
+            field=models.PositiveSmallIntegerField(
+                default=0,
+                help_text="Number of attempts to scan the pending file.",
+                verbose_name="scan attempts",
+            ),
+        ),
+        migrations.AddField(
+            model_name="attachment",
+            name="scan_attempted_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="Time of the last attempt to scan the pending file.",
+                null=True,
+                verbose_name="scan attempted at",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="attachment",
+            index=models.Index(
+                condition=models.Q(("scan_status", "pending")),
+                fields=["scan_attempts", "created_at"],
+                name="attachment_scan_queue_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.2.14 on 2026-10-18 03:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+import documents.fields
+import documents.utils
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("documents", "0016_attachment_scan_status"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AttachmentBlob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="created at"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="updated at"),
+                ),
+                (
+                    "digest",
+                    models.CharField(
+                        help_text="Keyed hash of the content of the file.",
+                        max_length=64,
+                        unique=True,
+                        verbose_name="digest",
+                    ),
+                ),
+                (
+                    "size",
+                    models.PositiveIntegerField(
+                        help_text="Size of the file in bytes.", verbose_name="size"
+                    ),
+                ),
+                (
+                    "ref_count",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Number of attachments referencing the blob.",
+                        verbose_name="reference count",
+                    ),
+                ),
+                (
+                    "file",
+                    documents.fields.EncryptedFileField(
+                        help_text="Encrypted file.",
+                        upload_to=documents.utils.get_blob_file_path,
+                        verbose_name="file",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "attachment blob",
+                "verbose_name_plural": "attachment blobs",
+            },
+        ),
+        migrations.AddField(
+            model_name="attachment",
+            name="blob",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Deduplicated content of the attachment. The file of the attachment is then the file of the blob.",
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="documents.attachmentblob",
+                verbose_name="blob",
+            ),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.14 on 2026-10-18 03:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("documents", "0017_attachment_blob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="attachmentblob",
+            name="data_key",
+            field=models.BinaryField(
+                help_text="Key of the encrypted data wrapped with a master key.",
+                null=True,
+                verbose_name="data key",
+            ),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="data_key",
+            field=models.BinaryField(
+                help_text="Key of the encrypted data wrapped with a master key.",
+                null=True,
+                verbose_name="data key",
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.contrib.postgres.operations import (
+    AddIndexConcurrently,
+    RemoveIndexConcurrently,
+)
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The indexes are built without locking the documents against writes
+    atomic = False
+
+    dependencies = [
+        ("documents", "0018_document_data_key"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="document",
+            index=models.Index(
+                fields=["created_at", "id"], name="document_created_at_id_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="document",
+            index=models.Index(
+                fields=["updated_at", "id"], name="document_updated_at_id_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="document",
+            index=models.Index(
+                fields=["status_timestamp", "id"],
+                name="document_status_ts_id_idx",
+            ),
+        ),
+        # Covered by the composite indexes
+        RemoveIndexConcurrently(
+            model_name="document",
+            name="document_created_at_idx",
+        ),
+        RemoveIndexConcurrently(
+            model_name="document",
+            name="document_updated_at_idx",
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.14 on 2026-10-18 04:37
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The indexes are built without locking the documents against writes
+    atomic = False
+
+    dependencies = [
+        ("documents", "0019_document_keyset_indexes"),
+        ("services", "0008_add_display_names_and_service_link"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="document",
+            index=models.Index(
+                fields=["service", "updated_at", "id"],
+                name="document_service_updated_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="document",
+            index=models.Index(
+                fields=["service", "user", "updated_at", "id"],
+                name="document_svc_user_updated_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="document",
+            index=models.Index(
+                fields=["user", "status_timestamp", "id"],
+                name="document_user_status_ts_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="document",
+            index=models.Index(
+                fields=["service", "transaction_id"],
+                name="document_svc_transaction_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="document",
+            index=models.Index(
+                condition=models.Q(("delete_after__isnull", False)),
+                fields=["delete_after"],
+                name="document_delete_after_idx",
+            ),
+        ),
+    ]
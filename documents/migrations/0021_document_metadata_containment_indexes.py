@@ -0,0 +1,36 @@
+# Generated by Django 5.2.14 on 2026-10-18 04:42
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+import utils.models
+
+
+class Migration(migrations.Migration):
+    # The indexes are built without locking the documents against writes
+    atomic = False
+
+    dependencies = [
+        ("documents", "0020_document_access_path_indexes"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="document",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["metadata"],
+                name="document_metadata_path_idx",
+                opclasses=["jsonb_path_ops"],
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="document",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    utils.models.CaseFoldedJSON("metadata"), name="jsonb_path_ops"
+                ),
+                name="document_metadata_folded_idx",
+            ),
+        ),
+    ]
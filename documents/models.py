@@ -1,5 +1,5 @@
 from django.conf import settings
-from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.urls import reverse
@@ -7,11 +7,14 @@ from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from atv.exceptions import MaximumFileSizeExceededException
+from documents.encryption import generate_data_key, unwrap_data_key, wrap_data_key
+from documents.enums import ScanStatus
 from documents.fields import EncryptedFileField, EncryptedJSONField
-from documents.utils import get_attachment_file_path
+from documents.keys import KeyRegistry, get_key_registry
+from documents.utils import get_attachment_file_path, get_blob_file_path
 from documents.validators import BusinessIDValidator
 from services.models import Service
-from utils.models import TimestampedModel, UUIDModel
+from utils.models import CaseFoldedJSON, TimestampedModel, UUIDModel
 
 
 class Activity(models.Model):
@@ -67,6 +70,101 @@ class StatusHistory(models.Model):
         ordering = ["-timestamp"]
 
 
+class DataKeyModel(models.Model):
+    """A model whose encrypted data is encrypted with its own random data key.
+
+    The data key is stored wrapped with the current master key, so rotating the
+    master keys only requires rewrapping the data keys. Instances created before the
+    data keys were introduced don't have one and use the master keys directly.
+    """
+
+    data_key = models.BinaryField(
+        null=True,
+        editable=False,
+        verbose_name=_("data key"),
+        help_text=_("Key of the encrypted data wrapped with a master key."),
+    )
+
+    class Meta:
+        abstract = True
+
+    @property
+    def encryption_keys(self) -> KeyRegistry:
+        """Keys for encrypting new data of the instance.
+
+        A saved instance without a data key gets one stored right away, so the data
+        encrypted with it is never left without its key.
+        """
+        if self.data_key is None:
+            wrapped_key = wrap_data_key(generate_data_key(), get_key_registry().current)
+            if self._state.adding:
+                self.data_key = wrapped_key
+            elif (
+                type(self)
+                ._base_manager.filter(pk=self.pk, data_key__isnull=True)
+                .update(data_key=wrapped_key)
+            ):
+                self.data_key = wrapped_key
+            else:
+                # Another process stored a data key meanwhile
+                self.refresh_from_db(fields=["data_key"])
+        return self.decryption_keys
+
+    @property
+    def decryption_keys(self) -> KeyRegistry:
+        """Keys for decrypting the data of the instance: the data key and the master
+        keys for the data encrypted before the instance had a data key."""
+        registry = get_key_registry()
+        if self.data_key is None:
+            return registry
+        wrapped_key = bytes(self.data_key)
+        cached = self.__dict__.get("_data_key_registry")
+        if cached is None or cached[0] != wrapped_key or cached[1] is not registry:
+            data_key = unwrap_data_key(wrapped_key, registry)
+            cached = (wrapped_key, registry, registry.with_key(data_key))
+            self._data_key_registry = cached
+        return cached[2]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.data_key is None:
+            self.data_key = wrap_data_key(
+                generate_data_key(), get_key_registry().current
+            )
+        super().save(*args, **kwargs)
+
+
+class AttachmentBlob(TimestampedModel, DataKeyModel):
+    """An encrypted file shared by all the attachments with the same content."""
+
+    digest = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name=_("digest"),
+        help_text=_("Keyed hash of the content of the file."),
+    )
+    size = models.PositiveIntegerField(
+        verbose_name=_("size"),
+        help_text=_("Size of the file in bytes."),
+    )
+    ref_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("reference count"),
+        help_text=_("Number of attachments referencing the blob."),
+    )
+    file = EncryptedFileField(
+        upload_to=get_blob_file_path,
+        verbose_name=_("file"),
+        help_text=_("Encrypted file."),
+    )
+
+    class Meta:
+        verbose_name = _("attachment blob")
+        verbose_name_plural = _("attachment blobs")
+
+    def __str__(self):
+        return f"AttachmentBlob {self.digest}"
+
+
 class Attachment(TimestampedModel):
     document = models.ForeignKey(
         "Document",
@@ -95,11 +193,50 @@ class Attachment(TimestampedModel):
         verbose_name=_("file"),
         help_text=_("Encrypted file."),
     )
+    blob = models.ForeignKey(
+        AttachmentBlob,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        verbose_name=_("blob"),
+        help_text=_(
+            "Deduplicated content of the attachment. The file of the attachment is"
+            " then the file of the blob."
+        ),
+    )
+    scan_status = models.CharField(
+        max_length=16,
+        choices=ScanStatus.choices,
+        default=ScanStatus.CLEAN,
+        verbose_name=_("scan status"),
+        help_text=_(
+            "Status of the virus scan of the file. Only clean files are served."
+        ),
+    )
+    scan_attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name=_("scan attempts"),
+        help_text=_("Number of attempts to scan the pending file."),
+    )
+    scan_attempted_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("scan attempted at"),
+        help_text=_("Time of the last attempt to scan the pending file."),
+    )
 
     class Meta:
         verbose_name = _("attachment")
         verbose_name_plural = _("attachments")
         default_related_name = "attachments"
+        indexes = [
+            # The queue of the pending scans, failed attempts last
+            models.Index(
+                fields=["scan_attempts", "created_at"],
+                condition=models.Q(scan_status=ScanStatus.PENDING),
+                name="attachment_scan_queue_idx",
+            )
+        ]
 
     def __str__(self):
         return f"Attachment {self.pk}"
@@ -108,20 +245,31 @@ class Attachment(TimestampedModel):
     def uri(self):
         return reverse("documents-attachments-detail", args=[self.document.id, self.id])
 
+    @property
+    def encryption_keys(self) -> KeyRegistry:
+        return (self.blob or self.document).encryption_keys
+
+    @property
+    def decryption_keys(self) -> KeyRegistry:
+        return (self.blob or self.document).decryption_keys
+
     def clean(self):
-        if self.file.size > settings.MAX_FILE_SIZE:
+        if self.size > settings.MAX_FILE_SIZE:
             raise MaximumFileSizeExceededException()
 
     def save(self, *args, **kwargs):
-        self.size = self.file.size
-        self.filename = self.file.name
+        # Once the file has been stored, its size and name are the ones of the
+        # encrypted file in the storage
+        if not self.file._committed:
+            self.size = self.file.size
+            self.filename = self.file.name
 
         self.full_clean()
 
         super().save(*args, **kwargs)
 
 
-class Document(UUIDModel, TimestampedModel):
+class Document(UUIDModel, TimestampedModel, DataKeyModel):
     service = models.ForeignKey(
         Service,
         on_delete=models.PROTECT,
@@ -277,13 +425,57 @@ class Document(UUIDModel, TimestampedModel):
         verbose_name_plural = _("documents")
         default_related_name = "documents"
         indexes = [
-            models.Index(fields=["created_at"], name="document_created_at_idx"),
-            models.Index(fields=["updated_at"], name="document_updated_at_idx"),
+            # The id breaks ties of the keyset pagination
+            models.Index(
+                fields=["created_at", "id"], name="document_created_at_id_idx"
+            ),
+            models.Index(
+                fields=["updated_at", "id"], name="document_updated_at_id_idx"
+            ),
+            models.Index(
+                fields=["status_timestamp", "id"],
+                name="document_status_ts_id_idx",
+            ),
+            # The listings of a service and of its users, newest first
+            models.Index(
+                fields=["service", "updated_at", "id"],
+                name="document_service_updated_idx",
+            ),
+            models.Index(
+                fields=["service", "user", "updated_at", "id"],
+                name="document_svc_user_updated_idx",
+            ),
+            # The listing of a user's documents of all services
+            models.Index(
+                fields=["user", "status_timestamp", "id"],
+                name="document_user_status_ts_idx",
+            ),
+            models.Index(
+                fields=["service", "transaction_id"],
+                name="document_svc_transaction_idx",
+            ),
+            # Only the documents which expire are looked up by delete_after
+            models.Index(
+                fields=["delete_after"],
+                condition=models.Q(delete_after__isnull=False),
+                name="document_delete_after_idx",
+            ),
             models.Index(fields=["business_id"], name="document_business_id_idx"),
             models.Index(fields=["transaction_id"], name="document_transaction_id_idx"),
             models.Index(fields=["draft"], name="document_draft_idx"),
             models.Index(fields=["locked_after"], name="document_locked_after_idx"),
+            # Serve the key existence checks of the lookfor filter
             GinIndex(fields=["metadata"], name="document_metadata_idx"),
+            # Serve the containment queries of the lookfor filter
+            GinIndex(
+                fields=["metadata"],
+                opclasses=["jsonb_path_ops"],
+                name="document_metadata_path_idx",
+            ),
+            GinIndex(
+                OpClass(CaseFoldedJSON("metadata"), name="jsonb_path_ops"),
+                name="document_metadata_folded_idx",
+            ),
             models.Index(fields=["status"], name="document_status_idx"),
             models.Index(fields=["type"], name="document_type_idx"),
         ]
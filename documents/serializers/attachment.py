@@ -1,11 +1,14 @@
 from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
 
 from atv.exceptions import MaximumFileSizeExceededException
 from utils.files import b_to_mb
 
+from ..blobs import assign_blobs, save_blobs
+from ..enums import ScanStatus
 from ..models import Attachment
-from ..utils import virus_scan_attachment_file
+from ..utils import save_files_for_scanning, save_scanned_files
 
 
 class AttachmentNameSerializer(serializers.ModelSerializer):
@@ -34,6 +37,7 @@ class AttachmentSerializer(serializers.ModelSerializer):
             "filename",
             "media_type",
             "size",
+            "scan_status",
             "href",
         )
 
@@ -52,6 +56,7 @@ class CreateAttachmentSerializer(serializers.ModelSerializer):
         exclude = (
             "size",
             "filename",
+            "scan_status",
         )
 
     def validate(self, attrs):
@@ -59,7 +64,73 @@ class CreateAttachmentSerializer(serializers.ModelSerializer):
         file = attrs.get("file")
         if (size := file.size) > settings.MAX_FILE_SIZE:
             raise MaximumFileSizeExceededException(file_size=b_to_mb(size))
-        data = file.read()
-        file.seek(0)
-        virus_scan_attachment_file(data)
         return attrs
+
+    def create(self, validated_data):
+        [attachment] = _save_attachments([Attachment(**validated_data)])
+        return attachment
+
+
+def create_document_attachments(document, files) -> list[Attachment]:
+    """Validate and create the attachments for the files uploaded to a document.
+
+    The files are virus scanned and stored concurrently. Either all or none of the
+    attachments are created, as long as this is called within a transaction.
+    """
+    attachments = []
+    for file in files:
+        serializer = CreateAttachmentSerializer(
+            data={
+                "document": document.id,
+                "file": file,
+                "media_type": file.content_type,
+            }
+        )
+        serializer.is_valid(raise_exception=True)
+        attachments.append(Attachment(**serializer.validated_data))
+    return _save_attachments(attachments)
+
+
+def _save_attachments(attachments):
+    for attachment in attachments:
+        attachment.size = attachment.file.size
+        attachment.filename = attachment.file.name
+
+    with transaction.atomic():
+        if settings.ATTACHMENT_DEDUPLICATION:
+            new_blobs = assign_blobs(attachments)
+            field_files = [blob.file for blob in new_blobs]
+            # The content of these is already stored, but they're still scanned
+            stored_uploads = [
+                attachment.file.file
+                for attachment in attachments
+                if attachment.blob not in new_blobs
+            ]
+        else:
+            new_blobs = []
+            field_files = [attachment.file for attachment in attachments]
+            stored_uploads = []
+
+        # Create the missing data keys before the files are stored in threads
+        for field_file in field_files:
+            field_file.instance.encryption_keys  # noqa: B018
+
+        if settings.ATTACHMENT_SCAN_DEFERRED:
+            for attachment in attachments:
+                attachment.scan_status = ScanStatus.PENDING
+            save_files_for_scanning(field_files)
+        else:
+            # The files are virus scanned in the same pass as they're encrypted and
+            # stored
+            save_scanned_files(field_files, scan_only=stored_uploads)
+
+        try:
+            if settings.ATTACHMENT_DEDUPLICATION:
+                save_blobs(attachments, new_blobs)
+            for attachment in attachments:
+                attachment.save()
+        except Exception:
+            for field_file in field_files:
+                field_file.delete(save=False)
+            raise
+    return attachments
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from django.conf import settings
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db.models import Count
@@ -20,7 +22,7 @@ from ..models import Document
 from .attachment import (
     AttachmentNameSerializer,
     AttachmentSerializer,
-    CreateAttachmentSerializer,
+    create_document_attachments,
 )
 from .status_history import StatusHistorySerializer
 
@@ -187,6 +189,62 @@ class DocumentSerializer(serializers.ModelSerializer):
             "attachments",
         )
 
+    # Fields needed for representing the current status
+    status_fields = (
+        "status",
+        "status_display_values",
+        "status_timestamp",
+        "status_histories",
+    )
+
+    def __init__(self, *args, fields: Optional[set[str]] = None, **kwargs):
+        """
+        :param fields: Names of the fields to include in the representation, see
+            get_sparse_fieldset. All the fields are included by default.
+        """
+        super().__init__(*args, **kwargs)
+        self.sparse_fieldset = fields
+        if fields is not None:
+            for name in set(self.fields) - self.get_source_fields(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def get_output_fields(cls) -> list[str]:
+        # The status is represented as a single field
+        return [
+            name
+            for name in cls.Meta.fields
+            if name not in ("status_display_values", "status_timestamp")
+        ]
+
+    @classmethod
+    def get_source_fields(cls, fields: set[str]) -> set[str]:
+        """Get the fields of the serializer needed for representing the given
+        output fields."""
+        if "status" in fields:
+            return fields | set(cls.status_fields)
+        return fields
+
+    @classmethod
+    def get_sparse_fieldset(
+        cls, fields: Optional[str], omit: Optional[str]
+    ) -> Optional[set[str]]:
+        """Parse the comma separated `fields` and `omit` query parameters.
+
+        Returns the names of the output fields to include, or None for all of them.
+        Raises InvalidFieldException for unknown field names.
+        """
+        if fields is None and omit is None:
+            return None
+        output_fields = cls.get_output_fields()
+        selected = set(fields.split(",")) if fields is not None else set(output_fields)
+        omitted = set(omit.split(",")) if omit is not None else set()
+        if unknown := (selected | omitted) - set(output_fields):
+            raise InvalidFieldException(
+                detail=f"Unknown fields: {', '.join(sorted(unknown))}"
+            )
+        return selected - omitted
+
     def update(self, document, validated_data):
         # If the document has been locked, no further updates are allowed
         if document.locked_after and document.locked_after <= now():
@@ -217,7 +275,12 @@ class DocumentSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        return status_to_representation(representation)
+        if "status" in representation:
+            representation = status_to_representation(representation)
+        if self.sparse_fieldset is not None:
+            for name in set(representation) - self.sparse_fieldset:
+                del representation[name]
+        return representation
 
 
 class CreateAnonymousDocumentSerializer(serializers.ModelSerializer):
@@ -280,13 +343,5 @@ class CreateAnonymousDocumentSerializer(serializers.ModelSerializer):
         attachments = validated_data.pop("attachments", [])
 
         document = Document.objects.create(**validated_data)
-        for attached_file in attachments:
-            data = {
-                "document": document.id,
-                "file": attached_file,
-                "media_type": attached_file.content_type,
-            }
-            attachment_serializer = CreateAttachmentSerializer(data=data)
-            attachment_serializer.is_valid(raise_exception=True)
-            attachment_serializer.save()
+        create_document_attachments(document, attachments)
         return document
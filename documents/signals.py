@@ -1,13 +1,19 @@
-import os
+from functools import partial
 
 from django.conf import settings
+from django.db import transaction
 from django.db.models.signals import post_delete
 from django.dispatch import receiver
 
-from utils.files import remove_directory, remove_instance_file
+from utils.files import remove_instance_file, remove_storage_directory
 
-from .models import Attachment, Document
-from .utils import get_document_attachment_directory_path
+from .blobs import release_blob
+from .fields import attachment_storage
+from .models import Attachment, AttachmentBlob, Document
+from .utils import (
+    get_document_attachment_directory_path,
+    get_legacy_document_attachment_directory_path,
+)
 
 
 @receiver(
@@ -21,10 +27,25 @@ def delete_attachment_file_handler(sender, instance, **kwargs):
     It can be enabled/disabled by switching the environment variable
     ENABLE_AUTOMATIC_ATTACHMENT_FILE_DELETION={0,1} (defaults to True)
     """
-    if settings.ENABLE_AUTOMATIC_ATTACHMENT_FILE_DELETION:
+    # The file of a deduplicated attachment belongs to its blob
+    if instance.blob_id:
+        release_blob(instance.blob_id)
+    elif settings.ENABLE_AUTOMATIC_ATTACHMENT_FILE_DELETION:
         remove_instance_file(instance, "file")
 
 
+@receiver(
+    post_delete,
+    sender=AttachmentBlob,
+    dispatch_uid="post_delete_attachment_blob_file",
+)
+def delete_attachment_blob_file_handler(sender, instance, **kwargs):
+    """When the last reference to a blob is removed, delete also the stored file
+    once the deletion has been committed"""
+    if settings.ENABLE_AUTOMATIC_ATTACHMENT_FILE_DELETION:
+        transaction.on_commit(partial(remove_instance_file, instance, "file"))
+
+
 @receiver(
     post_delete,
     sender=Document,
@@ -38,7 +59,9 @@ def delete_document_attachment_files_handler(sender, instance, **kwargs):
     ENABLE_AUTOMATIC_ATTACHMENT_FILE_DELETION={0,1} (defaults to True)
     """
     if settings.ENABLE_AUTOMATIC_ATTACHMENT_FILE_DELETION:
-        path = os.path.join(
-            settings.MEDIA_ROOT, get_document_attachment_directory_path(instance)
-        )
-        remove_directory(path)
+        # Files not yet moved by move_attachment_files are in the legacy directory
+        for path in (
+            get_document_attachment_directory_path(instance),
+            get_legacy_document_attachment_directory_path(instance),
+        ):
+            remove_storage_directory(attachment_storage, path)
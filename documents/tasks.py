@@ -1,8 +1,15 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 
-from documents.models import Document
+from documents.enums import ScanStatus
+from documents.models import Attachment, Document
+from documents.utils import scan_attachment_file
 
 logger = logging.getLogger(__name__)
 
@@ -19,3 +26,90 @@ def delete_expired_documents():
         )
     else:
         logger.info("Nothing to delete.")
+
+
+def _claim_pending_attachments(batch_size: int) -> list[Attachment]:
+    """Claim a batch of the pending attachments for scanning.
+
+    The claim counts as an attempt, so the other workers skip the attachments until
+    the retry delay has passed, and files which crash the worker are given up too.
+    """
+    now = timezone.now()
+    retry_after = now - timedelta(seconds=settings.ATTACHMENT_SCAN_RETRY_DELAY)
+    with transaction.atomic():
+        attachments = list(
+            Attachment.objects.filter(scan_status=ScanStatus.PENDING)
+            .filter(
+                Q(scan_attempted_at__isnull=True) | Q(scan_attempted_at__lt=retry_after)
+            )
+            .select_related("document", "blob")
+            .order_by("scan_attempts", "created_at")
+            .select_for_update(skip_locked=True, of=("self",))[:batch_size]
+        )
+        for attachment in attachments:
+            attachment.scan_attempts += 1
+            attachment.scan_attempted_at = now
+        Attachment.objects.bulk_update(
+            attachments, ["scan_attempts", "scan_attempted_at"]
+        )
+    return attachments
+
+
+def scan_pending_attachments(batch_size: int, workers: int) -> int:
+    """Virus scan a batch of attachments left pending by deferred scanning.
+
+    The batch is claimed in a short transaction and scanned outside of it, so
+    several workers can drain the queue at the same time without keeping rows
+    locked during the scans. The files of the batch are scanned concurrently in
+    threads, and the attachments sharing a blob are scanned once. A file which
+    fails to be scanned is retried after ATTACHMENT_SCAN_RETRY_DELAY, behind the
+    files not attempted yet, and marked failed after ATTACHMENT_SCAN_MAX_ATTEMPTS
+    attempts.
+
+    Returns the number of attachments attempted.
+    """
+    attachments = _claim_pending_attachments(batch_size)
+    if not attachments:
+        return 0
+
+    files = {}
+    for attachment in attachments:
+        files.setdefault(attachment.file.name, []).append(attachment)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            name: executor.submit(scan_attachment_file, file_attachments[0])
+            for name, file_attachments in files.items()
+        }
+
+    statuses = {ScanStatus.CLEAN: [], ScanStatus.INFECTED: [], ScanStatus.FAILED: []}
+    for name, future in futures.items():
+        for attachment in files[name]:
+            if error := future.exception():
+                if attachment.scan_attempts >= settings.ATTACHMENT_SCAN_MAX_ATTEMPTS:
+                    statuses[ScanStatus.FAILED].append(attachment.pk)
+                    logger.error(
+                        f"Scanning {attachment} failed, giving up after"
+                        f" {attachment.scan_attempts} attempts",
+                        exc_info=error,
+                    )
+                else:
+                    logger.error(f"Scanning {attachment} failed", exc_info=error)
+            elif signature := future.result():
+                logger.warning(f"{attachment} is infected: {signature}")
+                statuses[ScanStatus.INFECTED].append(attachment.pk)
+            else:
+                statuses[ScanStatus.CLEAN].append(attachment.pk)
+    for scan_status, pks in statuses.items():
+        if pks:
+            Attachment.objects.filter(
+                pk__in=pks, scan_status=ScanStatus.PENDING
+            ).update(scan_status=scan_status)
+    return len(attachments)
+
+
+def requeue_failed_scans() -> int:
+    """Queue the attachments whose scans failed to be scanned again, e.g. once clamd
+    has been fixed. Returns the number of attachments queued."""
+    return Attachment.objects.filter(scan_status=ScanStatus.FAILED).update(
+        scan_status=ScanStatus.PENDING, scan_attempts=0, scan_attempted_at=None
+    )
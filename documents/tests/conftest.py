@@ -1,11 +1,13 @@
 import shutil
 
 import pytest  # noqa
+from django.core.cache import cache
 from pytest_factoryboy import register
 
 from atv.tests.conftest import *  # noqa
 from services.tests.conftest import *  # noqa
 from users.tests.conftest import *  # noqa
+from utils.test.fake_s3 import FakeS3Client
 
 from ..models import Activity, StatusHistory
 from .factories import AttachmentFactory, DocumentFactory
@@ -22,6 +24,32 @@ def custom_media_dir_for_files(settings, request):
     request.addfinalizer(remove_uploaded_files)
 
 
+@pytest.fixture
+def s3_client(settings):
+    """Store the attachment files in an in-process fake of an S3 bucket."""
+    client = FakeS3Client(min_part_size=2**16)
+    settings.STORAGES = {
+        **settings.STORAGES,
+        "attachments": {
+            "BACKEND": "utils.storage.S3Storage",
+            "OPTIONS": {
+                "bucket_name": "attachments",
+                "part_size": 2**16,
+                "buffer_size": 2**16,
+                "client": client,
+            },
+        },
+    }
+    return client
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Don't let cached virus scan verdicts leak between tests
+    yield
+    cache.clear()
+
+
 @pytest.fixture
 def documents_with_nested_activities(service):
     """Creates 3 documents with 2 status histories each, 2 activities per history."""
@@ -1,6 +1,7 @@
 from unittest import mock
 
 import pytest
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import override_settings
 from freezegun import freeze_time
@@ -13,6 +14,8 @@ from atv.tests.factories import GroupFactory
 from audit_log.enums import Role
 from documents.models import Attachment
 from documents.tests.factories import DocumentFactory
+from documents.tests.utils import mock_virus_scan
+from documents.utils import get_document_attachment_directory_path
 from services.enums import ServicePermissions
 from services.tests.utils import get_user_service_client
 from utils.exceptions import get_error_response
@@ -41,9 +44,7 @@ def test_create_and_retrieve_attachment(user, service, document_data, snapshot):
         service=service,
         draft=True,
     )
-    with mock.patch(
-        "documents.serializers.attachment.virus_scan_attachment_file", return_value=None
-    ):
+    with mock_virus_scan():
         response = api_client.post(
             reverse("documents-attachments-list", args=[document.id]), document_data
         )
@@ -64,6 +65,80 @@ def test_create_and_retrieve_attachment(user, service, document_data, snapshot):
     snapshot.assert_match(body)
 
 
+def test_create_attachment_scans_upload_while_storing(user, service, document_data):
+    api_client = get_user_service_client(user, service)
+    document = DocumentFactory(user=user, service=service, draft=True)
+    with mock_virus_scan() as scan:
+        response = api_client.post(
+            reverse("documents-attachments-list", args=[document.id]), document_data
+        )
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert b"".join(call.args[0] for call in scan.send.call_args_list) == (
+        b"file_content"
+    )
+    scan.finish.assert_called_once()
+    attachment = document.attachments.get()
+    assert attachment.filename == "document1.pdf"
+    assert attachment.size == len(b"file_content")
+
+
+# Small files are received in memory and larger ones into temporary files
+@pytest.mark.parametrize(
+    "max_memory_size", [2621440, 0], ids=["in_memory", "temporary_file"]
+)
+def test_create_attachment_reuses_clean_verdict(
+    user, service, settings, max_memory_size
+):
+    settings.FILE_UPLOAD_MAX_MEMORY_SIZE = max_memory_size
+    api_client = get_user_service_client(user, service)
+    document = DocumentFactory(user=user, service=service, draft=True)
+    url = reverse("documents-attachments-list", args=[document.id])
+
+    def upload():
+        return api_client.post(url, {"file": SimpleUploadedFile("form.pdf", b"form")})
+
+    with mock_virus_scan() as scan:
+        assert upload().status_code == status.HTTP_201_CREATED
+        assert upload().status_code == status.HTTP_201_CREATED
+    assert scan.finish.call_count == 1
+
+    # New signatures invalidate the verdicts
+    with (
+        mock_virus_scan() as scan,
+        mock.patch("documents.utils.get_signature_version", return_value="2"),
+    ):
+        assert upload().status_code == status.HTTP_201_CREATED
+    assert scan.finish.call_count == 1
+
+    assert document.attachments.count() == 3
+
+
+def test_create_attachment_malicious_file(user, service, document_data):
+    api_client = get_user_service_client(user, service)
+    document = DocumentFactory(user=user, service=service, draft=True)
+    with mock_virus_scan(signature="Eicar-Signature"):
+        response = api_client.post(
+            reverse("documents-attachments-list", args=[document.id]), document_data
+        )
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json() == get_error_response(
+        "MALICIOUS FILE DETECTED", "Malware detected."
+    )
+    assert document.attachments.count() == 0
+    _, files = default_storage.listdir(get_document_attachment_directory_path(document))
+    assert files == []
+
+    # Infected files are scanned again
+    with mock_virus_scan(signature="Eicar-Signature") as scan:
+        api_client.post(
+            reverse("documents-attachments-list", args=[document.id]),
+            {"file": SimpleUploadedFile("document1.pdf", b"file_content")},
+        )
+    scan.finish.assert_called_once()
+
+
 @freeze_time("2021-06-30T12:00:00+03:00")
 def test_create_attachment_other_document(user, service):
     document = DocumentFactory(service=service)
@@ -173,9 +248,7 @@ def test_create_attachment_staff(
         service=service,
         draft=True,
     )
-    with mock.patch(
-        "documents.serializers.attachment.virus_scan_attachment_file", return_value=None
-    ):
+    with mock_virus_scan():
         response = api_client.post(
             reverse("documents-attachments-list", args=[document.id]), document_data
         )
@@ -213,9 +286,7 @@ def test_audit_log_is_created_when_creating(
         service=service,
         draft=True,
     )
-    with mock.patch(
-        "documents.serializers.attachment.virus_scan_attachment_file", return_value=None
-    ):
+    with mock_virus_scan():
         response = api_client.post(
             reverse("documents-attachments-list", args=[document.id]),
             document_data,
@@ -1,9 +1,12 @@
 import datetime
 import json
+import os
 import uuid
+from contextlib import nullcontext
 from unittest import mock
 
 import pytest
+from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import override_settings
 from freezegun import freeze_time
@@ -12,6 +15,7 @@ from rest_framework import status
 from rest_framework.reverse import reverse
 
 from documents.models import Attachment, Document
+from documents.tests.utils import mock_virus_scan
 from services.tests.utils import get_user_service_client
 from users.models import User
 from utils.exceptions import get_error_response
@@ -55,9 +59,7 @@ def test_create_anonymous_document(service_api_client, snapshot):
             ),
         ],
     }
-    with mock.patch(
-        "documents.serializers.attachment.virus_scan_attachment_file", return_value=None
-    ):
+    with mock_virus_scan():
         response = service_api_client.post(
             reverse("documents-list"), data, format="multipart"
         )
@@ -81,6 +83,7 @@ def test_create_anonymous_document(service_api_client, snapshot):
             "href": f"http://testserver/v1/documents/{document.id}/attachments/{attachment1.id}/",
             "id": attachment1.id,
             "media_type": "application/pdf",
+            "scan_status": "clean",
             "size": 12,
             "updated_at": "2021-06-30T12:00:00+03:00",
         },
@@ -90,6 +93,7 @@ def test_create_anonymous_document(service_api_client, snapshot):
             "href": f"http://testserver/v1/documents/{document.id}/attachments/{attachment2.id}/",
             "id": attachment2.id,
             "media_type": "application/pdf",
+            "scan_status": "clean",
             "size": 12,
             "updated_at": "2021-06-30T12:00:00+03:00",
         },
@@ -241,6 +245,45 @@ def test_create_document_no_attachments(service_api_client):
     assert body.get("attachments") == []
 
 
+def _scan_finding_eicar():
+    scan = mock.Mock()
+    data = []
+    scan.send.side_effect = data.append
+    scan.finish.side_effect = lambda: "Eicar" if b"EICAR" in b"".join(data) else None
+    return nullcontext(scan)
+
+
+def _count_stored_attachment_files():
+    path = os.path.join(settings.MEDIA_ROOT, settings.ATTACHMENT_MEDIA_DIR)
+    return sum(len(files) for _, _, files in os.walk(path))
+
+
+def test_create_document_with_malicious_attachment(service_api_client):
+    stored_files = _count_stored_attachment_files()
+    data = {
+        **VALID_DOCUMENT_DATA,
+        "attachments": [
+            SimpleUploadedFile(f"document{i}.pdf", content)
+            for i, content in enumerate([b"clean", b"EICAR", b"clean", b"clean"])
+        ],
+    }
+    with (
+        mock.patch("documents.utils.virus_scan", side_effect=_scan_finding_eicar),
+        mock.patch("documents.utils.get_signature_version", return_value="1"),
+    ):
+        response = service_api_client.post(
+            reverse("documents-list"), data, format="multipart"
+        )
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json() == get_error_response(
+        "MALICIOUS FILE DETECTED", "Malware detected."
+    )
+    assert Document.objects.count() == 0
+    assert Attachment.objects.count() == 0
+    assert _count_stored_attachment_files() == stored_files
+
+
 @pytest.mark.parametrize("attachments", [0, 1, 2])
 @pytest.mark.parametrize(
     "ip_address", [" 213.255.180.34 ", "2345:0425:2CA1::0567:5673:23b5"]
@@ -256,9 +299,7 @@ def test_audit_log_is_created_when_creating(
             )
             for i in range(attachments)
         ]
-    with mock.patch(
-        "documents.serializers.attachment.virus_scan_attachment_file", return_value=None
-    ):
+    with mock_virus_scan():
         response = service_api_client.post(
             reverse("documents-list"),
             data,
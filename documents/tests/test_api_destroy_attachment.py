@@ -263,3 +263,20 @@ def test_audit_log_is_created_when_destroying(user, service, ip_address):
         ).count()
         == 1
     )
+
+
+def test_destroy_attachment_removes_file_from_object_storage(
+    superuser_api_client, s3_client
+):
+    attachment = AttachmentFactory(document__draft=True)
+    assert attachment.file.name in s3_client.objects["attachments"]
+
+    response = superuser_api_client.delete(
+        reverse(
+            "documents-attachments-detail",
+            args=[attachment.document.id, attachment.id],
+        )
+    )
+
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert not s3_client.objects["attachments"]
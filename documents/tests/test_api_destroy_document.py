@@ -14,8 +14,9 @@ from rest_framework.reverse import reverse
 
 from atv.tests.factories import GroupFactory
 from documents.models import Attachment, Document, StatusHistory
-from documents.tests.factories import DocumentFactory
+from documents.tests.factories import AttachmentFactory, DocumentFactory
 from documents.tests.test_api_create_document import VALID_DOCUMENT_DATA
+from documents.tests.utils import mock_virus_scan
 from services.enums import ServicePermissions
 from services.models import ServiceAPIKey
 from services.tests.factories import ServiceFactory
@@ -269,9 +270,7 @@ def test_gdpr_delete_user_data_service_user(user, service_api_client):
             ),
         ],
     }
-    with mock.patch(
-        "documents.serializers.attachment.virus_scan_attachment_file", return_value=None
-    ):
+    with mock_virus_scan():
         response = service_api_client.post(
             reverse("documents-list"), data, format="multipart"
         )
@@ -443,3 +442,19 @@ def test_gdpr_delete_does_not_delete_user_with_api_key(
 
     # Verify attachments were deleted
     assert not Attachment.objects.filter(document=doc).exists()
+
+
+def test_destroy_document_removes_files_from_object_storage(
+    superuser_api_client, s3_client
+):
+    document = DocumentFactory(draft=True)
+    AttachmentFactory.create_batch(2, document=document)
+    other_attachment = AttachmentFactory()
+    assert len(s3_client.objects["attachments"]) == 3
+
+    response = superuser_api_client.delete(
+        reverse("documents-detail", args=[document.id])
+    )
+
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert list(s3_client.objects["attachments"]) == [other_attachment.file.name]
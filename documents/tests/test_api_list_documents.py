@@ -12,7 +12,7 @@ from documents.models import Document
 from documents.tests.factories import DocumentFactory
 from documents.tests.test_api_create_document import VALID_DOCUMENT_DATA
 from services.enums import ServicePermissions
-from services.tests.factories import ServiceFactory
+from services.tests.factories import IndexedMetadataKeyFactory, ServiceFactory
 from services.tests.utils import get_user_service_client
 from users.tests.factories import UserFactory
 
@@ -471,3 +471,263 @@ def test_document_query_causes_decent_amount_of_queries(
     with assertNumQueries(8):
         response = superuser_api_client.get(reverse("documents-list"))
         assert response.status_code == status.HTTP_200_OK
+
+
+def test_list_document_sparse_fieldset(
+    superuser_api_client, documents_with_nested_activities
+):
+    """Relations not needed for the requested fields aren't prefetched."""
+    with assertNumQueries(5):
+        response = superuser_api_client.get(
+            reverse("documents-list"), {"fields": "id,metadata"}
+        )
+    assert response.status_code == status.HTTP_200_OK
+    assert all(
+        set(document) == {"id", "metadata"} for document in response.json()["results"]
+    )
+
+
+def test_list_document_omit_fields(superuser_api_client, service):
+    DocumentFactory(service=service, status="handled")
+
+    response = superuser_api_client.get(
+        reverse("documents-list"), {"omit": "content,attachments,status_histories"}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    [document] = response.json()["results"]
+    assert not {"content", "attachments", "status_histories"} & set(document)
+    assert document["status"]["value"] == "handled"
+    assert "metadata" in document
+
+
+def test_list_document_unknown_field(superuser_api_client):
+    response = superuser_api_client.get(
+        reverse("documents-list"), {"fields": "id,secret"}
+    )
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def get_cursor_pages(api_client, url, params) -> list[list[str]]:
+    pages = []
+    while url:
+        response = api_client.get(url, params)
+        assert response.status_code == status.HTTP_200_OK
+        body = response.json()
+        assert "count" not in body
+        pages.append([document["id"] for document in body["results"]])
+        url, params = body["next"], None
+    return pages
+
+
+def get_ordered_ids(queryset, ordering: str) -> list[str]:
+    id_ordering = "-id" if ordering.startswith("-") else "id"
+    return [
+        str(pk)
+        for pk in queryset.order_by(ordering, id_ordering).values_list("id", flat=True)
+    ]
+
+
+@pytest.mark.parametrize("ordering", ["created_at", "-created_at", "-updated_at"])
+def test_list_document_cursor_pagination(superuser_api_client, ordering):
+    for timestamp in ("2021-01-30T12:00:00Z", "2021-06-30T12:00:00Z"):
+        with freezegun.freeze_time(timestamp):
+            # Ties are ordered by id
+            DocumentFactory.create_batch(3)
+    expected = get_ordered_ids(Document.objects.all(), ordering)
+
+    pages = get_cursor_pages(
+        superuser_api_client,
+        reverse("documents-list"),
+        {"pagination": "cursor", "sort": ordering, "page_size": 4},
+    )
+
+    assert pages == [expected[:4], expected[4:]]
+
+
+def test_list_document_cursor_pagination_is_stable(superuser_api_client):
+    with freezegun.freeze_time("2021-01-30T12:00:00Z"):
+        documents = DocumentFactory.create_batch(3)
+    url = reverse("documents-list")
+
+    response = superuser_api_client.get(url, {"pagination": "cursor", "page_size": 2})
+    first_page = [document["id"] for document in response.json()["results"]]
+    # Documents added to the beginning don't shift the following pages
+    DocumentFactory.create_batch(2)
+    response = superuser_api_client.get(response.json()["next"])
+
+    expected = get_ordered_ids(
+        Document.objects.filter(id__in=[d.id for d in documents]), "-updated_at"
+    )
+    assert first_page + [d["id"] for d in response.json()["results"]] == expected
+
+
+def test_list_document_cursor_pagination_previous(superuser_api_client):
+    DocumentFactory.create_batch(5)
+    expected = get_ordered_ids(Document.objects.all(), "-updated_at")
+    url = reverse("documents-list")
+
+    response = superuser_api_client.get(url, {"pagination": "cursor", "page_size": 2})
+    assert response.json()["previous"] is None
+    response = superuser_api_client.get(response.json()["next"])
+    response = superuser_api_client.get(response.json()["next"])
+    assert response.json()["next"] is None
+    response = superuser_api_client.get(response.json()["previous"])
+
+    assert [d["id"] for d in response.json()["results"]] == expected[2:4]
+    assert response.json()["next"] is not None
+
+
+def test_list_document_cursor_pagination_invalid_cursor(superuser_api_client):
+    response = superuser_api_client.get(
+        reverse("documents-list"), {"cursor": "invalid"}
+    )
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_list_document_statistics_cursor_pagination(service_api_client):
+    DocumentFactory.create_batch(3, service=service_api_client.service)
+    expected = get_ordered_ids(Document.objects.all(), "-created_at")
+
+    pages = get_cursor_pages(
+        service_api_client,
+        reverse("document-statistics-list"),
+        {"pagination": "cursor", "page_size": 2},
+    )
+
+    assert pages == [expected[:2], expected[2:]]
+
+
+def test_list_document_statistics_capped_count(service_api_client, settings):
+    settings.PAGINATION_COUNT_LIMIT = 3
+    DocumentFactory.create_batch(5, service=service_api_client.service)
+    url = reverse("document-statistics-list")
+
+    response = service_api_client.get(url, {"count": "capped", "page_size": 2})
+    body = response.json()
+    assert body["count"] == 3
+    assert body["count_type"] == "capped"
+    # The pages aren't limited by the capped count
+    response = service_api_client.get(
+        url, {"count": "capped", "page_size": 2, "page": 3}
+    )
+    body = response.json()
+    assert len(body["results"]) == 1
+    assert body["next"] is None
+    assert body["previous"] is not None
+
+
+def test_list_document_statistics_capped_count_below_limit(service_api_client):
+    DocumentFactory.create_batch(2, service=service_api_client.service)
+
+    response = service_api_client.get(
+        reverse("document-statistics-list"), {"count": "capped"}
+    )
+
+    assert response.json()["count"] == 2
+    assert response.json()["count_type"] == "exact"
+
+
+@pytest.mark.parametrize("count_limit,count_type", [(0, "estimated"), (100, "exact")])
+def test_list_document_statistics_estimated_count(
+    service_api_client, settings, count_limit, count_type
+):
+    settings.PAGINATION_COUNT_LIMIT = count_limit
+    DocumentFactory.create_batch(3, service=service_api_client.service)
+
+    response = service_api_client.get(
+        reverse("document-statistics-list"), {"count": "estimated", "page_size": 2}
+    )
+
+    body = response.json()
+    assert response.status_code == status.HTTP_200_OK
+    assert body["count_type"] == count_type
+    assert len(body["results"]) == 2
+    assert body["next"] is not None
+    if count_type == "exact":
+        assert body["count"] == 3
+
+
+def test_list_document_invalid_count_type(superuser_api_client):
+    response = superuser_api_client.get(reverse("documents-list"), {"count": "some"})
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_list_document_count_type_is_only_reported_when_requested(superuser_api_client):
+    DocumentFactory()
+
+    response = superuser_api_client.get(reverse("documents-list"))
+
+    assert response.json()["count"] == 1
+    assert "count_type" not in response.json()
+
+
+@pytest.mark.parametrize(
+    "lookfor,lookfor_mode,expected",
+    [
+        ("handler:Matti", "exact", True),
+        ("handler:matti", "exact", False),
+        ("handler:matti", None, True),
+        ("handler:MATTI, round:2", None, True),
+        ("round:2", "exact", False),
+        ("round:2, handled:true", None, True),
+        ("round:3", None, False),
+        ("Handler:matti", None, False),
+        ("area:ÄÄNEKOSKI", None, True),
+        ("area:ÄÄNEKOSKI", "exact", False),
+        ("handler:Matti, handler:Maija", "exact", False),
+        ("handler:Matti, handler:Matti", "exact", True),
+        # "ſ" and "s" are equal in upper case but not in lower case
+        ("signer:KAISA", None, True),
+        ("signer:kaisa", None, True),
+        ("signer:kaisa", "exact", False),
+    ],
+)
+def test_list_document_lookfor_mode(
+    superuser_api_client, lookfor, lookfor_mode, expected
+):
+    document = DocumentFactory(
+        metadata={
+            "handler": "Matti",
+            "round": 2,
+            "handled": True,
+            "area": "Äänekoski",
+            "signer": "Kaiſa",
+        }
+    )
+    DocumentFactory(metadata={"handler": "Maija", "round": 2, "note": "Line\nbreak"})
+    params = {"lookfor": lookfor}
+    if lookfor_mode:
+        params["lookfor_mode"] = lookfor_mode
+
+    response = superuser_api_client.get(reverse("documents-list"), params)
+
+    assert response.status_code == status.HTTP_200_OK
+    ids = [result["id"] for result in response.json()["results"]]
+    assert ids == ([str(document.id)] if expected else [])
+
+
+def test_list_document_invalid_lookfor_mode(superuser_api_client):
+    response = superuser_api_client.get(
+        reverse("documents-list"), {"lookfor": "a:b", "lookfor_mode": "regex"}
+    )
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.parametrize("lookfor_mode", ["exact", "iexact"])
+def test_list_document_lookfor_indexed_metadata_key(service_api_client, lookfor_mode):
+    service = service_api_client.service
+    IndexedMetadataKeyFactory(service=service, key="handler")
+    document = DocumentFactory(service=service, metadata={"handler": "Matti"})
+    DocumentFactory(service=service, metadata={"handler": "Maija"})
+
+    response = service_api_client.get(
+        reverse("documents-list"),
+        {"lookfor": "handler:Matti", "lookfor_mode": lookfor_mode},
+    )
+
+    assert [result["id"] for result in response.json()["results"]] == [str(document.id)]
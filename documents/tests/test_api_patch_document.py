@@ -1,5 +1,4 @@
 import json
-from unittest import mock
 from uuid import uuid4
 
 import pytest
@@ -17,6 +16,7 @@ from atv.tests.factories import GroupFactory
 from documents.models import Activity, Document, StatusHistory
 from documents.tests.factories import DocumentFactory
 from documents.tests.test_api_create_document import VALID_DOCUMENT_DATA
+from documents.tests.utils import mock_virus_scan
 from services.enums import ServicePermissions
 from services.tests.utils import get_user_service_client
 from users.models import User
@@ -66,9 +66,7 @@ def test_update_document_owner(user, snapshot):
             ),
         ],
     }
-    with mock.patch(
-        "documents.serializers.attachment.virus_scan_attachment_file", return_value=None
-    ):
+    with mock_virus_scan():
         response = api_client.patch(
             reverse("documents-detail", args=[document.id]), data, format="multipart"
         )
@@ -86,6 +84,7 @@ def test_update_document_owner(user, snapshot):
             "href": f"http://testserver/v1/documents/2d2b7a36-a306-4e35-990f-13aea04263ff/attachments/{attachment.id}/",
             "id": attachment.id,
             "media_type": "application/pdf",
+            "scan_status": "clean",
             "size": 12,
             "updated_at": "2021-06-30T12:00:00+03:00",
         }
@@ -217,9 +216,7 @@ def test_update_document_staff(user, service, snapshot):
             ),
         ],
     }
-    with mock.patch(
-        "documents.serializers.attachment.virus_scan_attachment_file", return_value=None
-    ):
+    with mock_virus_scan():
         response = api_client.patch(
             reverse("documents-detail", args=[document.id]), data, format="multipart"
         )
@@ -237,6 +234,7 @@ def test_update_document_staff(user, service, snapshot):
             "href": f"http://testserver/v1/documents/2d2b7a36-a306-4e35-990f-13aea04263ff/attachments/{attachment.id}/",
             "id": attachment.id,
             "media_type": "application/pdf",
+            "scan_status": "clean",
             "size": 12,
             "updated_at": "2021-06-30T12:00:00+03:00",
         }
@@ -644,9 +642,7 @@ def test_audit_log_is_created_when_patching(user, attachments, ip_address):
             )
             for i in range(attachments)
         ]
-    with mock.patch(
-        "documents.serializers.attachment.virus_scan_attachment_file", return_value=None
-    ):
+    with mock_virus_scan():
         api_client.patch(
             reverse("documents-detail", args=[document.id]),
             data,
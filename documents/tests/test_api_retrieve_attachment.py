@@ -1,4 +1,6 @@
 import random
+import zipfile
+from io import BytesIO
 from uuid import uuid4
 
 import pytest
@@ -8,7 +10,8 @@ from rest_framework import status
 from rest_framework.reverse import reverse
 
 from atv.tests.factories import GroupFactory
-from documents.tests.factories import AttachmentFactory
+from documents.enums import ScanStatus
+from documents.tests.factories import AttachmentFactory, DocumentFactory
 from services.enums import ServicePermissions
 from services.tests.utils import get_user_service_client
 from utils.exceptions import get_error_response
@@ -30,6 +33,30 @@ def test_retrieve_attachment_superuser(superuser_api_client, attachment):
     ) == 'attachment; filename="{}"'.format(attachment.filename)
 
 
+@pytest.mark.parametrize(
+    "scan_status,status_code,error_code",
+    [
+        (ScanStatus.PENDING, status.HTTP_409_CONFLICT, "ATTACHMENT_NOT_SCANNED"),
+        (ScanStatus.FAILED, status.HTTP_409_CONFLICT, "ATTACHMENT_SCAN_FAILED"),
+        (ScanStatus.INFECTED, status.HTTP_400_BAD_REQUEST, "MALICIOUS FILE DETECTED"),
+    ],
+)
+def test_retrieve_attachment_not_clean(
+    superuser_api_client, attachment, scan_status, status_code, error_code
+):
+    attachment.scan_status = scan_status
+    attachment.save()
+
+    response = superuser_api_client.get(
+        reverse(
+            "documents-attachments-detail", args=[attachment.document.id, attachment.id]
+        )
+    )
+
+    assert response.status_code == status_code
+    assert response.json()["errors"][0]["code"] == error_code
+
+
 def test_retrieve_attachment_service_staff(user_factory, attachment):
     user = user_factory()
     group = GroupFactory()
@@ -149,3 +176,190 @@ def test_audit_log_is_created_when_retrieving(user, service, ip_address):
         ).count()
         == 1
     )
+
+
+def test_retrieve_attachment_is_streamed(superuser_api_client, settings):
+    settings.ATTACHMENT_ENCRYPTION_SEGMENT_SIZE = 4
+    attachment = AttachmentFactory(file__data=b"Test file content")
+
+    response = superuser_api_client.get(
+        reverse(
+            "documents-attachments-detail", args=[attachment.document.id, attachment.id]
+        )
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.streaming
+    assert response.headers.get("Content-Length") == str(len(b"Test file content"))
+    assert list(response.streaming_content) == [
+        b"Test",
+        b" fil",
+        b"e co",
+        b"nten",
+        b"t",
+    ]
+
+
+def _get_attachment(api_client, attachment, **headers):
+    return api_client.get(
+        reverse(
+            "documents-attachments-detail", args=[attachment.document.id, attachment.id]
+        ),
+        headers=headers,
+    )
+
+
+def test_retrieve_attachment_range(superuser_api_client, settings):
+    settings.ATTACHMENT_ENCRYPTION_SEGMENT_SIZE = 4
+    attachment = AttachmentFactory(file__data=b"Test file content")
+
+    response = _get_attachment(superuser_api_client, attachment, Range="bytes=5-11")
+
+    assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+    assert response.getvalue() == b"file co"
+    assert response.headers["Content-Range"] == "bytes 5-11/17"
+    assert response.headers["Content-Length"] == "7"
+    assert response.headers["Accept-Ranges"] == "bytes"
+
+    response = _get_attachment(superuser_api_client, attachment, Range="bytes=-3")
+
+    assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+    assert response.getvalue() == b"ent"
+    assert response.headers["Content-Range"] == "bytes 14-16/17"
+
+
+def test_retrieve_attachment_range_not_satisfiable(superuser_api_client, attachment):
+    response = _get_attachment(superuser_api_client, attachment, Range="bytes=100-")
+
+    assert response.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+    assert response.headers["Content-Range"] == "bytes */9"
+
+
+def test_retrieve_attachment_if_range(superuser_api_client, attachment):
+    response = _get_attachment(superuser_api_client, attachment)
+    etag = response.headers["ETag"]
+    last_modified = response.headers["Last-Modified"]
+
+    for if_range in [etag, last_modified]:
+        response = _get_attachment(
+            superuser_api_client, attachment, Range="bytes=5-", **{"If-Range": if_range}
+        )
+        assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert response.getvalue() == b"file"
+
+    response = _get_attachment(
+        superuser_api_client, attachment, Range="bytes=5-", **{"If-Range": '"other"'}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.getvalue() == b"Test file"
+
+
+def test_retrieve_attachment_from_object_storage(superuser_api_client, s3_client):
+    data = random.Random(0).randbytes(300_000)
+    attachment = AttachmentFactory(file__data=data)
+
+    # The encrypted segments were streamed to the bucket in parts
+    assert any(name == "upload_part" for name, _ in s3_client.calls)
+    assert attachment.file.name in s3_client.objects["attachments"]
+
+    response = _get_attachment(superuser_api_client, attachment)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert b"".join(response.streaming_content) == data
+
+    s3_client.calls.clear()
+    response = _get_attachment(
+        superuser_api_client, attachment, Range="bytes=200000-200009"
+    )
+
+    assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+    assert response.getvalue() == data[200000:200010]
+    # Only the header and the segment covering the range were downloaded
+    ranges = [
+        kwargs["Range"] for name, kwargs in s3_client.calls if name == "get_object"
+    ]
+    assert 0 < len(ranges) <= 3
+
+
+def _get_attachments_zip(api_client, document):
+    return api_client.get(
+        reverse("documents-attachments-download-zip", args=[document.id])
+    )
+
+
+def test_download_attachments_zip(user, service, settings):
+    settings.ATTACHMENT_ENCRYPTION_SEGMENT_SIZE = 4
+    api_client = get_user_service_client(user, service)
+    document = DocumentFactory(user=user, service=service)
+    first = AttachmentFactory(
+        document=document, file__data=b"First file", file__filename="file.txt"
+    )
+    AttachmentFactory(
+        document=document, file__data=b"Second file", file__filename="file.txt"
+    )
+    AttachmentFactory(file__data=b"Another document")
+
+    response = _get_attachments_zip(api_client, document)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.streaming
+    assert response.headers["Content-Type"] == "application/zip"
+    assert response.headers["Content-Disposition"] == (
+        f'attachment; filename="{document.id}.zip"'
+    )
+    with zipfile.ZipFile(BytesIO(b"".join(response.streaming_content))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == [first.filename, "file (1).txt"]
+        assert archive.read(first.filename) == b"First file"
+        assert archive.read("file (1).txt") == b"Second file"
+        assert all(
+            info.compress_type == zipfile.ZIP_STORED for info in archive.infolist()
+        )
+
+    # A single entry for the whole document
+    assert (
+        ResilientLogEntry.objects.filter(
+            context__target__type="Document",
+            context__target__id=str(document.pk),
+            context__operation="READ",
+        ).count()
+        == 1
+    )
+    assert not ResilientLogEntry.objects.filter(
+        context__target__type="Attachment"
+    ).exists()
+
+
+def test_download_attachments_zip_empty(superuser_api_client, document):
+    response = _get_attachments_zip(superuser_api_client, document)
+
+    assert response.status_code == status.HTTP_200_OK
+    with zipfile.ZipFile(BytesIO(b"".join(response.streaming_content))) as archive:
+        assert archive.namelist() == []
+
+
+def test_download_attachments_zip_no_access(user, service):
+    api_client = get_user_service_client(user, service)
+    attachment = AttachmentFactory()
+
+    response = _get_attachments_zip(api_client, attachment.document)
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.parametrize(
+    "scan_status,status_code",
+    [
+        (ScanStatus.PENDING, status.HTTP_409_CONFLICT),
+        (ScanStatus.FAILED, status.HTTP_409_CONFLICT),
+        (ScanStatus.INFECTED, status.HTTP_400_BAD_REQUEST),
+    ],
+)
+def test_download_attachments_zip_not_clean(
+    superuser_api_client, attachment, scan_status, status_code
+):
+    AttachmentFactory(document=attachment.document, scan_status=scan_status)
+
+    response = _get_attachments_zip(superuser_api_client, attachment.document)
+
+    assert response.status_code == status_code
@@ -310,3 +310,41 @@ def test_audit_log_is_created_when_retrieving(user):
         ).count()
         == 1
     )
+
+
+def test_retrieve_document_sparse_fieldset(superuser_api_client, service):
+    document = DocumentFactory(service=service, content={"secret": "value"})
+
+    response = superuser_api_client.get(
+        reverse("documents-detail", args=[document.id]), {"fields": "id,status"}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    body = response.json()
+    assert set(body) == {"id", "status"}
+    assert body["status"]["value"] == document.status
+
+
+def test_get_user_document_metadatas_cursor_pagination(superuser_api_client, user):
+    with freeze_time("2021-01-30T12:00:00Z"):
+        DocumentFactory.create_batch(2, user=user)
+    DocumentFactory.create_batch(3, user=user, status_timestamp=None)
+    # Nulls come first when sorting in descending order, and ties are ordered by id
+    expected = [
+        str(pk)
+        for pk in Document.objects.order_by("-status_timestamp", "-id").values_list(
+            "id", flat=True
+        )
+    ]
+
+    url, params, pages = (
+        reverse("userdocuments-detail", args=[user.uuid]),
+        {"pagination": "cursor", "page_size": 2},
+        [],
+    )
+    while url:
+        body = superuser_api_client.get(url, params).json()
+        pages.append([document["id"] for document in body["results"]])
+        url, params = body["next"], None
+
+    assert pages == [expected[:2], expected[2:4], expected[4:]]
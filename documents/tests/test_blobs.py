@@ -0,0 +1,140 @@
+import hashlib
+from io import BytesIO
+
+import pytest
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from documents.blobs import assign_blobs
+from documents.models import Attachment, AttachmentBlob
+from documents.serializers import attachment as attachment_serializers
+from documents.serializers.attachment import create_document_attachments
+from documents.tests.factories import DocumentFactory
+from documents.tests.utils import mock_virus_scan
+from documents.utils import get_content_digest, get_decrypted_file
+from utils.storage import S3Storage
+
+
+@pytest.fixture(autouse=True)
+def attachment_deduplication(settings):
+    settings.ATTACHMENT_DEDUPLICATION = True
+
+
+def upload(document, *contents):
+    files = []
+    for i, content in enumerate(contents):
+        file = SimpleUploadedFile(f"file{i}.txt", content)
+        # The upload handlers of requests hash the files
+        file.sha256 = hashlib.sha256(content).hexdigest()
+        files.append(file)
+    with mock_virus_scan() as scan:
+        attachments = create_document_attachments(document, files)
+    return attachments, scan
+
+
+def test_identical_files_are_stored_once(service):
+    document1 = DocumentFactory(service=service)
+    document2 = DocumentFactory(service=service)
+
+    [attachment1], _ = upload(document1, b"form")
+    [attachment2, attachment3], scan = upload(document2, b"form", b"other")
+
+    blob = AttachmentBlob.objects.get(attachments=attachment1)
+    assert blob.ref_count == 2
+    assert attachment2.blob == blob
+    assert attachment1.file.name == attachment2.file.name == blob.file.name
+    assert attachment3.blob != blob
+    assert AttachmentBlob.objects.count() == 2
+    # The other file is scanned, the known clean one comes from the verdict cache
+    scan.finish.assert_called_once()
+
+    attachment2 = Attachment.objects.get(pk=attachment2.pk)
+    assert attachment2.filename == "file0.txt"
+    assert attachment2.size == len(b"form")
+    assert (
+        get_decrypted_file(
+            attachment2.file.read(), "", attachment2.decryption_keys
+        ).read()
+        == b"form"
+    )
+
+
+class CountingBytesIO(BytesIO):
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def test_upload_is_read_once(document):
+    content = b"form" * 2**16
+    file = SimpleUploadedFile("file.txt", content)
+    file.file = CountingBytesIO(content)
+    file.sha256 = hashlib.sha256(content).hexdigest()
+
+    with mock_virus_scan():
+        [attachment] = create_document_attachments(document, [file])
+
+    assert file.file.bytes_read == len(content)
+    assert attachment.blob.digest == get_content_digest(file.sha256)
+
+
+def test_identical_files_in_one_upload(document):
+    attachments, _ = upload(document, b"form", b"form")
+
+    blob = AttachmentBlob.objects.get()
+    assert blob.ref_count == 2
+    assert {attachment.blob for attachment in attachments} == {blob}
+
+
+def test_blob_is_deleted_with_last_attachment(
+    service, django_capture_on_commit_callbacks
+):
+    document1 = DocumentFactory(service=service)
+    document2 = DocumentFactory(service=service)
+    [attachment1], _ = upload(document1, b"form")
+    upload(document2, b"form")
+    blob = AttachmentBlob.objects.get()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        attachment1.delete()
+    blob.refresh_from_db()
+    assert blob.ref_count == 1
+    assert default_storage.exists(blob.file.name)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        document2.delete()
+    assert not AttachmentBlob.objects.exists()
+    assert not default_storage.exists(blob.file.name)
+
+
+def test_concurrent_uploads_of_same_content(service, s3_client, monkeypatch):
+    document1 = DocumentFactory(service=service)
+    document2 = DocumentFactory(service=service)
+
+    def assign_blobs_racing(attachments):
+        new_blobs = assign_blobs(attachments)
+        # Another upload stores the same content before this one saves its blob
+        monkeypatch.setattr(attachment_serializers, "assign_blobs", assign_blobs)
+        upload(document2, b"form")
+        return new_blobs
+
+    monkeypatch.setattr(attachment_serializers, "assign_blobs", assign_blobs_racing)
+    # Both uploads check the name is free before either of them writes the file
+    monkeypatch.setattr(S3Storage, "exists", lambda self, name: False)
+    [attachment1], _ = upload(document1, b"form")
+
+    blob = AttachmentBlob.objects.get()
+    assert blob.ref_count == 2
+    assert attachment1.blob == blob
+    # Only the file of the saved blob is left, intact
+    assert list(s3_client.objects["attachments"]) == [blob.file.name]
+    attachment1 = Attachment.objects.get(pk=attachment1.pk)
+    assert (
+        get_decrypted_file(
+            attachment1.file.read(), "", attachment1.decryption_keys
+        ).read()
+        == b"form"
+    )
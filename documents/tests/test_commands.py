@@ -1,13 +1,50 @@
-from datetime import timezone
+import json
+import os
+import time
+from datetime import datetime, timezone
 from pathlib import Path
 from uuid import uuid4
 
+import pytest
+from Crypto.Cipher import AES
 from dateutil.relativedelta import relativedelta
 from dateutil.utils import today
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import override_settings
 
-from documents.models import Activity, Attachment, Document, StatusHistory
+from documents import key_rotation
+from documents.encryption import encrypt_bytes, get_key_id
+from documents.enums import ScanStatus
+from documents.file_layout import move_attachment_file
+from documents.keys import get_key_registry
+from documents.management.commands.rotate_encryption_keys import (
+    Command as RotateEncryptionKeysCommand,
+)
+from documents.metadata_indexes import (
+    get_existing_metadata_indexes,
+    get_metadata_index_name,
+)
+from documents.models import (
+    Activity,
+    Attachment,
+    AttachmentBlob,
+    Document,
+    StatusHistory,
+)
+from documents.serializers.attachment import create_document_attachments
+from documents.tasks import scan_pending_attachments
 from documents.tests.factories import AttachmentFactory, DocumentFactory
+from documents.tests.utils import mock_virus_scan
+from documents.utils import (
+    get_document_attachment_directory_path,
+    get_legacy_document_attachment_directory_path,
+    iter_decrypted_file,
+)
+from services.models import IndexedMetadataKey
+from services.tests.factories import IndexedMetadataKeyFactory
+from utils.clamd import ClamdError
 
 
 def test_call_remove_outdated_files():
@@ -40,6 +77,158 @@ def test_call_remove_extra_directories(settings):
     assert not path_to_remove.exists()
 
 
+def test_call_remove_extra_files_in_hashed_directories(settings, document):
+    attachment = AttachmentFactory(document=document)
+    orphan = Document(id=uuid4())
+    root = Path(settings.MEDIA_ROOT)
+    extra_file = root / get_document_attachment_directory_path(document) / "extra"
+    orphan_directory = root / get_document_attachment_directory_path(orphan)
+    orphan_directory.mkdir(parents=True)
+    extra_file.touch()
+
+    call_command("remove_outdated_files")
+
+    assert not extra_file.exists()
+    assert not orphan_directory.exists()
+    assert (root / attachment.file.name).exists()
+
+
+@override_settings(ATTACHMENT_DEDUPLICATION=True)
+def test_remove_outdated_files_blobs(
+    settings, document, django_capture_on_commit_callbacks
+):
+    with mock_virus_scan():
+        [attachment] = create_document_attachments(
+            document, [SimpleUploadedFile("file.txt", b"content")]
+        )
+    unreferenced = AttachmentBlob(
+        digest="0" * 64, size=4, file=SimpleUploadedFile("blob", b"blob")
+    )
+    unreferenced.save()
+    root = Path(settings.MEDIA_ROOT)
+    orphan_file = root / settings.ATTACHMENT_BLOB_MEDIA_DIR / "ab" / "orphan"
+    orphan_file.parent.mkdir(parents=True, exist_ok=True)
+    orphan_file.touch()
+
+    call_command("remove_outdated_files", dry_run=True)
+
+    assert AttachmentBlob.objects.count() == 2
+    assert orphan_file.exists()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        call_command("remove_outdated_files")
+
+    assert list(AttachmentBlob.objects.all()) == [attachment.blob]
+    assert not orphan_file.exists()
+    assert not (root / unreferenced.file.name).exists()
+    assert (root / attachment.blob.file.name).exists()
+
+
+def test_remove_outdated_files_queries_in_batches(
+    settings, service, django_assert_max_num_queries
+):
+    root = Path(settings.MEDIA_ROOT)
+    extra_files = []
+    for document in DocumentFactory.create_batch(3, service=service):
+        AttachmentFactory(document=document)
+        extra_files.append(
+            root / get_document_attachment_directory_path(document) / "extra"
+        )
+        extra_files[-1].touch()
+    for _ in range(3):
+        (root / get_document_attachment_directory_path(Document(id=uuid4()))).mkdir(
+            parents=True
+        )
+
+    # The documents and the attachments of each batch are loaded with a query each,
+    # and the blobs without attachments with one more
+    with django_assert_max_num_queries(5):
+        call_command("remove_outdated_files", batch_size=3)
+
+    assert not any(path.exists() for path in extra_files)
+    assert len(Attachment.objects.all()) == 3
+    assert all((root / a.file.name).exists() for a in Attachment.objects.all())
+
+
+def test_remove_outdated_files_older_than(settings, document):
+    directory = Path(settings.MEDIA_ROOT) / get_document_attachment_directory_path(
+        document
+    )
+    directory.mkdir(parents=True)
+    new_file = directory / "new"
+    old_file = directory / "old"
+    new_file.touch()
+    old_file.touch()
+    two_hours_ago = time.time() - 2 * 60 * 60
+    os.utime(old_file, (two_hours_ago, two_hours_ago))
+
+    call_command("remove_outdated_files", older_than=60)
+
+    assert new_file.exists()
+    assert not old_file.exists()
+
+
+def test_remove_outdated_files_from_object_storage(s3_client, document):
+    attachment = AttachmentFactory(document=document)
+    objects = s3_client.objects["attachments"]
+    objects[f"attachments/{document.pk}/remove_me.file"] = b""
+    objects[f"attachments/{uuid4()}/remove_me.file"] = b""
+
+    call_command("remove_outdated_files", dry_run=True)
+    assert len(objects) == 3
+
+    call_command("remove_outdated_files")
+    assert list(objects) == [attachment.file.name]
+
+
+def _move_to_legacy_directory(attachment):
+    storage = attachment.file.storage
+    legacy_name = (
+        f"{get_legacy_document_attachment_directory_path(attachment.document)}"
+        f"{attachment.filename}"
+    )
+    with storage.open(attachment.file.name) as f:
+        legacy_name = storage.save(legacy_name, f)
+    storage.delete(attachment.file.name)
+    Attachment.objects.filter(pk=attachment.pk).update(file=legacy_name)
+    return Attachment.objects.get(pk=attachment.pk)
+
+
+def test_move_attachment_files(document, django_capture_on_commit_callbacks):
+    attachment = _move_to_legacy_directory(AttachmentFactory(document=document))
+    moved_attachment = AttachmentFactory(document=document)
+    legacy_name = attachment.file.name
+    assert legacy_name.startswith(f"attachments/{document.pk}/")
+
+    call_command("move_attachment_files", dry_run=True)
+    assert Attachment.objects.get(pk=attachment.pk).file.name == legacy_name
+
+    with django_capture_on_commit_callbacks(execute=True):
+        call_command("move_attachment_files", workers=1)
+
+    attachment.refresh_from_db()
+    assert attachment.file.name.startswith(
+        get_document_attachment_directory_path(document)
+    )
+    assert b"".join(iter_decrypted_file(attachment.file)) == b"Test file"
+    assert not attachment.file.storage.exists(legacy_name)
+    assert Attachment.objects.get(pk=moved_attachment.pk).file == moved_attachment.file
+
+
+def test_moved_file_is_read_from_new_path(document):
+    attachment = _move_to_legacy_directory(AttachmentFactory(document=document))
+    stale_attachment = Attachment.objects.get(pk=attachment.pk)
+
+    move_attachment_file(attachment.pk)
+    attachment.file.storage.delete(stale_attachment.file.name)
+
+    # The instance loaded before the move falls back to the new name
+    assert b"".join(iter_decrypted_file(stale_attachment.file)) == b"Test file"
+    assert stale_attachment.file.name.startswith(
+        get_document_attachment_directory_path(document)
+    )
+
+
 def test_delete_expired_documents(service):
     document1 = DocumentFactory(
         service=service, delete_after=today(timezone.utc) - relativedelta(days=1)
@@ -65,3 +254,341 @@ def test_delete_expired_documents(service):
     assert Document.objects.count() == 1
     assert Attachment.objects.count() == 1
     assert StatusHistory.objects.count() == 1
+
+
+@override_settings(ATTACHMENT_SCAN_DEFERRED=True)
+def test_scan_pending_attachments(document):
+    with mock_virus_scan() as scan:
+        attachments = create_document_attachments(
+            document,
+            [SimpleUploadedFile(f"file{i}.txt", b"content") for i in range(3)],
+        )
+    scan.finish.assert_not_called()
+    assert {attachment.scan_status for attachment in attachments} == {
+        ScanStatus.PENDING
+    }
+
+    with mock_virus_scan() as scan:
+        call_command("scan_pending_attachments", batch_size=2)
+
+    # The decrypted files are scanned
+    assert scan.finish.call_count == 3
+    assert b"".join(call.args[0] for call in scan.send.call_args_list) == (
+        b"content" * 3
+    )
+    assert set(document.attachments.values_list("scan_status", flat=True)) == {
+        ScanStatus.CLEAN
+    }
+
+
+@override_settings(ATTACHMENT_SCAN_DEFERRED=True, ATTACHMENT_DEDUPLICATION=True)
+def test_scan_pending_attachments_shared_blob(document):
+    def upload(*contents):
+        with mock_virus_scan():
+            return create_document_attachments(
+                document,
+                [
+                    SimpleUploadedFile(f"file{i}.txt", content)
+                    for i, content in enumerate(contents)
+                ],
+            )
+
+    upload(b"form", b"form", b"other")
+
+    with mock_virus_scan() as scan:
+        call_command("scan_pending_attachments")
+
+    # The attachments of the same blob are scanned once
+    assert scan.finish.call_count == 2
+    assert set(document.attachments.values_list("scan_status", flat=True)) == {
+        ScanStatus.CLEAN
+    }
+
+    # The verdict of the blob is cached
+    [attachment] = upload(b"form")
+    with mock_virus_scan() as scan:
+        call_command("scan_pending_attachments")
+
+    scan.finish.assert_not_called()
+    attachment.refresh_from_db()
+    assert attachment.scan_status == ScanStatus.CLEAN
+
+
+# The files are scanned in threads with connections of their own
+@pytest.mark.django_db(transaction=True)
+def test_scan_pending_attachments_doesnt_lock_during_scan(document):
+    attachment = AttachmentFactory(document=document, scan_status=ScanStatus.PENDING)
+
+    def finish():
+        try:
+            with transaction.atomic():
+                Attachment.objects.select_for_update(nowait=True).get(pk=attachment.pk)
+        finally:
+            connection.close()
+
+    with mock_virus_scan() as scan:
+        scan.finish.side_effect = finish
+        call_command("scan_pending_attachments")
+
+    attachment.refresh_from_db()
+    assert attachment.scan_status == ScanStatus.CLEAN
+
+
+def test_scan_pending_attachments_infected(document):
+    attachment = AttachmentFactory(document=document, scan_status=ScanStatus.PENDING)
+    clean_attachment = AttachmentFactory(document=document)
+
+    with mock_virus_scan(signature="Eicar-Signature") as scan:
+        call_command("scan_pending_attachments")
+
+    scan.finish.assert_called_once()
+    attachment.refresh_from_db()
+    assert attachment.scan_status == ScanStatus.INFECTED
+    clean_attachment.refresh_from_db()
+    assert clean_attachment.scan_status == ScanStatus.CLEAN
+
+
+def test_scan_pending_attachments_failure(document):
+    attachment = AttachmentFactory(document=document, scan_status=ScanStatus.PENDING)
+
+    with mock_virus_scan() as scan:
+        scan.finish.side_effect = ClamdError()
+        call_command("scan_pending_attachments")
+
+    attachment.refresh_from_db()
+    assert attachment.scan_status == ScanStatus.PENDING
+    assert attachment.scan_attempts == 1
+    assert attachment.scan_attempted_at is not None
+
+    # The attachment isn't retried before the retry delay
+    with mock_virus_scan() as scan:
+        call_command("scan_pending_attachments")
+
+    scan.finish.assert_not_called()
+
+
+@override_settings(ATTACHMENT_SCAN_MAX_ATTEMPTS=2)
+def test_scan_pending_attachments_failure_max_attempts(document):
+    attachment = AttachmentFactory(
+        document=document,
+        scan_status=ScanStatus.PENDING,
+        scan_attempts=1,
+        scan_attempted_at=datetime.now(timezone.utc) - relativedelta(hours=1),
+    )
+
+    with mock_virus_scan() as scan:
+        scan.finish.side_effect = ClamdError()
+        call_command("scan_pending_attachments")
+
+    attachment.refresh_from_db()
+    assert attachment.scan_status == ScanStatus.FAILED
+    assert attachment.scan_attempts == 2
+
+
+def test_scan_pending_attachments_retry_failed(document):
+    attachment = AttachmentFactory(
+        document=document,
+        scan_status=ScanStatus.FAILED,
+        scan_attempts=5,
+        scan_attempted_at=datetime.now(timezone.utc),
+    )
+
+    with mock_virus_scan() as scan:
+        call_command("scan_pending_attachments")
+    scan.finish.assert_not_called()
+
+    with mock_virus_scan() as scan:
+        call_command("scan_pending_attachments", retry_failed=True)
+
+    scan.finish.assert_called_once()
+    attachment.refresh_from_db()
+    assert attachment.scan_status == ScanStatus.CLEAN
+    assert attachment.scan_attempts == 1
+
+
+def test_scan_pending_attachments_failures_dont_block_queue(document):
+    failing = AttachmentFactory.create_batch(
+        2, document=document, scan_status=ScanStatus.PENDING
+    )
+    with mock_virus_scan() as scan:
+        scan.finish.side_effect = ClamdError()
+        call_command("scan_pending_attachments", batch_size=2)
+    Attachment.objects.filter(pk__in=[a.pk for a in failing]).update(
+        scan_attempted_at=datetime.now(timezone.utc) - relativedelta(hours=1)
+    )
+    attachment = AttachmentFactory(document=document, scan_status=ScanStatus.PENDING)
+
+    with mock_virus_scan():
+        scan_pending_attachments(batch_size=1, workers=1)
+
+    # The newer attachment is scanned before the failed ones are retried
+    attachment.refresh_from_db()
+    assert attachment.scan_status == ScanStatus.CLEAN
+    assert set(
+        Attachment.objects.filter(pk__in=[a.pk for a in failing]).values_list(
+            "scan_status", flat=True
+        )
+    ) == {ScanStatus.PENDING}
+
+
+def test_benchmark_compression(document, caplog):
+    call_command("benchmark_compression", sizes="100,10000", documents=1, repeat=1)
+
+    assert len(caplog.records) == 3
+    assert "saved" in caplog.records[1].message
+
+
+def test_rotate_encryption_keys(settings, document, django_capture_on_commit_callbacks):
+    old_key = get_key_registry().current
+    attachment = AttachmentFactory(document=document)
+    # A document and an attachment encrypted with the master key directly
+    legacy_document = DocumentFactory(service=document.service)
+    legacy_attachment = AttachmentFactory(document=legacy_document)
+    with legacy_attachment.file.open("wb") as f:
+        f.write(encrypt_bytes(b"legacy", old_key))
+    Document.objects.filter(pk=legacy_document.pk).update(
+        data_key=None, content={"legacy": True}
+    )
+
+    new_key = AES.get_random_bytes(32).hex()
+    settings.FIELD_ENCRYPTION_KEYS = [new_key, old_key.key.hex()]
+    with django_capture_on_commit_callbacks(execute=True):
+        call_command("rotate_encryption_keys", batch_size=1)
+    settings.FIELD_ENCRYPTION_KEYS = [new_key]
+
+    document = Document.objects.get(pk=document.pk)
+    assert get_key_id(document.data_key) == get_key_registry().current.key_id
+    attachment = Attachment.objects.get(pk=attachment.pk)
+    assert b"".join(iter_decrypted_file(attachment.file)) == b"Test file"
+
+    legacy_document = Document.objects.get(pk=legacy_document.pk)
+    assert legacy_document.content == {"legacy": True}
+    old_name = legacy_attachment.file.name
+    legacy_attachment = Attachment.objects.get(pk=legacy_attachment.pk)
+    assert b"".join(iter_decrypted_file(legacy_attachment.file)) == b"legacy"
+    assert not legacy_attachment.file.storage.exists(old_name)
+
+
+# The rows are rotated in threads with connections of their own
+@pytest.mark.django_db(transaction=True)
+def test_rotate_encryption_keys_resumes_from_checkpoint(settings, service, tmp_path):
+    documents = sorted(DocumentFactory.create_batch(3, service=service), key=str)
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text(f'{{"documents": "{documents[0].pk}"}}')
+    wrapped_keys = {document.pk: bytes(document.data_key) for document in documents}
+
+    old_key = get_key_registry().current.key.hex()
+    settings.FIELD_ENCRYPTION_KEYS = [AES.get_random_bytes(32).hex(), old_key]
+    call_command(
+        "rotate_encryption_keys", batch_size=1, workers=2, checkpoint=str(checkpoint)
+    )
+
+    rotated = {
+        document.pk: bytes(document.data_key) != wrapped_keys[document.pk]
+        for document in Document.objects.all()
+    }
+    assert rotated == {
+        documents[0].pk: False,
+        documents[1].pk: True,
+        documents[2].pk: True,
+    }
+    assert str(documents[2].pk) in checkpoint.read_text()
+
+
+def test_rotate_encryption_keys_retries_failed_rows(
+    settings, service, tmp_path, monkeypatch
+):
+    documents = sorted(DocumentFactory.create_batch(3, service=service), key=str)
+    checkpoint = tmp_path / "checkpoint.json"
+    wrapped_keys = {document.pk: bytes(document.data_key) for document in documents}
+    old_key = get_key_registry().current.key.hex()
+    settings.FIELD_ENCRYPTION_KEYS = [AES.get_random_bytes(32).hex(), old_key]
+
+    def rotate_document(pk):
+        if str(pk) == str(documents[1].pk):
+            raise OSError("Storage unavailable")
+        return key_rotation.rotate_document(pk)
+
+    monkeypatch.setitem(
+        RotateEncryptionKeysCommand.targets, "documents", (Document, rotate_document)
+    )
+    call_command("rotate_encryption_keys", batch_size=2, checkpoint=str(checkpoint))
+
+    saved = json.loads(checkpoint.read_text())
+    assert saved["documents"] == str(documents[2].pk)
+    assert saved["failed"]["documents"] == [str(documents[1].pk)]
+
+    monkeypatch.undo()
+    call_command("rotate_encryption_keys", batch_size=2, checkpoint=str(checkpoint))
+
+    saved = json.loads(checkpoint.read_text())
+    assert saved["failed"]["documents"] == []
+    for document in Document.objects.all():
+        assert bytes(document.data_key) != wrapped_keys[document.pk]
+
+
+def test_rotate_encryption_keys_retries_more_failed_rows_than_batch(
+    settings, service, tmp_path, monkeypatch
+):
+    documents = sorted(DocumentFactory.create_batch(5, service=service), key=str)
+    failed = [str(document.pk) for document in documents]
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text(
+        json.dumps({"documents": failed[-1], "failed": {"documents": failed}})
+    )
+    wrapped_keys = {document.pk: bytes(document.data_key) for document in documents}
+    old_key = get_key_registry().current.key.hex()
+    settings.FIELD_ENCRYPTION_KEYS = [AES.get_random_bytes(32).hex(), old_key]
+
+    def rotate_document(pk):
+        if str(pk) == failed[2]:
+            raise KeyboardInterrupt()
+        return key_rotation.rotate_document(pk)
+
+    monkeypatch.setitem(
+        RotateEncryptionKeysCommand.targets, "documents", (Document, rotate_document)
+    )
+    with pytest.raises(KeyboardInterrupt):
+        call_command("rotate_encryption_keys", batch_size=2, checkpoint=str(checkpoint))
+
+    # Only the rows of the finished batch are removed from the failed rows
+    assert json.loads(checkpoint.read_text())["failed"]["documents"] == failed[2:]
+
+    monkeypatch.undo()
+    call_command("rotate_encryption_keys", batch_size=2, checkpoint=str(checkpoint))
+
+    saved = json.loads(checkpoint.read_text())
+    assert saved == {"documents": failed[-1], "failed": {"documents": []}}
+    for document in Document.objects.all():
+        assert bytes(document.data_key) != wrapped_keys[document.pk]
+
+
+# Indexes are built concurrently outside of transactions
+@pytest.mark.django_db(transaction=True)
+def test_sync_metadata_indexes():
+    kept, removed = IndexedMetadataKeyFactory.create_batch(2)
+    call_command("sync_metadata_indexes")
+    assert get_existing_metadata_indexes() == {
+        get_metadata_index_name(kept.service_id, kept.key): True,
+        get_metadata_index_name(removed.service_id, removed.key): True,
+    }
+
+    removed.delete()
+    added = IndexedMetadataKeyFactory(service=kept.service)
+    call_command("sync_metadata_indexes")
+    assert get_existing_metadata_indexes() == {
+        get_metadata_index_name(kept.service_id, kept.key): True,
+        get_metadata_index_name(added.service_id, added.key): True,
+    }
+
+    IndexedMetadataKey.objects.all().delete()
+    call_command("sync_metadata_indexes")
+    assert get_existing_metadata_indexes() == {}
+
+
+def test_sync_metadata_indexes_dry_run():
+    IndexedMetadataKeyFactory()
+
+    call_command("sync_metadata_indexes", dry_run=True)
+
+    assert get_existing_metadata_indexes() == {}
@@ -0,0 +1,331 @@
+import struct
+from io import BytesIO
+
+import pytest
+from Crypto.Cipher import AES
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+
+from ..encryption import (
+    FLAG_COMPRESSED,
+    MAGIC,
+    TAG_SIZE,
+    Header,
+    _segment_cipher,
+    decrypt_bytes,
+    decrypt_range,
+    decrypt_segmented,
+    decrypt_stream,
+    encrypt_bytes,
+    encrypt_stream,
+    is_segmented,
+    unwrap_data_key,
+    wrap_data_key,
+)
+from ..keys import KeyRegistry, get_key_registry
+from ..models import Attachment, Document
+from ..utils import get_decrypted_file
+
+HEADER_SIZE = Header(1, b"").size
+OTHER_KEY = AES.get_random_bytes(32).hex()
+
+
+def encrypt(data, segment_size=4, key=None):
+    key = key or get_key_registry().current
+    return b"".join(encrypt_stream(BytesIO(data), key, segment_size))
+
+
+@pytest.mark.parametrize("data", [b"", b"abc", b"abcd", b"abcdefghij" * 10])
+def test_encrypt_decrypt_roundtrip(data):
+    encrypted = encrypt(data)
+
+    assert is_segmented(encrypted)
+    assert list(decrypt_stream(BytesIO(encrypted), get_key_registry()))[0] == data[:4]
+    assert decrypt_segmented(encrypted, get_key_registry()) == data
+
+
+def test_encrypt_stream_yields_one_segment_at_a_time():
+    chunks = list(encrypt_stream(BytesIO(b"x" * 10), get_key_registry().current, 4))
+
+    assert [len(chunk) for chunk in chunks] == [
+        HEADER_SIZE,
+        4 + TAG_SIZE,
+        4 + TAG_SIZE,
+        2 + TAG_SIZE,
+    ]
+
+
+def test_header_contains_key_id():
+    encrypted = encrypt(b"abcdefghij")
+
+    header, _ = Header.read(BytesIO(encrypted))
+    assert header.key_id == get_key_registry().current.key_id
+
+
+def test_decrypt_with_rotated_key(settings):
+    old_key = KeyRegistry([OTHER_KEY]).current
+    encrypted = encrypt(b"abcdefghij", key=old_key)
+    settings.FIELD_ENCRYPTION_KEYS = [settings.FIELD_ENCRYPTION_KEYS[0], OTHER_KEY]
+
+    assert get_key_registry().get(old_key.key_id).key == old_key.key
+    assert decrypt_segmented(encrypted, get_key_registry()) == b"abcdefghij"
+
+
+def test_decrypt_unknown_key():
+    encrypted = encrypt(b"abcdefghij")
+
+    with pytest.raises(ValueError):
+        decrypt_segmented(encrypted, KeyRegistry([OTHER_KEY]))
+
+
+def test_decrypt_version_1_header_by_trying_keys():
+    key = get_key_registry().current
+    header = Header(16, AES.get_random_bytes(7), version=1)
+    header_bytes = MAGIC + struct.pack("!BBI7s", 1, 0, 16, header.nonce_prefix)
+    cipher = _segment_cipher(key.key, header, header_bytes, 0, True)
+    encrypted = header_bytes + b"".join(cipher.encrypt_and_digest(b"version 1"))
+
+    registry = KeyRegistry([OTHER_KEY, key.key.hex()])
+    assert decrypt_segmented(encrypted, registry) == b"version 1"
+
+
+@pytest.mark.parametrize(
+    "tamper",
+    [
+        # Drop the last segment
+        lambda data: data[: -(2 + TAG_SIZE)],
+        # Swap the first two segments
+        lambda data: (
+            data[:HEADER_SIZE]
+            + data[HEADER_SIZE + 4 + TAG_SIZE : HEADER_SIZE + 2 * (4 + TAG_SIZE)]
+            + data[HEADER_SIZE : HEADER_SIZE + 4 + TAG_SIZE]
+            + data[HEADER_SIZE + 2 * (4 + TAG_SIZE) :]
+        ),
+        # Change the segment size in the header
+        lambda data: data[:15] + b"\x05" + data[16:],
+        # Flip a bit in the cypher text
+        lambda data: (
+            data[:HEADER_SIZE]
+            + bytes([data[HEADER_SIZE] ^ 1])
+            + data[HEADER_SIZE + 1 :]
+        ),
+    ],
+)
+def test_decrypt_tampered_data(tamper):
+    encrypted = encrypt(b"abcdefghij")
+
+    with pytest.raises(ValueError):
+        decrypt_segmented(tamper(encrypted), get_key_registry())
+
+
+@pytest.mark.parametrize(
+    "start,end", [(0, 10), (0, 1), (3, 5), (4, 8), (5, 9), (8, 10), (9, 10), (2, 50)]
+)
+def test_decrypt_range(start, end):
+    encrypted = encrypt(b"abcdefghij")
+
+    decrypted = list(decrypt_range(BytesIO(encrypted), get_key_registry(), start, end))
+
+    assert b"".join(decrypted) == b"abcdefghij"[start:end]
+
+
+def test_decrypt_range_decrypts_only_covering_segments():
+    encrypted = bytearray(encrypt(b"abcdefghij"))
+    # Corrupt the first segment, which is not needed for the range
+    encrypted[HEADER_SIZE] ^= 1
+
+    decrypted = list(decrypt_range(BytesIO(encrypted), get_key_registry(), 4, 10))
+
+    assert decrypted == [b"efgh", b"ij"]
+    with pytest.raises(ValueError):
+        list(decrypt_range(BytesIO(encrypted), get_key_registry(), 3, 10))
+
+
+def test_decrypt_range_truncated_file():
+    # Drop the last segment, so the second to last one is not the final one
+    encrypted = encrypt(b"abcdefghij")[: -(2 + TAG_SIZE)]
+
+    with pytest.raises(ValueError):
+        list(decrypt_range(BytesIO(encrypted), get_key_registry(), 4, 8))
+
+
+def test_get_decrypted_file_legacy_format():
+    cipher = AES.new(get_key_registry().current.key, AES.MODE_GCM)
+    cypher_text, tag = cipher.encrypt_and_digest(b"legacy content")
+    legacy_file = cipher.nonce + tag + cypher_text
+
+    assert not is_segmented(legacy_file)
+    assert get_decrypted_file(legacy_file, "file.txt").read() == b"legacy content"
+
+
+def test_attachment_is_stored_in_segmented_format(document, settings):
+    settings.ATTACHMENT_ENCRYPTION_SEGMENT_SIZE = 8
+    content = b"this is testing text"
+
+    attachment = Attachment.objects.create(
+        document=document,
+        media_type="text/plain",
+        file=SimpleUploadedFile("document1.txt", content, content_type="text/plain"),
+    )
+
+    stored = attachment.file.read()
+    assert is_segmented(stored)
+    # Header and three segments of at most 8 bytes
+    assert len(stored) == HEADER_SIZE + len(content) + 3 * TAG_SIZE
+    assert attachment.size == len(content)
+    keys = attachment.decryption_keys
+    assert get_decrypted_file(stored, "document1.txt", keys).read() == content
+
+
+def test_json_field_value_contains_key_id(document):
+    with connection.cursor() as cur:
+        cur.execute(
+            "SELECT content FROM %s WHERE id = %%s" % Document._meta.db_table,
+            [document.id],
+        )
+        value = cur.fetchone()[0]
+
+    header, _ = Header.read(BytesIO(value))
+    assert header.key_id == document.decryption_keys.current.key_id
+    assert decrypt_bytes(value, document.decryption_keys) == b"{}"
+
+
+def test_json_field_legacy_value(document):
+    cipher = AES.new(get_key_registry().current.key, AES.MODE_GCM)
+    cypher_text, tag = cipher.encrypt_and_digest(b'{"legacy": true}')
+    with connection.cursor() as cur:
+        cur.execute(
+            "UPDATE %s SET content = %%s WHERE id = %%s" % Document._meta.db_table,
+            [cipher.nonce + tag + cypher_text, document.id],
+        )
+
+    document.refresh_from_db()
+    assert document.content == {"legacy": True}
+
+
+def test_document_data_key_is_wrapped_with_master_key(document):
+    header, _ = Header.read(BytesIO(bytes(document.data_key)))
+    assert header.key_id == get_key_registry().current.key_id
+
+    data_key = unwrap_data_key(document.data_key, get_key_registry())
+    assert document.encryption_keys.current.key == data_key.key
+    assert get_key_registry().get(data_key.key_id) is None
+
+
+def test_attachment_is_encrypted_with_document_data_key(document):
+    attachment = Attachment.objects.create(
+        document=document,
+        media_type="text/plain",
+        file=SimpleUploadedFile("document1.txt", b"text", content_type="text/plain"),
+    )
+
+    header, _ = Header.read(attachment.file)
+    assert header.key_id == document.encryption_keys.current.key_id
+
+
+def test_document_without_data_key(document):
+    content = encrypt(b'{"legacy": true}')
+    Document.objects.filter(pk=document.pk).update(data_key=None)
+    with connection.cursor() as cur:
+        cur.execute(
+            "UPDATE %s SET content = %%s WHERE id = %%s" % Document._meta.db_table,
+            [content, document.id],
+        )
+
+    document = Document.objects.get(pk=document.pk)
+    assert document.content == {"legacy": True}
+    assert document.decryption_keys is get_key_registry()
+
+    # The data key is stored as soon as something is encrypted with it
+    keys = document.encryption_keys
+    document.refresh_from_db()
+    assert document.data_key is not None
+    assert document.decryption_keys.current.key == keys.current.key
+    assert document.content == {"legacy": True}
+
+
+def test_rewrap_data_key_with_rotated_master_key(document, settings):
+    document.content = {"secret": 1}
+    document.save()
+    data_key = unwrap_data_key(document.data_key, get_key_registry())
+
+    settings.FIELD_ENCRYPTION_KEYS = [OTHER_KEY, settings.FIELD_ENCRYPTION_KEYS[0]]
+    Document.objects.filter(pk=document.pk).update(
+        data_key=wrap_data_key(data_key, get_key_registry().current)
+    )
+    settings.FIELD_ENCRYPTION_KEYS = [OTHER_KEY]
+
+    assert Document.objects.get(pk=document.pk).content == {"secret": 1}
+
+
+COMPRESSIBLE = b"abcdefghij" * 100
+
+
+def test_compressed_stream_roundtrip():
+    encrypted = b"".join(
+        encrypt_stream(BytesIO(COMPRESSIBLE), get_key_registry().current, 16, True)
+    )
+
+    header, _ = Header.read(BytesIO(encrypted))
+    assert header.flags & FLAG_COMPRESSED
+    assert len(encrypted) < len(COMPRESSIBLE)
+    assert decrypt_segmented(encrypted, get_key_registry()) == COMPRESSIBLE
+    # Decompressed chunks are at most a segment long
+    chunks = list(decrypt_stream(BytesIO(encrypted), get_key_registry()))
+    assert max(len(chunk) for chunk in chunks) == 16
+
+
+@pytest.mark.parametrize("start,end", [(0, 10), (15, 17), (990, 1000), (995, 2000)])
+def test_decrypt_range_compressed(start, end):
+    encrypted = b"".join(
+        encrypt_stream(BytesIO(COMPRESSIBLE), get_key_registry().current, 16, True)
+    )
+
+    decrypted = decrypt_range(BytesIO(encrypted), get_key_registry(), start, end)
+
+    assert b"".join(decrypted) == COMPRESSIBLE[start:end]
+
+
+def test_encrypt_bytes_compressed():
+    encrypted = encrypt_bytes(COMPRESSIBLE, get_key_registry().current, True)
+
+    assert len(encrypted) < len(COMPRESSIBLE)
+    assert decrypt_bytes(encrypted, get_key_registry()) == COMPRESSIBLE
+
+
+@pytest.mark.parametrize(
+    "content_type,compressed", [("text/plain", True), ("image/png", False)]
+)
+def test_attachment_compression(document, settings, content_type, compressed):
+    settings.ENCRYPTION_COMPRESSION = True
+
+    attachment = Attachment.objects.create(
+        document=document,
+        media_type=content_type,
+        file=SimpleUploadedFile("file", COMPRESSIBLE, content_type=content_type),
+    )
+
+    header, _ = Header.read(attachment.file)
+    assert bool(header.flags & FLAG_COMPRESSED) == compressed
+    assert attachment.size == len(COMPRESSIBLE)
+    attachment.file.seek(0)
+    keys = attachment.decryption_keys
+    assert get_decrypted_file(attachment.file.read(), "", keys).read() == COMPRESSIBLE
+
+
+def test_json_field_compression(document, settings):
+    settings.ENCRYPTION_COMPRESSION = True
+    document.content = {"answers": ["yes"] * 1000}
+    document.save()
+
+    with connection.cursor() as cur:
+        cur.execute(
+            "SELECT content FROM %s WHERE id = %%s" % Document._meta.db_table,
+            [document.id],
+        )
+        value = bytes(cur.fetchone()[0])
+
+    header, _ = Header.read(BytesIO(value))
+    assert header.flags & FLAG_COMPRESSED
+    assert len(value) < 1000
+    assert Document.objects.get(pk=document.pk).content == document.content
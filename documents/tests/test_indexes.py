@@ -0,0 +1,148 @@
+import pytest
+from django.db import connection
+from django.utils import timezone
+
+from documents.api.filtersets import DocumentFilterSet
+from documents.api.querysets import get_document_metadata_queryset
+from documents.metadata_indexes import get_metadata_index
+from documents.models import Document
+from documents.tests.factories import DocumentFactory
+from services.tests.factories import IndexedMetadataKeyFactory, ServiceFactory
+from users.tests.factories import UserFactory
+
+
+@pytest.fixture
+def documents():
+    services = ServiceFactory.create_batch(2)
+    users = UserFactory.create_batch(10)
+    for service in services:
+        for user in users:
+            DocumentFactory(service=service, user=user)
+    DocumentFactory(delete_after=timezone.now().date())
+    columns = ", ".join(
+        field.column for field in Document._meta.concrete_fields if field.name != "id"
+    )
+    with connection.cursor() as cursor:
+        # Copies of the documents give the planner statistics of a larger table
+        cursor.execute(
+            f"INSERT INTO documents_document (id, {columns})"
+            f" SELECT gen_random_uuid(), {columns}"
+            " FROM documents_document, generate_series(1, 100)"
+        )
+        cursor.execute("ANALYZE documents_document")
+        # The tables of the tests are still so small that scanning them is cheap
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        cursor.execute("SET LOCAL enable_bitmapscan = off")
+    return services, users
+
+
+@pytest.mark.parametrize(
+    "ordering", ["-updated_at", "updated_at"], ids=["descending", "ascending"]
+)
+def test_service_listing_uses_index(documents, ordering):
+    services, _ = documents
+    queryset = Document.objects.filter(service=services[0]).order_by(ordering)[:20]
+
+    plan = queryset.explain()
+
+    assert "document_service_updated_idx" in plan
+    assert "Sort" not in plan
+
+
+def test_service_user_listing_uses_index(documents):
+    services, users = documents
+    queryset = Document.objects.filter(service=services[0], user=users[0]).order_by(
+        "-updated_at"
+    )[:20]
+
+    plan = queryset.explain()
+
+    assert "document_svc_user_updated_idx" in plan
+    assert "Sort" not in plan
+
+
+def test_user_metadata_listing_uses_index(documents):
+    _, users = documents
+    queryset = get_document_metadata_queryset(users[0]).order_by(
+        "-status_timestamp", "-id"
+    )[:20]
+
+    plan = queryset.explain()
+
+    assert "document_user_status_ts_idx" in plan
+    assert "Sort" not in plan
+
+
+def test_transaction_lookup_uses_index(documents):
+    services, _ = documents
+    queryset = Document.objects.filter(service=services[0], transaction_id="1234")
+
+    plan = queryset.explain()
+
+    assert "document_svc_transaction_idx" in plan
+
+
+def test_expired_documents_lookup_uses_index(documents):
+    queryset = Document.objects.filter(delete_after__lt=timezone.now())
+
+    plan = queryset.explain()
+
+    assert "document_delete_after_idx" in plan
+
+
+@pytest.mark.parametrize(
+    "lookfor_mode,index",
+    [
+        ("exact", "document_metadata_path_idx"),
+        (None, "document_metadata_folded_idx"),
+    ],
+)
+def test_lookfor_uses_index(documents, lookfor_mode, index):
+    params = {"lookfor": "handler:Matti, round:2"}
+    if lookfor_mode:
+        params["lookfor_mode"] = lookfor_mode
+
+    queryset = DocumentFilterSet(params, queryset=Document.objects.all()).qs
+
+    assert index in queryset.explain()
+
+
+def test_lookfor_exact_mode_uses_single_containment(documents):
+    params = {"lookfor": "handler:Matti, round:2", "lookfor_mode": "exact"}
+
+    queryset = DocumentFilterSet(params, queryset=Document.objects.all()).qs
+
+    assert str(queryset.query).count("@>") == 1
+
+
+def test_lookfor_scalars_use_key_index(documents):
+    # Numbers aren't matched with containment, but the keys have to exist
+    queryset = DocumentFilterSet(
+        {"lookfor": "round:2"}, queryset=Document.objects.all()
+    ).qs
+
+    assert "document_metadata_idx" in queryset.explain()
+
+
+@pytest.mark.parametrize("lookfor_mode", ["exact", None])
+def test_lookfor_indexed_metadata_key_uses_index(documents, rf, lookfor_mode):
+    services, _ = documents
+    service = services[0]
+    IndexedMetadataKeyFactory(service=service, key="handler")
+    index = get_metadata_index(service.id, "handler")
+    with connection.cursor() as cursor:
+        # The table can't be altered with the foreign keys of the rows unchecked
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+    with connection.schema_editor() as schema_editor:
+        schema_editor.add_index(Document, index)
+    request = rf.get("/")
+    request._service = service
+    params = {"lookfor": "handler:Matti"}
+    if lookfor_mode:
+        params["lookfor_mode"] = lookfor_mode
+
+    queryset = DocumentFilterSet(
+        params, queryset=Document.objects.filter(service=service), request=request
+    ).qs
+
+    assert index.name in queryset.explain()
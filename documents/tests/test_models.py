@@ -8,6 +8,7 @@ from django.test import override_settings
 
 from atv.exceptions import MaximumFileSizeExceededException
 
+from ..fields import EncryptedValue
 from ..models import Attachment, Document
 from ..utils import get_decrypted_file
 from .utils import generate_tos_uuid
@@ -35,12 +36,38 @@ def test_content_is_encrypted(service, user):
         row = cur.fetchone()
         assert b"test_content" not in row[0]
 
-    data = field.decrypt(row[0])
+    data = field.decrypt(row[0], document.decryption_keys)
     assert data == content
     assert document.content == data
     assert isinstance(document.content, dict)
 
 
+def test_content_is_decrypted_on_access(document):
+    document.content = {"field": "test_content"}
+    document.save()
+
+    document = Document.objects.get(pk=document.pk)
+    assert isinstance(document.__dict__["content"], EncryptedValue)
+    # Saving without accessing the content keeps it as it is
+    document.status = "handled"
+    document.save()
+
+    document = Document.objects.get(pk=document.pk)
+    assert document.content == {"field": "test_content"}
+    assert document.__dict__["content"] == {"field": "test_content"}
+
+
+@pytest.mark.parametrize("json_engine", ["json", "orjson"])
+def test_content_with_lone_surrogate(document, settings, json_engine):
+    settings.JSON_ENGINE = json_engine
+    # Accepted by the JSON parser of the API, but not encodable as UTF-8
+    document.content = {"field": "\ud800"}
+    document.save()
+
+    document = Document.objects.get(pk=document.pk)
+    assert document.content == {"field": "\ud800"}
+
+
 @override_settings(MAX_FILE_SIZE=50)
 def test_attachment_file_size_exceeded(document):
     with pytest.raises(MaximumFileSizeExceededException):
@@ -70,7 +97,9 @@ def test_attachment_is_encrypted(document):
     file_content = attachment.file.read()
     assert b"this is testing text" not in file_content
 
-    data = get_decrypted_file(file_content, "document.txt").read()
+    data = get_decrypted_file(
+        file_content, "document.txt", attachment.decryption_keys
+    ).read()
     assert data == b"this is testing text"
 
 
@@ -1,5 +1,20 @@
+from contextlib import contextmanager, nullcontext
+from unittest import mock
 from uuid import uuid4
 
 
 def generate_tos_uuid():
     return str(uuid4()).replace("-", "")
+
+
+@contextmanager
+def mock_virus_scan(signature=None):
+    """Replace the clamd virus scan, which isn't available in tests, with a scan
+    finding the given signature or nothing."""
+    scan = mock.Mock()
+    scan.finish.return_value = signature
+    with (
+        mock.patch("documents.utils.virus_scan", return_value=nullcontext(scan)),
+        mock.patch("documents.utils.get_signature_version", return_value="1"),
+    ):
+        yield scan
@@ -1,57 +1,450 @@
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from io import BytesIO
+from itertools import chain
+from tempfile import SpooledTemporaryFile
+from typing import ContextManager, Iterator, Optional
 
-from Crypto.Cipher import AES
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files import File
-from pyclamd import pyclamd
+from django.db import transaction
 
 from atv.exceptions import MaliciousFileException
-from atv.settings import FIELD_ENCRYPTION_KEYS
+from utils.clamd import ClamdPool, InstreamScan
+from utils.files import TeeFile
+
+from .encryption import (
+    FLAG_COMPRESSED,
+    HEADER_MAX_SIZE,
+    MAGIC,
+    Header,
+    decrypt_bytes,
+    decrypt_range,
+    decrypt_stream,
+    is_segmented,
+)
+from .fields import EncryptedFileField, should_compress_file
+from .keys import KeyRegistry, get_key_registry
+
+logger = logging.getLogger(__name__)
+
+SCAN_VERDICT_CACHE_PREFIX = "scan-verdict"
+CLEAN_VERDICT = "clean"
+
+
+def get_upload_sha256(upload) -> str:
+    """Get the SHA-256 of an uploaded file, which the upload handlers calculate while
+    the file is received. Files without it, e.g. ones not uploaded in a request, are
+    read once for it and the digest is kept in the file."""
+    if getattr(upload, "sha256", None) is None:
+        upload.seek(0)
+        sha256 = hashlib.sha256()
+        while chunk := upload.read(settings.ATTACHMENT_ENCRYPTION_SEGMENT_SIZE):
+            sha256.update(chunk)
+        upload.seek(0)
+        upload.sha256 = sha256.hexdigest()
+    return upload.sha256
+
+
+def get_content_digest(sha256: str) -> str:
+    """Get a digest of a content from its SHA-256.
+
+    The digest is an HMAC with a key derived from SECRET_KEY, so it doesn't reveal
+    whether a file with a known content has been stored.
+    """
+    key = hashlib.sha256(b"atv-content-digest:" + settings.SECRET_KEY.encode())
+    return hmac.new(key.digest(), bytes.fromhex(sha256), hashlib.sha256).hexdigest()
 
 
 def get_attachment_file_path(instance, filename):
     """File will be uploaded to
-    MEDIA_ROOT/ATTACHMENT_MEDIA_DIR/<document_id>/<filename>"""
-    return f"{settings.ATTACHMENT_MEDIA_DIR}/{instance.document.id}/{filename}"
+    MEDIA_ROOT/ATTACHMENT_MEDIA_DIR/<ab>/<cd>/<document_id>/<filename>"""
+    return f"{get_document_attachment_directory_path(instance.document)}{filename}"
+
+
+def get_blob_file_path(instance, filename):
+    """Blobs are stored by their digest to
+    MEDIA_ROOT/ATTACHMENT_BLOB_MEDIA_DIR/<digest[:2]>/<digest>.<random>
+
+    The random suffix keeps concurrent uploads of the same content from writing
+    to the same file, as object storages can't create files atomically."""
+    return (
+        f"{settings.ATTACHMENT_BLOB_MEDIA_DIR}/{instance.digest[:2]}/"
+        f"{instance.digest}.{uuid.uuid4().hex}"
+    )
+
+
+def get_document_fan_out_path(document_id) -> str:
+    """Get the two levels of directories a document's attachments are spread to,
+    "<ab>/<cd>", from a hash of the document's ID. This keeps the number of entries
+    in each directory small however many documents there are."""
+    digest = hashlib.sha256(str(document_id).encode()).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}"
 
 
 def get_document_attachment_directory_path(instance):
     """Get the root directory for a document's attachments.
 
+    :type instance: documents.models.Document
+    """
+    fan_out = get_document_fan_out_path(instance.id)
+    return f"{settings.ATTACHMENT_MEDIA_DIR}/{fan_out}/{instance.id}/"
+
+
+def get_legacy_document_attachment_directory_path(instance):
+    """Get the directory where a document's attachments were stored before they
+    were spread to hashed directories. Used until move_attachment_files has moved
+    all the files.
+
     :type instance: documents.models.Document
     """
     return f"{settings.ATTACHMENT_MEDIA_DIR}/{instance.id}/"
 
 
-def get_decrypted_file(file, file_name):
-    nonce = file[:16]
-    # Perform same nonce checks here as Pycryptodome, so we can raise a more
-    # user-friendly error message
-    if not isinstance(nonce, (bytes, bytearray, memoryview)) or len(nonce) != 16:
-        raise ValueError("Data is corrupted.")
-    tag = file[16:32]
-    cypher_text = file[32:]
-    counter = 0
-    num_keys = len(FIELD_ENCRYPTION_KEYS)
-    while counter < num_keys:
-        cipher = AES.new(
-            bytes.fromhex(FIELD_ENCRYPTION_KEYS[counter]), AES.MODE_GCM, nonce=nonce
+def get_decrypted_file(file, file_name, keys: Optional[KeyRegistry] = None):
+    plaintext = decrypt_bytes(file, keys or get_key_registry())
+    return File(BytesIO(plaintext), name=file_name)
+
+
+def iter_decrypted_file(file, byte_range=None) -> Iterator[bytes]:
+    """Decrypt a stored attachment file incrementally.
+
+    The key is resolved and the first segment verified before returning, so a wrong
+    key or corrupted data raises before anything has been streamed to the client.
+    The returned generator yields the plaintext one segment at a time and closes the
+    file when it's exhausted or closed.
+
+    If a byte range (start, end) with an exclusive end is given, only the segments
+    covering it are decrypted.
+
+    The file is decrypted with the keys of the model instance it belongs to.
+
+    :type file: django.db.models.fields.files.FieldFile
+    """
+    file.open("rb")
+    try:
+        segments = _decrypt_file_segments(file, byte_range)
+    except Exception:
+        file.close()
+        raise
+    return _close_when_done(segments, file)
+
+
+def _decrypt_file_segments(file, byte_range) -> Iterator[bytes]:
+    keys = file.instance.decryption_keys
+    segmented = is_segmented(file.read(len(MAGIC)))
+    file.seek(0)
+    if not segmented:
+        # Legacy files are a single AES-GCM blob which can only be verified as a
+        # whole, so they have to be decrypted in memory.
+        plaintext = get_decrypted_file(file.read(), file.name, keys).read()
+        if byte_range:
+            plaintext = plaintext[byte_range[0] : byte_range[1]]
+        return iter([plaintext])
+
+    if byte_range:
+        segments = decrypt_range(file, keys, *byte_range)
+    else:
+        segments = decrypt_stream(file, keys)
+    return chain([next(segments, b"")], segments)
+
+
+def read_file_header(file) -> Optional[Header]:
+    """Read the header of a stored file, or None if it's in the legacy format.
+
+    :type file: django.db.models.fields.files.FieldFile
+    """
+    with file.open("rb"):
+        data = file.read(HEADER_MAX_SIZE)
+    if not is_segmented(data):
+        return None
+    return Header.read(BytesIO(data))[0]
+
+
+def reencrypt_file(file):
+    """Re-encrypt a stored file with the current key of its instance.
+
+    The file is stored under a new name, and the old one is deleted once the
+    current transaction has been committed. The plaintext is spooled to a temporary
+    file, so large files aren't held in memory. A compressed file stays compressed.
+
+    :type file: django.db.models.fields.files.FieldFile
+    """
+    header = read_file_header(file)
+    compress = header is not None and bool(header.flags & FLAG_COMPRESSED)
+    old_name = file.name
+    storage = file.storage
+    with SpooledTemporaryFile(settings.ATTACHMENT_ENCRYPTION_SEGMENT_SIZE) as plain:
+        for chunk in iter_decrypted_file(file):
+            plain.write(chunk)
+        plain.seek(0)
+        key = file.instance.encryption_keys.current
+        file.save(
+            os.path.basename(old_name),
+            EncryptedFileField.encrypt_file(plain, key, compress),
+            save=False,
         )
-        try:
-            plaintext = cipher.decrypt_and_verify(cypher_text, tag)
-        except ValueError:
-            counter += 1
-            continue
-        return File(BytesIO(plaintext), name=file_name)
-    raise ValueError("AES Key incorrect or data is corrupted")
+    transaction.on_commit(lambda: storage.delete(old_name))
+
+
+def _close_when_done(segments, file) -> Iterator[bytes]:
+    try:
+        yield from segments
+    finally:
+        file.close()
 
 
 # TODO: Consider scanning files on download as well to improve chance of catching most
 #  recent threats to protect users if clamav virus databases didn't include the virus'
 #  profile at the time of upload
-# Note this function is mocked in testing because there is no clamav connection during
-# pipeline testing
-def virus_scan_attachment_file(file_data):
-    cd = pyclamd.ClamdNetworkSocket(host=settings.CLAMAV_HOST)
-    if cd.scan_stream(file_data) is not None:
-        raise MaliciousFileException
+@lru_cache(maxsize=1)
+def _build_clamd_pool(host, port, size, timeout, wait_timeout) -> ClamdPool:
+    return ClamdPool(host, port, size, timeout, wait_timeout)
+
+
+def get_clamd_pool() -> ClamdPool:
+    """Get the pool of clamd connections of the process."""
+    return _build_clamd_pool(
+        settings.CLAMAV_HOST,
+        settings.CLAMAV_PORT,
+        settings.CLAMAV_POOL_SIZE,
+        settings.CLAMAV_TIMEOUT,
+        settings.CLAMAV_POOL_WAIT_TIMEOUT,
+    )
+
+
+# Note these functions are mocked in testing because there is no clamav connection
+# during pipeline testing
+def virus_scan() -> ContextManager[InstreamScan]:
+    return get_clamd_pool().scan()
+
+
+def get_signature_version() -> str:
+    return get_clamd_pool().signature_version()
+
+
+class ScanVerdictCacheStats:
+    """Hit rate of the scan verdict cache in this process and the scanning time it
+    has saved, estimated with the average time of the files actually scanned."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.total_scan_time = 0.0
+
+    def record_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def record_miss(self, scan_time: float):
+        with self._lock:
+            self.misses += 1
+            self.total_scan_time += scan_time
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            average_scan_time = self.total_scan_time / self.misses if self.misses else 0
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0,
+                "time_saved": self.hits * average_scan_time,
+            }
+
+
+scan_verdict_cache_stats = ScanVerdictCacheStats()
+
+
+def _get_scan_verdict_cache_key(digest: str) -> str:
+    return f"{SCAN_VERDICT_CACHE_PREFIX}:{get_signature_version()}:{digest}"
+
+
+def is_known_clean(digest: str) -> bool:
+    """Check whether a content has been found clean with the current signatures.
+
+    :param digest: Digest of the content from get_content_digest.
+    """
+    return cache.get(_get_scan_verdict_cache_key(digest)) == CLEAN_VERDICT
+
+
+def _cache_clean_verdict(digest: str):
+    cache.set(
+        _get_scan_verdict_cache_key(digest),
+        CLEAN_VERDICT,
+        settings.SCAN_VERDICT_CACHE_TIMEOUT,
+    )
+
+
+def _scan_upload(upload, store) -> Optional[str]:
+    """Virus scan an upload while passing it to `store` for storing.
+
+    The upload is read only once: every chunk read from it is passed both to
+    `store` and to clamd. Returns the name of the found signature or None.
+
+    The same files tend to be uploaded many times, so clean verdicts are cached by
+    the digest of the content and the version of clamd's signature database. The
+    uploads of requests are hashed by the upload handlers while they're received,
+    so files already known to be clean are only stored. Other files are hashed in
+    the same pass as they're scanned.
+    """
+    started = time.monotonic()
+    upload.seek(0)
+    sha256 = getattr(upload, "sha256", None)
+    verdict_cached = sha256 is not None and is_known_clean(get_content_digest(sha256))
+
+    if verdict_cached:
+        store(upload)
+        signature = None
+        scan_verdict_cache_stats.record_hit()
+    else:
+        consumers = []
+        if sha256 is None:
+            hasher = hashlib.sha256()
+            consumers.append(hasher.update)
+        with virus_scan() as scan:
+            store(TeeFile(upload, scan.send, *consumers))
+            signature = scan.finish()
+        scan_verdict_cache_stats.record_miss(time.monotonic() - started)
+        if signature is None:
+            _cache_clean_verdict(get_content_digest(sha256 or hasher.hexdigest()))
+
+    logger.info(
+        "Attachment file scanned",
+        extra={
+            "attachment_size": upload.size,
+            "duration": time.monotonic() - started,
+            "infected": signature is not None,
+            "verdict_cached": verdict_cached,
+            "scan_verdict_cache": scan_verdict_cache_stats.as_dict(),
+        },
+    )
+    return signature
+
+
+def _store_encrypted(field_file, upload):
+    # The data key of the instance has to exist already when storing in a thread
+    key = field_file.instance.encryption_keys.current
+    compress = should_compress_file(
+        field_file.file, getattr(field_file.instance, "media_type", "")
+    )
+    field_file.save(
+        field_file.name,
+        EncryptedFileField.encrypt_file(upload, key, compress),
+        save=False,
+    )
+
+
+def _discard(upload):
+    while upload.read(settings.ATTACHMENT_ENCRYPTION_SEGMENT_SIZE):
+        pass
+
+
+def save_scanned_file(field_file):
+    """Encrypt and store an uploaded file while virus scanning it.
+
+    If a virus is found, the stored file is deleted and MaliciousFileException is
+    raised.
+
+    :type field_file: django.db.models.fields.files.FieldFile
+    """
+    upload = field_file.file
+    try:
+        signature = _scan_upload(upload, partial(_store_encrypted, field_file))
+    except Exception:
+        if field_file._committed:
+            field_file.delete(save=False)
+        raise
+    if signature is not None:
+        field_file.delete(save=False)
+        raise MaliciousFileException()
+
+
+def scan_uploaded_file(upload):
+    """Virus scan an uploaded file without storing it, e.g. because the same content
+    is already stored. Raises MaliciousFileException if a virus is found."""
+    if _scan_upload(upload, _discard) is not None:
+        raise MaliciousFileException()
+
+
+def save_scanned_files(field_files, scan_only=()):
+    """Run save_scanned_file for several uploaded files, and scan_uploaded_file for
+    the uploads in `scan_only`, concurrently.
+
+    The files are scanned and stored in threads, at most as many at a time as there
+    are clamd connections in the pool. If any of them fails, the files stored for
+    the others are deleted and the first error is raised, so either all or none of
+    the files are stored.
+
+    The threads don't touch the database, so the attachments can be saved in the
+    transaction of the request afterwards.
+
+    :type field_files: list[django.db.models.fields.files.FieldFile]
+    """
+    jobs = [partial(save_scanned_file, field_file) for field_file in field_files]
+    jobs += [partial(scan_uploaded_file, upload) for upload in scan_only]
+    if len(jobs) <= 1:
+        for job in jobs:
+            job()
+        return
+
+    max_workers = min(len(jobs), settings.CLAMAV_POOL_SIZE)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(job) for job in jobs]
+
+    errors = [future.exception() for future in futures if future.exception()]
+    if errors:
+        for field_file, future in zip(field_files, futures):
+            if future.exception() is None:
+                field_file.delete(save=False)
+        raise errors[0]
+
+
+def save_files_for_scanning(field_files):
+    """Encrypt and store uploaded files without scanning them.
+
+    The attachments of the files should be left pending for a deferred scan, so
+    they aren't served before the scan has found them clean.
+
+    :type field_files: list[django.db.models.fields.files.FieldFile]
+    """
+    for field_file in field_files:
+        _store_encrypted(field_file, field_file.file)
+
+
+def scan_attachment_file(attachment) -> Optional[str]:
+    """Virus scan the stored file of an attachment.
+
+    The file is decrypted segment by segment while it's being sent to clamd.
+    Returns the name of the found signature or None if the file is clean.
+
+    The file of a blob isn't scanned if its content is already known to be clean,
+    and clean verdicts are cached the same way as when scanning uploads.
+
+    :type attachment: documents.models.Attachment
+    """
+    digest = attachment.blob.digest if attachment.blob_id else None
+    if digest is not None and is_known_clean(digest):
+        scan_verdict_cache_stats.record_hit()
+        return None
+
+    started = time.monotonic()
+    sha256 = hashlib.sha256()
+    with virus_scan() as scan:
+        for chunk in iter_decrypted_file(attachment.file):
+            scan.send(chunk)
+            sha256.update(chunk)
+        signature = scan.finish()
+    scan_verdict_cache_stats.record_miss(time.monotonic() - started)
+    if signature is None:
+        _cache_clean_verdict(digest or get_content_digest(sha256.hexdigest()))
+    return signature
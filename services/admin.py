@@ -6,7 +6,7 @@ from guardian.admin import GuardedModelAdmin
 from rest_framework_api_key.admin import APIKeyModelAdmin
 from rest_framework_api_key.models import APIKey
 
-from .models import Service, ServiceAPIKey, ServiceClientId
+from .models import IndexedMetadataKey, Service, ServiceAPIKey, ServiceClientId
 
 
 @admin.register(ServiceClientId)
@@ -25,11 +25,16 @@ class ServiceClientIdInline(admin.StackedInline):
     extra = 0
 
 
+class IndexedMetadataKeyInline(admin.TabularInline):
+    model = IndexedMetadataKey
+    extra = 0
+
+
 @admin.register(Service)
 class ServiceAdmin(GuardedModelAdmin):
     list_display = ("name", "short_description", "api_key_count")
     search_fields = ("name",)
-    inlines = (ServiceClientIdInline,)
+    inlines = (ServiceClientIdInline, IndexedMetadataKeyInline)
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
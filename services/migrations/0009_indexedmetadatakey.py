@@ -0,0 +1,62 @@
+# Generated by Django 5.2.14 on 2026-10-18 04:53
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("services", "0008_add_display_names_and_service_link"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IndexedMetadataKey",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "key",
+                    models.CharField(
+                        help_text="Metadata key the documents of the service are filtered by. The index of the key is created by the sync_metadata_indexes command.",
+                        max_length=100,
+                        validators=[
+                            django.core.validators.RegexValidator(
+                                "__|,|:",
+                                inverse_match=True,
+                                message="Enter a top-level key.",
+                            )
+                        ],
+                        verbose_name="key",
+                    ),
+                ),
+                (
+                    "service",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="indexed_metadata_keys",
+                        to="services.service",
+                        verbose_name="service",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "indexed metadata key",
+                "verbose_name_plural": "indexed metadata keys",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("service", "key"),
+                        name="unique_service_indexed_metadata_key",
+                    )
+                ],
+            },
+        ),
+    ]
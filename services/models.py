@@ -1,4 +1,5 @@
 from django.conf import settings
+from django.core.validators import RegexValidator
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from rest_framework_api_key.models import AbstractAPIKey
@@ -73,3 +74,37 @@ class ServiceClientId(models.Model):
 
     def __str__(self) -> str:
         return f"{self.service.name}: {self.client_id}"
+
+
+class IndexedMetadataKey(models.Model):
+    service = models.ForeignKey(
+        Service,
+        on_delete=models.CASCADE,
+        related_name="indexed_metadata_keys",
+        verbose_name=_("service"),
+    )
+    key = models.CharField(
+        max_length=100,
+        validators=[
+            RegexValidator(
+                r"__|,|:", inverse_match=True, message=_("Enter a top-level key.")
+            )
+        ],
+        verbose_name=_("key"),
+        help_text=_(
+            "Metadata key the documents of the service are filtered by. The index of"
+            " the key is created by the sync_metadata_indexes command."
+        ),
+    )
+
+    class Meta:
+        verbose_name = _("indexed metadata key")
+        verbose_name_plural = _("indexed metadata keys")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["service", "key"], name="unique_service_indexed_metadata_key"
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.service.name}: {self.key}"
@@ -1,6 +1,11 @@
 import factory
 
-from services.models import Service, ServiceAPIKey, ServiceClientId
+from services.models import (
+    IndexedMetadataKey,
+    Service,
+    ServiceAPIKey,
+    ServiceClientId,
+)
 
 
 class ServiceFactory(factory.django.DjangoModelFactory):
@@ -35,3 +40,11 @@ class ServiceClientIdFactory(factory.django.DjangoModelFactory):
 
     class Meta:
         model = ServiceClientId
+
+
+class IndexedMetadataKeyFactory(factory.django.DjangoModelFactory):
+    service = factory.SubFactory(ServiceFactory)
+    key = factory.Sequence(lambda n: "key-%d" % n)
+
+    class Meta:
+        model = IndexedMetadataKey
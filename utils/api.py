@@ -1,7 +1,335 @@
+import base64
+import json
+from collections import OrderedDict
+from datetime import datetime
+from functools import partial
+from typing import Optional
+
+from django.conf import settings
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
 from rest_framework.pagination import PageNumberPagination as DRFPageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from atv.exceptions import InvalidFieldException
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination with keyset predicates on (ordering field, id).
+
+    A page is fetched with a predicate on the position of the last row of the
+    previous page instead of an offset, so the cost of a page doesn't depend on how
+    deep it is, and rows inserted or deleted meanwhile don't shift the pages. The
+    ordering field is the first field the queryset is ordered by, which has to be
+    one of `ordering_fields`.
+
+    There's no count, as counting is what makes deep pages of large results slow.
+    """
+
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def __init__(self, ordering_fields=(), page_size=None):
+        self.ordering_fields = ordering_fields
+        if page_size:
+            self.page_size = page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.field, self.descending = self.get_ordering(queryset)
+        self.nullable = queryset.model._meta.get_field(self.field).null
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor["reverse"])
+        descending = self.descending != reverse
+
+        # The default placement of nulls lets the database scan the index either way
+        queryset = queryset.order_by(
+            f"-{self.field}" if descending else self.field,
+            "-pk" if descending else "pk",
+        )
+        if cursor:
+            queryset = queryset.filter(
+                self.after(cursor["value"], cursor["pk"], descending)
+            )
+
+        rows = list(queryset[: self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        self.page = rows[: self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        return self.page
+
+    def get_ordering(self, queryset) -> tuple[str, bool]:
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        field = ordering[0] if ordering else None
+        if isinstance(field, str) and field.lstrip("-") in self.ordering_fields:
+            return field.lstrip("-"), field.startswith("-")
+        raise InvalidFieldException(
+            detail="Cursor pagination is only supported when sorting by "
+            + ", ".join(self.ordering_fields)
+        )
+
+    def after(self, value, pk, descending: bool) -> Q:
+        """Predicate of the rows after the position (value, pk) in the ordering.
+        Nulls are ordered like Postgres does by default, as if they were larger
+        than any value.
+
+        The bound on the ordering field alone lets the database scan the composite
+        index of (field, id) from the position instead of filtering all the rows.
+        """
+        lookup = "lt" if descending else "gt"
+        field = self.field
+        is_null = Q(**{f"{field}__isnull": True})
+        if value is None:
+            after = is_null & Q(**{f"pk__{lookup}": pk})
+            return after | ~is_null if descending else after
+        tie = Q(**{field: value, f"pk__{lookup}": pk})
+        after = Q(**{f"{field}__{lookup}e": value}) & (
+            Q(**{f"{field}__{lookup}": value}) | tie
+        )
+        return after | is_null if self.nullable and not descending else after
+
+    def encode_cursor(self, row, reverse: bool) -> str:
+        value = getattr(row, self.field)
+        position = {
+            "value": value.isoformat() if value is not None else None,
+            "pk": str(row.pk),
+            "reverse": reverse,
+        }
+        cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request) -> Optional[dict]:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if cursor["value"] is not None:
+                cursor["value"] = datetime.fromisoformat(cursor["value"])
+            cursor["reverse"] = bool(cursor["reverse"])
+            cursor["pk"] = str(cursor["pk"])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def get_next_link(self) -> Optional[str]:
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self) -> Optional[str]:
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict(
+                [
+                    ("next", self.get_next_link()),
+                    ("previous", self.get_previous_link()),
+                    ("results", data),
+                ]
+            )
+        )
+
+
+class CountType:
+    EXACT = "exact"
+    ESTIMATED = "estimated"
+    CAPPED = "capped"
+
+    choices = (EXACT, ESTIMATED, CAPPED)
+
+
+class InexactPage(Page):
+    """Page of a paginator whose count isn't exact, which knows whether there are
+    more rows from the extra row fetched with it."""
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+
+class CountingPaginator(Paginator):
+    """Paginator which counts the rows exactly, or above `count_limit` rows either
+    estimates the count with the plan of the query or caps it to the limit.
+
+    The pages of inexact counts aren't bounded by the count, which may be lower
+    than the number of rows.
+    """
+
+    def __init__(self, object_list, per_page, count_type=CountType.EXACT, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.requested_count_type = count_type
+        self.count_limit = settings.PAGINATION_COUNT_LIMIT
+
+    def estimate_count(self) -> int:
+        plan = json.loads(self.object_list.order_by().explain(format="json"))
+        return plan[0]["Plan"]["Plan Rows"]
+
+    @cached_property
+    def count_and_type(self) -> tuple[int, str]:
+        if self.requested_count_type == CountType.ESTIMATED:
+            estimate = self.estimate_count()
+            if estimate > self.count_limit:
+                return estimate, CountType.ESTIMATED
+        elif self.requested_count_type == CountType.CAPPED:
+            # Counts at most one row over the limit
+            count = self.object_list[: self.count_limit + 1].count()
+            if count > self.count_limit:
+                return self.count_limit, CountType.CAPPED
+            return count, CountType.EXACT
+        return super().count, CountType.EXACT
+
+    @property
+    def count(self) -> int:
+        return self.count_and_type[0]
+
+    @property
+    def count_type(self) -> str:
+        return self.count_and_type[1]
+
+    def validate_number(self, number):
+        if self.count_type == CountType.EXACT:
+            return super().validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(self.error_messages["invalid_page"])
+        if number < 1:
+            raise EmptyPage(self.error_messages["min_page"])
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if self.count_type == CountType.EXACT:
+            return super().page(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom : bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage(self.error_messages["no_results"])
+        return InexactPage(
+            rows[: self.per_page], number, self, has_next=len(rows) > self.per_page
+        )
 
 
 class PageNumberPagination(DRFPageNumberPagination):
+    """Page number pagination, which views listing large tables can let clients
+    switch to keyset pagination with `?pagination=cursor`.
+
+    The views opt in by setting `keyset_ordering_fields` to the fields which can be
+    paginated over. The following pages are requested with the `cursor` of the
+    `next` and `previous` links.
+
+    Large results can be counted faster with `?count=estimated` or `?count=capped`,
+    in which case the response tells with `count_type` how the count was made.
+    """
+
     page_size = 20
     page_size_query_param = "page_size"
     max_page_size = 100
+    pagination_query_param = "pagination"
+    count_query_param = "count"
+    keyset_pagination = None
+    count_type = None
+
+    def use_keyset_pagination(self, request, view) -> bool:
+        if not getattr(view, "keyset_ordering_fields", None):
+            return False
+        return (
+            request.query_params.get(self.pagination_query_param) == "cursor"
+            or KeysetPagination.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_keyset_pagination(request, view):
+            self.keyset_pagination = KeysetPagination(
+                view.keyset_ordering_fields, self.get_page_size(request)
+            )
+            return self.keyset_pagination.paginate_queryset(queryset, request, view)
+        self.count_type = request.query_params.get(self.count_query_param)
+        if self.count_type not in (None, *CountType.choices):
+            raise InvalidFieldException(
+                detail=f"Invalid {self.count_query_param}: {self.count_type}"
+            )
+        self.django_paginator_class = partial(
+            CountingPaginator, count_type=self.count_type or CountType.EXACT
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset_pagination:
+            return self.keyset_pagination.get_paginated_response(data)
+        response = super().get_paginated_response(data)
+        if self.count_type:
+            response.data["count_type"] = self.page.paginator.count_type
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema["properties"]["count_type"] = {
+            "type": "string",
+            "enum": list(CountType.choices),
+            "description": f"How the count was made, when `{self.count_query_param}`"
+            " is given",
+        }
+        return response_schema
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters.append(
+            {
+                "name": self.count_query_param,
+                "required": False,
+                "in": "query",
+                "description": (
+                    "How to count the results. `exact` by default. Above"
+                    f" {settings.PAGINATION_COUNT_LIMIT} results `estimated` gives"
+                    " the estimate of the database and `capped` gives the limit,"
+                    " which are much faster for large results. The response tells"
+                    " with `count_type` which was used."
+                ),
+                "schema": {"type": "string", "enum": list(CountType.choices)},
+            }
+        )
+        if getattr(view, "keyset_ordering_fields", None):
+            parameters += [
+                {
+                    "name": self.pagination_query_param,
+                    "required": False,
+                    "in": "query",
+                    "description": (
+                        "`cursor` to paginate with cursors instead of page numbers."
+                        " Cursor pages have no `count`, but deep pages are as fast"
+                        " as the first one and stay stable while documents are"
+                        " added. Supported when sorting by "
+                        + ", ".join(f"`{f}`" for f in view.keyset_ordering_fields)
+                        + "."
+                    ),
+                    "schema": {"type": "string", "enum": ["page", "cursor"]},
+                },
+                {
+                    "name": KeysetPagination.cursor_query_param,
+                    "required": False,
+                    "in": "query",
+                    "description": "The pagination cursor value.",
+                    "schema": {"type": "string"},
+                },
+            ]
+        return parameters
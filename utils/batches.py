@@ -0,0 +1,60 @@
+"""Processing the rows of a table in batches, e.g. in resumable management
+commands which rewrite every row while the API is in use."""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Iterator, Optional
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+def iter_batches(queryset, batch_size: int, after=None) -> Iterator[list]:
+    """Iterate the primary keys of the queryset in batches ordered by the key,
+    starting after the given key."""
+    queryset = queryset.order_by("pk").values_list("pk", flat=True)
+    while True:
+        if after is not None:
+            batch = list(queryset.filter(pk__gt=after)[:batch_size])
+        else:
+            batch = list(queryset[:batch_size])
+        if not batch:
+            return
+        yield batch
+        after = batch[-1]
+
+
+def _process_row(process: Callable, pk) -> Optional[bool]:
+    try:
+        return process(pk)
+    except Exception:
+        logger.exception(f"Processing {pk} with {process.__name__} failed")
+        return None
+
+
+def _process_in_thread(process: Callable, pks: list) -> list[Optional[bool]]:
+    try:
+        return [_process_row(process, pk) for pk in pks]
+    finally:
+        # The connection of the thread would otherwise be left open
+        connection.close()
+
+
+def process_batch(process: Callable, pks: list, workers: int) -> list[Optional[bool]]:
+    """Process the rows of a batch with `process` using the given number of threads.
+
+    Returns the result of each row: whether it was changed, or None if it failed.
+    """
+    if workers <= 1:
+        return [_process_row(process, pk) for pk in pks]
+
+    chunks = [pks[i::workers] for i in range(workers)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(partial(_process_in_thread, process), chunks))
+    # Restore the order of the batch
+    ordered = [None] * len(pks)
+    for i, chunk_results in enumerate(results):
+        ordered[i::workers] = chunk_results
+    return ordered
@@ -0,0 +1,318 @@
+"""Minimal client for the clamd protocol.
+
+The INSTREAM scan is fed with the data chunk by chunk while the data is being read
+for other purposes, e.g. encrypted and stored, instead of taking the whole buffer to
+scan at once.
+
+The connections are kept open in IDSESSION mode and pooled per process by
+:class:`ClamdPool`, so uploads don't pay for the connection setup.
+"""
+
+import logging
+import os
+import re
+import socket
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+CHUNK_LENGTH_FORMAT = "!L"
+RESPONSE_BUFFER_SIZE = 4096
+# clamd closes idle sessions after IdleTimeout (30 s by default), so connections idle
+# for longer than this are checked before use
+HEALTH_CHECK_AFTER = 5.0
+# How long the version of the signature database is cached in seconds
+SIGNATURE_VERSION_TTL = 60.0
+
+
+class ClamdError(Exception):
+    """Communication with clamd failed or clamd couldn't scan the data."""
+
+
+class ClamdConnection:
+    def __init__(self, host: str, port: int, timeout: Optional[float] = None):
+        try:
+            self.socket = socket.create_connection((host, port), timeout=timeout)
+        except OSError as e:
+            raise ClamdError(f"Could not reach clamd at {host}:{port}") from e
+        self.last_used = time.monotonic()
+        self.closed = False
+
+    def start_session(self):
+        """Keep the connection open for several commands. The responses are then
+        prefixed with the ID of the command."""
+        self.send_command("IDSESSION")
+
+    def ping(self) -> bool:
+        try:
+            self.send_command("PING")
+            return self.receive_response().endswith("PONG")
+        except ClamdError:
+            return False
+
+    def send_command(self, command: str):
+        # Null terminated commands, see `man clamd`
+        self.send(f"z{command}\0".encode())
+
+    def send(self, data: bytes):
+        try:
+            self.socket.sendall(data)
+        except OSError as e:
+            raise ClamdError("Sending data to clamd failed") from e
+
+    def receive_response(self) -> str:
+        response = b""
+        while not response.endswith(b"\0"):
+            try:
+                data = self.socket.recv(RESPONSE_BUFFER_SIZE)
+            except OSError as e:
+                raise ClamdError("Receiving a response from clamd failed") from e
+            if not data:
+                raise ClamdError("clamd closed the connection")
+            response += data
+        return response[:-1].decode()
+
+    def close(self):
+        self.socket.close()
+        self.closed = True
+
+
+class InstreamScan:
+    """A clamd INSTREAM scan which is fed with the data to scan in chunks."""
+
+    def __init__(self, connection: ClamdConnection):
+        self.connection = connection
+        self.finished = False
+        self.connection.send_command("INSTREAM")
+
+    def send(self, data: bytes):
+        # A zero length chunk would terminate the stream
+        if data:
+            self.connection.send(struct.pack(CHUNK_LENGTH_FORMAT, len(data)) + data)
+
+    def finish(self) -> Optional[str]:
+        """Terminate the stream and wait for the result of the scan.
+
+        Returns the name of the found signature or None if the data is clean.
+        """
+        self.connection.send(struct.pack(CHUNK_LENGTH_FORMAT, 0))
+        result = parse_scan_response(self.connection.receive_response())
+        self.finished = True
+        return result
+
+
+def parse_scan_response(response: str) -> Optional[str]:
+    """Parse a response like "stream: OK" or "stream: Eicar-Signature FOUND"."""
+    result = response.rsplit(": ", 1)[-1]
+    if result == "OK":
+        return None
+    if result.endswith(" FOUND"):
+        return result.removesuffix(" FOUND")
+    raise ClamdError(f"clamd failed to scan the data: {response}")
+
+
+def parse_version_response(response: str) -> str:
+    """Parse the version of the signature database from a response like
+    "ClamAV 1.0.1/26789/Tue Jan 10 08:19:41 2023"."""
+    parts = re.sub(r"^\d+: ", "", response).split("/")
+    if len(parts) < 3:
+        raise ClamdError(f"Unexpected VERSION response from clamd: {response}")
+    return parts[1]
+
+
+class ClamdPoolStats:
+    """Counters for sizing the pool and the clamd sidecar.
+
+    The wait time is the time spent waiting for a free connection and the scan time
+    the time from starting a scan to getting its result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.scans = 0
+        self.connections_opened = 0
+        self.health_check_failures = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.total_scan_time = 0.0
+        self.max_scan_time = 0.0
+
+    def record_connection(self):
+        with self._lock:
+            self.connections_opened += 1
+
+    def record_health_check_failure(self):
+        with self._lock:
+            self.health_check_failures += 1
+
+    def record_scan(self, wait_time: float, scan_time: float):
+        with self._lock:
+            self.scans += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+            self.total_scan_time += scan_time
+            self.max_scan_time = max(self.max_scan_time, scan_time)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "scans": self.scans,
+                "connections_opened": self.connections_opened,
+                "health_check_failures": self.health_check_failures,
+                "avg_wait_time": self.total_wait_time / self.scans if self.scans else 0,
+                "max_wait_time": self.max_wait_time,
+                "avg_scan_time": self.total_scan_time / self.scans if self.scans else 0,
+                "max_scan_time": self.max_scan_time,
+            }
+
+
+class ClamdPool:
+    """A bounded pool of persistent clamd connections for one process.
+
+    At most `size` scans run at the same time; further scans wait for a free
+    connection up to `wait_timeout` seconds. Connections which have been idle for a
+    while are checked with PING before use and replaced if clamd has closed them.
+    A connection is discarded if a scan on it fails, because the state of its
+    session is unknown.
+
+    The pool is reset when it's used in a forked process, e.g. an uWSGI worker, so
+    the connections of the parent process are never shared.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        size: int,
+        timeout: Optional[float] = None,
+        wait_timeout: Optional[float] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.wait_timeout = wait_timeout
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle: list[ClamdConnection] = []
+        self._signature_version: Optional[str] = None
+        self._signature_version_checked = 0.0
+        self.stats = ClamdPoolStats()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # The sockets inherited from the parent are still used by it, so they're
+            # only closed in this process
+            for connection in self._idle:
+                connection.socket.close()
+            self._reset()
+
+    def _connect(self) -> ClamdConnection:
+        connection = ClamdConnection(self.host, self.port, self.timeout)
+        try:
+            connection.start_session()
+        except ClamdError:
+            connection.close()
+            raise
+        self.stats.record_connection()
+        return connection
+
+    def _get_connection(self) -> ClamdConnection:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                connection = self._idle.pop()
+            idle_time = time.monotonic() - connection.last_used
+            if idle_time < HEALTH_CHECK_AFTER or connection.ping():
+                return connection
+            self.stats.record_health_check_failure()
+            connection.close()
+        return self._connect()
+
+    @contextmanager
+    def _borrow(self) -> Iterator[tuple[ClamdConnection, float]]:
+        """Borrow a connection and tell how long it took to get one.
+
+        The connection is discarded if it's closed or the context exits with an
+        error, because the state of its session is then unknown.
+        """
+        self._check_fork()
+        slots = self._slots
+        started = time.monotonic()
+        if not slots.acquire(timeout=self.wait_timeout):
+            raise ClamdError("Timed out waiting for a free clamd connection")
+        try:
+            wait_time = time.monotonic() - started
+            connection = self._get_connection()
+            try:
+                yield connection, wait_time
+            except BaseException:
+                connection.close()
+                raise
+            if not connection.closed:
+                connection.last_used = time.monotonic()
+                with self._lock:
+                    self._idle.append(connection)
+        finally:
+            slots.release()
+
+    @contextmanager
+    def scan(self) -> Iterator[InstreamScan]:
+        """Start an INSTREAM scan on a pooled connection.
+
+        The scan should be finished within the context, otherwise its connection is
+        discarded.
+        """
+        with self._borrow() as (connection, wait_time):
+            scan_started = time.monotonic()
+            scan = InstreamScan(connection)
+            yield scan
+            if not scan.finished:
+                connection.close()
+                return
+
+            scan_time = time.monotonic() - scan_started
+            self.stats.record_scan(wait_time, scan_time)
+            logger.info(
+                "Virus scan finished",
+                extra={
+                    "clamd_wait_time": wait_time,
+                    "clamd_scan_time": scan_time,
+                    "clamd_pool": self.stats.as_dict(),
+                },
+            )
+
+    def signature_version(self) -> str:
+        """Get the version of clamd's signature database.
+
+        The version is asked from clamd at most once in SIGNATURE_VERSION_TTL seconds.
+        """
+        self._check_fork()
+        now = time.monotonic()
+        if (
+            self._signature_version is None
+            or now - self._signature_version_checked > SIGNATURE_VERSION_TTL
+        ):
+            with self._borrow() as (connection, _):
+                connection.send_command("VERSION")
+                self._signature_version = parse_version_response(
+                    connection.receive_response()
+                )
+            self._signature_version_checked = now
+        return self._signature_version
+
+    def close(self):
+        """Close the idle connections of the pool."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
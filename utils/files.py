@@ -1,9 +1,17 @@
+import hashlib
 import logging
+import mimetypes
 import os
+import posixpath
 import shutil
 from pathlib import Path
 from typing import Union
 
+from django.conf import settings
+from django.core.files.uploadhandler import (
+    MemoryFileUploadHandler,
+    TemporaryFileUploadHandler,
+)
 from sentry_sdk import capture_exception
 
 logger = logging.getLogger(__name__)
@@ -12,7 +20,17 @@ logger = logging.getLogger(__name__)
 def remove_instance_file(instance, field_name):
     file = getattr(instance, field_name, None)
     if file:
-        remove_file(file.path)
+        remove_stored_file(file.storage, file.name)
+
+
+def remove_stored_file(storage, name: str):
+    """Delete a file from a storage, which may not be the local filesystem."""
+    if not storage.exists(name):
+        e = FileNotFoundError(f"No such file in the storage: {name}")
+        logger.warning(e)
+        capture_exception(e)
+        return
+    storage.delete(name)
 
 
 def remove_file(path: Union[Path, str]):
@@ -28,6 +46,109 @@ def remove_directory(path: Union[Path, str]):
         shutil.rmtree(path)
 
 
+def remove_storage_directory(storage, path: str):
+    """Remove a directory and everything in it from a storage.
+
+    Object storages don't have directories, so the files under the path are
+    deleted one by one.
+    """
+    try:
+        local_path = storage.path(path)
+    except NotImplementedError:
+        pass
+    else:
+        remove_directory(local_path)
+        return
+
+    directories, files = storage.listdir(path)
+    for name in files:
+        storage.delete(posixpath.join(path, name))
+    for name in directories:
+        remove_storage_directory(storage, posixpath.join(path, name))
+
+
+class TeeFile:
+    """Read-only file-like object which passes everything read from the wrapped file
+    also to the given consumers, so the data can be processed in several ways while
+    reading it only once.
+
+    Seeking isn't supported, because the consumers would receive the data again.
+    """
+
+    def __init__(self, file, *consumers):
+        self.file = file
+        self.consumers = consumers
+        self.name = getattr(file, "name", None)
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        for consumer in self.consumers:
+            consumer(data)
+        return data
+
+
+class HashingUploadHandlerMixin:
+    """Calculate the SHA-256 of an uploaded file while it's being received, so the
+    file doesn't have to be read again for it. The hex digest is set to the `sha256`
+    attribute of the uploaded file."""
+
+    def new_file(self, *args, **kwargs):
+        # The memory handler stops the handlers after it when it's activated
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        data = super().receive_data_chunk(raw_data, start)
+        if data is None:
+            # The data is kept by this handler instead of passed to the next one
+            self.sha256.update(raw_data)
+        return data
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(
+    HashingUploadHandlerMixin, MemoryFileUploadHandler
+):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(
+    HashingUploadHandlerMixin, TemporaryFileUploadHandler
+):
+    pass
+
+
 def b_to_mb(b: int):
     """Convert bytes to MB."""
     return round(float(b) / (1024**2), 2)
+
+
+def guess_content_type(filename: str) -> str:
+    """Guess the content type of a file from its name the same way as
+    django.http.FileResponse does."""
+    content_type, encoding = mimetypes.guess_type(filename)
+    # Encoding isn't set to prevent browsers from automatically uncompressing files.
+    content_type = {
+        "br": "application/x-brotli",
+        "bzip2": "application/x-bzip",
+        "compress": "application/x-compress",
+        "gzip": "application/gzip",
+        "xz": "application/x-xz",
+    }.get(encoding, content_type)
+    return content_type or "application/octet-stream"
+
+
+def is_compressible(media_type: str) -> bool:
+    """Check whether content of the given media type is worth compressing, i.e.
+    it's not compressed already. Unknown media types are compressed."""
+    media_type = (media_type or "").split(";")[0].strip().lower()
+    return not any(
+        media_type == pattern
+        or (pattern.endswith("/") and media_type.startswith(pattern))
+        for pattern in settings.INCOMPRESSIBLE_MEDIA_TYPES
+    )
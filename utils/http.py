@@ -0,0 +1,67 @@
+import re
+from typing import Optional
+
+from django.utils.http import parse_http_date_safe
+
+BYTE_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiableError(Exception):
+    """The requested byte range doesn't overlap the content."""
+
+
+def parse_range_header(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """Parse a Range header with a single byte range.
+
+    Returns the range as (start, end) with an exclusive end which is clamped to the
+    size of the content. Returns None if the header is missing, malformed or asks
+    for multiple ranges, in which case the whole content should be served.
+
+    Raises RangeNotSatisfiableError if the range doesn't overlap the content.
+    """
+    if not header:
+        return None
+    match = BYTE_RANGE_RE.match(header.strip())
+    if not match:
+        return None
+
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = int(last) + 1 if last else size
+        if last and end <= start:
+            return None
+    elif last:
+        # Suffix range, i.e. the last N bytes
+        if int(last) == 0:
+            raise RangeNotSatisfiableError()
+        start = max(size - int(last), 0)
+        end = size
+    else:
+        return None
+
+    if start >= size:
+        raise RangeNotSatisfiableError()
+    return start, min(end, size)
+
+
+def if_range_passes(header: Optional[str], etag: str, last_modified: int) -> bool:
+    """Check whether the range of a request should be served according to its
+    If-Range header, i.e. whether the client's copy is still the current one.
+
+    :param etag: The current strong entity tag of the content
+    :param last_modified: The modification time of the content as a timestamp
+    """
+    if not header:
+        return True
+    if header.startswith(('"', "W/")):
+        # Weak entity tags never match
+        return header == etag
+    return parse_http_date_safe(header) == last_modified
+
+
+def get_byte_range(request, size: int, etag: str, last_modified: int):
+    """Get the byte range the request asks for, see parse_range_header."""
+    if not if_range_passes(request.headers.get("If-Range"), etag, last_modified):
+        return None
+    return parse_range_header(request.headers.get("Range"), size)
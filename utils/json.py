@@ -0,0 +1,168 @@
+"""Pluggable JSON codec for the encrypted content and the API.
+
+The engine is chosen with the JSON_ENGINE setting: "orjson" is fast but optional,
+"json" is the standard library, and "auto" uses orjson when it's installed.
+
+Both engines encode the types handled by DjangoJSONEncoder, e.g. datetimes, decimals
+and UUIDs, the same way, so the decoded data doesn't depend on the engine. Values
+orjson can't handle, e.g. integers over 64 bits, fall back to the standard library.
+"""
+
+import json
+import math
+from functools import lru_cache
+from typing import Any, Union
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework import parsers, renderers
+from rest_framework.exceptions import ParseError
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _reject_constant(name):
+    raise ValueError(f"Invalid JSON constant: {name}")
+
+
+def _has_non_finite_float(value: Any) -> bool:
+    if isinstance(value, float):
+        return not math.isfinite(value)
+    if isinstance(value, dict):
+        return any(_has_non_finite_float(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(_has_non_finite_float(item) for item in value)
+    return False
+
+
+class StdlibCodec:
+    name = "json"
+
+    def dumps(self, value: Any, default=None, strict: bool = False) -> bytes:
+        """
+        :param strict: Reject NaN and infinite floats, which aren't valid JSON,
+            with ValueError.
+        """
+        encoder = DjangoJSONEncoder if default is None else None
+        options = {
+            "cls": encoder,
+            "default": default,
+            "separators": (",", ":"),
+            "allow_nan": not strict,
+        }
+        try:
+            return json.dumps(value, ensure_ascii=False, **options).encode()
+        except UnicodeEncodeError:
+            # Lone surrogates, e.g. "\ud800", aren't valid UTF-8 but can be escaped
+            return json.dumps(value, ensure_ascii=True, **options).encode()
+
+    def loads(self, data: Union[bytes, str], strict: bool = False) -> Any:
+        """
+        :param strict: Reject the NaN and Infinity constants, which aren't valid
+            JSON.
+        """
+        if strict:
+            return json.loads(data, parse_constant=_reject_constant)
+        return json.loads(data)
+
+
+class OrjsonCodec(StdlibCodec):
+    name = "orjson"
+    # Datetimes are passed to the default function, which formats them like
+    # DjangoJSONEncoder instead of with microseconds and "+00:00"
+    options = orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+
+    def dumps(self, value: Any, default=None, strict: bool = False) -> bytes:
+        try:
+            data = orjson.dumps(
+                value,
+                default=default or DjangoJSONEncoder().default,
+                option=self.options,
+            )
+        except orjson.JSONEncodeError:
+            return super().dumps(value, default, strict)
+        # orjson encodes NaN and infinite floats as null
+        if strict and b"null" in data and _has_non_finite_float(value):
+            raise ValueError("Out of range float values are not JSON compliant")
+        return data
+
+    def loads(self, data: Union[bytes, str], strict: bool = False) -> Any:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # E.g. integers over 64 bits, or invalid data which raises again
+            return super().loads(data, strict)
+
+
+@lru_cache
+def _build_codec(engine: str) -> StdlibCodec:
+    if engine == "auto":
+        engine = "orjson" if orjson else "json"
+    if engine == "json":
+        return StdlibCodec()
+    if engine == "orjson":
+        if orjson is None:
+            raise ImproperlyConfigured("JSON_ENGINE is orjson but it's not installed.")
+        return OrjsonCodec()
+    raise ImproperlyConfigured(f"Unknown JSON_ENGINE: {engine}")
+
+
+def get_codec() -> StdlibCodec:
+    return _build_codec(settings.JSON_ENGINE)
+
+
+def dumps(value: Any) -> bytes:
+    """Encode a value as UTF-8 JSON."""
+    return get_codec().dumps(value)
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    return get_codec().loads(data)
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """DRF JSON renderer using the configured codec.
+
+    Indented responses, e.g. the browsable API, are rendered by DRF itself.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context) or not (
+            self.compact and self.ensure_ascii is False
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = get_codec().dumps(
+                data, default=self.encoder_class().default, strict=True
+            )
+        except ValueError:
+            if self.strict:
+                raise
+            # NaN and Infinity are rendered by DRF when STRICT_JSON is disabled
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escape the line separators like DRF does, as they're invalid in JavaScript
+        return ret.replace("\u2028".encode(), b"\\u2028").replace(
+            "\u2029".encode(), b"\\u2029"
+        )
+
+
+class JSONParser(parsers.JSONParser):
+    """DRF JSON parser using the configured codec."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        if encoding.lower().replace("-", "") != "utf8":
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return get_codec().loads(stream.read(), strict=True)
+        except ValueError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
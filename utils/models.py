@@ -17,3 +17,16 @@ class UUIDModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+class CaseFoldedJSON(models.Func):
+    """JSON with all of its keys and string values case folded, which expression
+    indexes and case-insensitive containment queries are made of.
+
+    The strings are folded like the UPPER of the iexact lookups, so the strings
+    which are iexact equal are equal when folded too, e.g. "ſ" and "s". They're
+    lowered afterwards to keep the escapes and literals of the JSON valid.
+    """
+
+    template = "(lower(upper(%(expressions)s::text))::jsonb)"
+    output_field = models.JSONField()
@@ -0,0 +1,308 @@
+"""Storage backend for S3 compatible object storages, e.g. AWS S3, Ceph or MinIO.
+
+Files are uploaded as multipart uploads while they're being written, so a file is
+never held in memory as a whole, and they're read with ranged GETs, so reading a
+part of a large file, e.g. a byte range of an encrypted attachment, only downloads
+the segments needed.
+
+The client is created with boto3, which is only needed when the backend is used.
+Any client with the same interface can be passed instead, e.g. an in-process fake
+in tests.
+"""
+
+import posixpath
+from io import SEEK_CUR, SEEK_END, SEEK_SET, UnsupportedOperation
+from typing import Optional
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import File
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+
+try:
+    import boto3
+except ImportError:  # pragma: no cover
+    boto3 = None
+
+# S3 requires the parts of a multipart upload, except the last one, to be at
+# least 5 MiB
+MIN_PART_SIZE = 5 * 2**20
+DEFAULT_PART_SIZE = 8 * 2**20
+DEFAULT_BUFFER_SIZE = 2**20
+
+NOT_FOUND_CODES = {"404", "NoSuchKey", "NotFound"}
+
+
+def is_not_found(error: Exception) -> bool:
+    """Check whether an error raised by the client means the object doesn't exist."""
+    response = getattr(error, "response", None) or {}
+    return str(response.get("Error", {}).get("Code")) in NOT_FOUND_CODES
+
+
+class S3File(File):
+    """Read-only, seekable file of an object in the storage.
+
+    The object is read with ranged GETs of at least `buffer_size` bytes, so reading
+    it sequentially in small pieces doesn't cost a request per read.
+    """
+
+    def __init__(self, storage: "S3Storage", name: str, buffer_size: int):
+        self._storage = storage
+        self._buffer_size = buffer_size
+        self._buffer = b""
+        self._buffer_start = 0
+        self._position = 0
+        self._size = None
+        self.name = name
+        self.mode = "rb"
+        self.file = None
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = self._storage.size(self.name)
+        return self._size
+
+    @property
+    def closed(self):
+        return self._buffer is None
+
+    def close(self):
+        self._buffer = None
+
+    def open(self, mode=None):
+        if mode and mode not in ("r", "rb"):
+            raise UnsupportedOperation("Stored objects can only be read")
+        self.seek(0)
+        self._buffer = b""
+        return self
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=SEEK_SET):
+        if whence == SEEK_CUR:
+            offset += self._position
+        elif whence == SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self._position = offset
+        return offset
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        remaining = self.size - self._position
+        size = remaining if size is None or size < 0 else min(size, remaining)
+        if size <= 0:
+            return b""
+
+        offset = self._position - self._buffer_start
+        if not 0 <= offset < len(self._buffer) or offset + size > len(self._buffer):
+            self._buffer_start = self._position
+            self._buffer = self._storage.read_range(
+                self.name, self._position, min(max(size, self._buffer_size), remaining)
+            )
+            offset = 0
+        data = self._buffer[offset : offset + size]
+        self._position += len(data)
+        return data
+
+    def write(self, data):
+        raise UnsupportedOperation("Stored objects can only be read")
+
+
+@deconstructible(path="utils.storage.S3Storage")
+class S3Storage(Storage):
+    """Storage of files as objects in a bucket of an S3 compatible object storage.
+
+    :param part_size: Size of the parts of multipart uploads. Files smaller than it
+        are uploaded with a single request.
+    :param buffer_size: Minimum number of bytes fetched by a read.
+    :param client: S3 client to use instead of creating one with boto3.
+    """
+
+    def __init__(
+        self,
+        bucket_name: str = "",
+        endpoint_url: Optional[str] = None,
+        region_name: Optional[str] = None,
+        access_key_id: Optional[str] = None,
+        secret_access_key: Optional[str] = None,
+        location: str = "",
+        part_size: int = DEFAULT_PART_SIZE,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        client=None,
+    ):
+        if not bucket_name:
+            raise ImproperlyConfigured("S3Storage requires a bucket name.")
+        self.bucket_name = bucket_name
+        self.endpoint_url = endpoint_url or None
+        self.region_name = region_name or None
+        self.access_key_id = access_key_id or None
+        self.secret_access_key = secret_access_key or None
+        self.location = location.strip("/")
+        self.part_size = part_size
+        self.buffer_size = buffer_size
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            if boto3 is None:
+                raise ImproperlyConfigured("S3Storage requires boto3 to be installed.")
+            # boto3 clients are thread-safe, so one is shared by all the threads
+            self._client = boto3.client(
+                "s3",
+                endpoint_url=self.endpoint_url,
+                region_name=self.region_name,
+                aws_access_key_id=self.access_key_id,
+                aws_secret_access_key=self.secret_access_key,
+            )
+        return self._client
+
+    def _key(self, name: str) -> str:
+        name = posixpath.normpath(name.replace("\\", "/")).lstrip("/")
+        if name == ".":
+            name = ""
+        if name.startswith("../"):
+            raise ValueError(f"Invalid name {name}")
+        if self.location:
+            name = posixpath.join(self.location, name).rstrip("/")
+        return name
+
+    def read_range(self, name: str, start: int, length: int) -> bytes:
+        """Read `length` bytes of an object starting at `start`. Less is returned at
+        the end of the object."""
+        try:
+            response = self.client.get_object(
+                Bucket=self.bucket_name,
+                Key=self._key(name),
+                Range=f"bytes={start}-{start + length - 1}",
+            )
+        except Exception as e:
+            if is_not_found(e):
+                raise FileNotFoundError(name) from e
+            raise
+        return response["Body"].read()
+
+    def _open(self, name, mode="rb"):
+        if mode not in ("r", "rb"):
+            raise UnsupportedOperation("Stored objects can only be read")
+        file = S3File(self, name, self.buffer_size)
+        # Fail like opening a missing local file would
+        file._size = self.size(name)
+        return file
+
+    def _save(self, name, content):
+        key = self._key(name)
+        chunks = content.chunks()
+        buffer = bytearray()
+        for chunk in chunks:
+            buffer += chunk
+            if len(buffer) >= self.part_size:
+                break
+        else:
+            # Small files are uploaded with a single request
+            self.client.put_object(Bucket=self.bucket_name, Key=key, Body=bytes(buffer))
+            return name
+
+        upload_id = self.client.create_multipart_upload(
+            Bucket=self.bucket_name, Key=key
+        )["UploadId"]
+        try:
+            parts = []
+            for chunk in chunks:
+                buffer += chunk
+                while len(buffer) >= 2 * self.part_size:
+                    parts.append(self._upload_part(key, upload_id, parts, buffer))
+            # The last part may be smaller than the part size, but the one before it
+            # may not, so the remainder is split into at most two parts
+            while buffer:
+                parts.append(self._upload_part(key, upload_id, parts, buffer))
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket_name, Key=key, UploadId=upload_id
+            )
+            raise
+        return name
+
+    def _upload_part(self, key, upload_id, parts: list, buffer: bytearray) -> dict:
+        """Upload a part from the beginning of the buffer and remove it from it."""
+        body = bytes(buffer[: self.part_size])
+        del buffer[: self.part_size]
+        part_number = len(parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket_name,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=body,
+        )
+        return {"ETag": response["ETag"], "PartNumber": part_number}
+
+    def _head(self, name: str) -> Optional[dict]:
+        try:
+            return self.client.head_object(Bucket=self.bucket_name, Key=self._key(name))
+        except Exception as e:
+            if is_not_found(e):
+                return None
+            raise
+
+    def delete(self, name):
+        if not name:
+            raise ValueError("The name must be given to delete().")
+        self.client.delete_object(Bucket=self.bucket_name, Key=self._key(name))
+
+    def exists(self, name):
+        return self._head(name) is not None
+
+    def size(self, name):
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head["ContentLength"]
+
+    def get_modified_time(self, name):
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head["LastModified"]
+
+    def listdir(self, path):
+        """List the "directories" and files directly under the path. Objects have no
+        directories, so empty ones don't exist."""
+        prefix = self._key(path)
+        prefix = f"{prefix}/" if prefix else ""
+        directories, files = [], []
+        kwargs = {"Bucket": self.bucket_name, "Prefix": prefix, "Delimiter": "/"}
+        while True:
+            response = self.client.list_objects_v2(**kwargs)
+            for common_prefix in response.get("CommonPrefixes", []):
+                directories.append(common_prefix["Prefix"][len(prefix) :].rstrip("/"))
+            for obj in response.get("Contents", []):
+                files.append(obj["Key"][len(prefix) :])
+            if not response.get("IsTruncated"):
+                return directories, files
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+    def url(self, name):
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket_name, "Key": self._key(name)}
+        )
@@ -0,0 +1,130 @@
+"""In-process stand-in for an S3 client, covering the calls used by S3Storage."""
+
+# The arguments are named like the ones of boto3
+# ruff: noqa: N803
+
+import threading
+from datetime import datetime, timezone
+from hashlib import md5
+from io import BytesIO
+
+from utils.storage import MIN_PART_SIZE
+
+
+class FakeClientError(Exception):
+    """Mimics botocore's ClientError, which carries the error code in `response`."""
+
+    def __init__(self, code: str, operation: str):
+        super().__init__(f"An error occurred ({code}) when calling {operation}")
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeS3Client:
+    def __init__(self, min_part_size: int = MIN_PART_SIZE, page_size: int = 1000):
+        self.min_part_size = min_part_size
+        self.page_size = page_size
+        self.objects: dict[str, dict[str, bytes]] = {}
+        self.uploads: dict[str, dict] = {}
+        self.calls: list[tuple[str, dict]] = []
+        self._lock = threading.Lock()
+
+    def _record(self, operation, **kwargs):
+        with self._lock:
+            self.calls.append((operation, kwargs))
+
+    def _bucket(self, bucket) -> dict:
+        return self.objects.setdefault(bucket, {})
+
+    def _get(self, bucket, key, operation) -> bytes:
+        try:
+            return self._bucket(bucket)[key]
+        except KeyError:
+            raise FakeClientError("NoSuchKey", operation)
+
+    def put_object(self, Bucket, Key, Body):
+        self._record("put_object", Key=Key, size=len(Body))
+        self._bucket(Bucket)[Key] = bytes(Body)
+        return {"ETag": md5(Body).hexdigest()}
+
+    def get_object(self, Bucket, Key, Range=None):
+        self._record("get_object", Key=Key, Range=Range)
+        data = self._get(Bucket, Key, "GetObject")
+        if Range:
+            start, end = Range.removeprefix("bytes=").split("-")
+            if int(start) >= len(data):
+                raise FakeClientError("InvalidRange", "GetObject")
+            data = data[int(start) : int(end) + 1]
+        return {"Body": BytesIO(data), "ContentLength": len(data)}
+
+    def head_object(self, Bucket, Key):
+        self._record("head_object", Key=Key)
+        data = self._get(Bucket, Key, "HeadObject")
+        return {
+            "ContentLength": len(data),
+            "LastModified": datetime.now(timezone.utc),
+        }
+
+    def delete_object(self, Bucket, Key):
+        self._record("delete_object", Key=Key)
+        self._bucket(Bucket).pop(Key, None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", Delimiter="", ContinuationToken=None):
+        self._record("list_objects_v2", Prefix=Prefix)
+        entries = set()
+        for key in self._bucket(Bucket):
+            if not key.startswith(Prefix):
+                continue
+            rest = key[len(Prefix) :]
+            if Delimiter and Delimiter in rest:
+                entries.add(("prefix", Prefix + rest.split(Delimiter)[0] + Delimiter))
+            else:
+                entries.add(("key", key))
+        entries = sorted(entries, key=lambda entry: entry[1])
+        start = int(ContinuationToken or 0)
+        page = entries[start : start + self.page_size]
+        response = {
+            "CommonPrefixes": [
+                {"Prefix": name} for kind, name in page if kind == "prefix"
+            ],
+            "Contents": [{"Key": name} for kind, name in page if kind == "key"],
+            "IsTruncated": start + self.page_size < len(entries),
+        }
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(start + self.page_size)
+        return response
+
+    def create_multipart_upload(self, Bucket, Key):
+        self._record("create_multipart_upload", Key=Key)
+        upload_id = f"upload-{len(self.uploads)}"
+        self.uploads[upload_id] = {"bucket": Bucket, "key": Key, "parts": {}}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._record("upload_part", Key=Key, PartNumber=PartNumber, size=len(Body))
+        etag = md5(Body).hexdigest()
+        self.uploads[UploadId]["parts"][PartNumber] = (etag, bytes(Body))
+        return {"ETag": etag}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self._record("complete_multipart_upload", Key=Key)
+        upload = self.uploads.pop(UploadId)
+        parts = MultipartUpload["Parts"]
+        for part in parts[:-1]:
+            if len(upload["parts"][part["PartNumber"]][1]) < self.min_part_size:
+                raise FakeClientError("EntityTooSmall", "CompleteMultipartUpload")
+        for part in parts:
+            if upload["parts"][part["PartNumber"]][0] != part["ETag"]:
+                raise FakeClientError("InvalidPart", "CompleteMultipartUpload")
+        self._bucket(Bucket)[Key] = b"".join(
+            upload["parts"][part["PartNumber"]][1] for part in parts
+        )
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self._record("abort_multipart_upload", Key=Key)
+        self.uploads.pop(UploadId, None)
+        return {}
+
+    def generate_presigned_url(self, operation, Params):
+        return f"https://{Params['Bucket']}.s3.example.com/{Params['Key']}"
@@ -0,0 +1,162 @@
+import socketserver
+import struct
+import threading
+from unittest import mock
+
+import pytest
+
+from utils.clamd import (
+    HEALTH_CHECK_AFTER,
+    ClamdError,
+    ClamdPool,
+    InstreamScan,
+    parse_scan_response,
+    parse_version_response,
+)
+
+
+@pytest.mark.parametrize(
+    "response,expected",
+    [
+        ("stream: OK", None),
+        ("stream: Eicar-Signature FOUND", "Eicar-Signature"),
+        ("1: stream: Win.Test.EICAR_HDB-1 FOUND", "Win.Test.EICAR_HDB-1"),
+    ],
+)
+def test_parse_scan_response(response, expected):
+    assert parse_scan_response(response) == expected
+
+
+def test_parse_version_response():
+    assert parse_version_response("1: ClamAV 1.0.1/26789/Tue Jan 10 2023") == "26789"
+    with pytest.raises(ClamdError):
+        parse_version_response("1: COMMAND READ TIMED OUT")
+
+
+def test_parse_scan_response_error():
+    with pytest.raises(ClamdError):
+        parse_scan_response("INSTREAM size limit exceeded. ERROR")
+
+
+def test_instream_scan():
+    connection = mock.Mock()
+    connection.receive_response.return_value = "stream: OK"
+
+    scan = InstreamScan(connection)
+    scan.send(b"abc")
+    scan.send(b"")
+    assert scan.finish() is None
+
+    connection.send_command.assert_called_once_with("INSTREAM")
+    assert connection.send.call_args_list == [
+        mock.call(struct.pack("!L", 3) + b"abc"),
+        mock.call(struct.pack("!L", 0)),
+    ]
+
+
+class FakeClamdHandler(socketserver.BaseRequestHandler):
+    """Serves the subset of the clamd protocol used by the client."""
+
+    def read_exactly(self, size):
+        data = b""
+        while len(data) < size:
+            data += self.request.recv(size - len(data))
+        return data
+
+    def read_command(self):
+        command = b""
+        while not command.endswith(b"\0"):
+            data = self.request.recv(1)
+            if not data:
+                return None
+            command += data
+        return command[1:-1].decode()
+
+    def handle(self):
+        assert self.read_command() == "IDSESSION"
+        command_id = 0
+        while (command := self.read_command()) not in (None, "END"):
+            command_id += 1
+            if command == "PING":
+                result = "PONG"
+            elif command == "VERSION":
+                result = "ClamAV 1.0.1/26789/Tue Jan 10 08:19:41 2023"
+            else:
+                data = b""
+                while size := struct.unpack("!L", self.read_exactly(4))[0]:
+                    data += self.read_exactly(size)
+                result = "stream: " + ("Eicar FOUND" if b"EICAR" in data else "OK")
+            self.request.sendall(f"{command_id}: {result}\0".encode())
+
+
+@pytest.fixture
+def clamd_pool():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeClamdHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    pool = ClamdPool(*server.server_address, size=1, timeout=5, wait_timeout=0.1)
+    yield pool
+    pool.close()
+    server.shutdown()
+    server.server_close()
+
+
+def scan(pool, data):
+    with pool.scan() as instream_scan:
+        instream_scan.send(data)
+        return instream_scan.finish()
+
+
+def test_pool_reuses_connections(clamd_pool):
+    assert scan(clamd_pool, b"clean") is None
+    assert scan(clamd_pool, b"EICAR") == "Eicar"
+
+    stats = clamd_pool.stats.as_dict()
+    assert stats["scans"] == 2
+    assert stats["connections_opened"] == 1
+
+
+def test_pool_size_is_bounded(clamd_pool):
+    with clamd_pool.scan() as instream_scan:
+        with pytest.raises(ClamdError):
+            with clamd_pool.scan():
+                pass
+        instream_scan.finish()
+
+
+def test_pool_discards_connection_of_failed_scan(clamd_pool):
+    with pytest.raises(RuntimeError):
+        with clamd_pool.scan():
+            raise RuntimeError()
+    assert scan(clamd_pool, b"clean") is None
+
+    assert clamd_pool.stats.connections_opened == 2
+
+
+def test_pool_replaces_unhealthy_connection(clamd_pool):
+    scan(clamd_pool, b"clean")
+    [connection] = clamd_pool._idle
+    connection.last_used -= HEALTH_CHECK_AFTER
+    connection.socket.close()
+
+    assert scan(clamd_pool, b"clean") is None
+    assert clamd_pool.stats.health_check_failures == 1
+    assert clamd_pool.stats.connections_opened == 2
+
+
+def test_pool_is_reset_after_fork(clamd_pool):
+    scan(clamd_pool, b"clean")
+    [inherited] = clamd_pool._idle
+    clamd_pool._pid = -1
+
+    assert scan(clamd_pool, b"clean") is None
+    assert inherited.socket.fileno() == -1
+    assert clamd_pool._idle != [inherited]
+    assert clamd_pool.stats.connections_opened == 1
+
+
+def test_pool_signature_version(clamd_pool):
+    assert clamd_pool.signature_version() == "26789"
+    assert scan(clamd_pool, b"clean") is None
+    assert clamd_pool.stats.connections_opened == 1
@@ -0,0 +1,45 @@
+import pytest
+
+from utils.http import RangeNotSatisfiableError, if_range_passes, parse_range_header
+
+
+@pytest.mark.parametrize(
+    "header,expected",
+    [
+        (None, None),
+        ("", None),
+        ("bytes=0-9", (0, 10)),
+        ("bytes=10-", (10, 100)),
+        ("bytes=90-200", (90, 100)),
+        ("bytes=-10", (90, 100)),
+        ("bytes=-200", (0, 100)),
+        ("bytes=5-4", None),
+        ("bytes=0-1,5-6", None),
+        ("bytes=-", None),
+        ("items=0-9", None),
+    ],
+)
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=200-300", "bytes=-0"])
+def test_parse_range_header_not_satisfiable(header):
+    with pytest.raises(RangeNotSatisfiableError):
+        parse_range_header(header, 100)
+
+
+@pytest.mark.parametrize(
+    "header,passes",
+    [
+        (None, True),
+        ('"1-1600000000"', True),
+        ('"1-1500000000"', False),
+        ('W/"1-1600000000"', False),
+        ("Sun, 13 Sep 2020 12:26:40 GMT", True),
+        ("Sun, 13 Sep 2020 12:26:41 GMT", False),
+        ("not a date", False),
+    ],
+)
+def test_if_range_passes(header, passes):
+    assert if_range_passes(header, '"1-1600000000"', 1600000000) is passes
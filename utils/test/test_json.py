@@ -0,0 +1,82 @@
+import json as stdlib_json
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+from io import BytesIO
+from uuid import uuid4
+
+import pytest
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework import renderers
+from rest_framework.exceptions import ParseError
+
+from utils import json
+from utils.json import JSONParser, JSONRenderer
+
+VALUE = {
+    "datetime": datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc),
+    "date": date(2024, 1, 2),
+    "time": time(3, 4, 5),
+    "decimal": Decimal("1.10"),
+    "uuid": uuid4(),
+    "text": "ääkköset \u2028\u2029",
+    "nested": [{"number": 1.5, "none": None, "bool": True}],
+}
+
+
+@pytest.fixture(params=["json", "orjson"])
+def json_engine(request, settings):
+    settings.JSON_ENGINE = request.param
+    return request.param
+
+
+def test_dumps_like_django_json_encoder(json_engine):
+    expected = stdlib_json.loads(stdlib_json.dumps(VALUE, cls=DjangoJSONEncoder))
+
+    assert json.get_codec().name == json_engine
+    assert json.loads(json.dumps(VALUE)) == expected
+
+
+def test_big_integers(json_engine):
+    value = {"big": 2**70}
+
+    assert json.loads(json.dumps(value)) == value
+
+
+def test_renderer_like_drf(json_engine):
+    data = {key: value for key, value in VALUE.items() if key != "time"}
+
+    rendered = JSONRenderer().render(data)
+
+    assert rendered == renderers.JSONRenderer().render(data)
+
+
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), -float("inf")])
+def test_renderer_rejects_non_finite_floats_like_drf(json_engine, value):
+    data = {"results": [{"value": value, "none": None}]}
+
+    with pytest.raises(ValueError, match="Out of range float values"):
+        renderers.JSONRenderer().render(data)
+    with pytest.raises(ValueError, match="Out of range float values"):
+        JSONRenderer().render(data)
+
+
+def test_renderer_non_strict_like_drf(json_engine):
+    data = {"value": float("nan")}
+    renderer, drf_renderer = JSONRenderer(), renderers.JSONRenderer()
+    renderer.strict = drf_renderer.strict = False
+
+    assert renderer.render(data) == drf_renderer.render(data) == b'{"value":NaN}'
+
+
+def test_parser(json_engine):
+    data = JSONParser().parse(BytesIO('{"a": [1, "ä"]}'.encode()))
+
+    assert data == {"a": [1, "ä"]}
+    with pytest.raises(ParseError):
+        JSONParser().parse(BytesIO(b'{"a": NaN}'))
+
+
+def test_lone_surrogate(json_engine):
+    value = {"a": "\ud800", "b": "ä"}
+
+    assert json.loads(json.dumps(value)) == value
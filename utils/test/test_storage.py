@@ -0,0 +1,98 @@
+import pytest
+from django.core.files.base import ContentFile
+
+from utils.storage import S3Storage
+from utils.test.fake_s3 import FakeS3Client
+
+DATA = bytes(range(256)) * 100
+
+
+@pytest.fixture
+def client():
+    return FakeS3Client(min_part_size=1000)
+
+
+@pytest.fixture
+def storage(client):
+    return S3Storage("bucket", part_size=1000, buffer_size=100, client=client)
+
+
+def calls(client, operation):
+    return [kwargs for name, kwargs in client.calls if name == operation]
+
+
+def test_small_file_is_put_in_one_request(storage, client):
+    name = storage.save("dir/small", ContentFile(b"data"))
+
+    assert client.objects["bucket"][name] == b"data"
+    assert not calls(client, "create_multipart_upload")
+
+
+def test_large_file_is_uploaded_in_parts(storage, client):
+    name = storage.save("dir/large", ContentFile(DATA))
+
+    assert client.objects["bucket"][name] == DATA
+    part_sizes = [call["size"] for call in calls(client, "upload_part")]
+    assert sum(part_sizes) == len(DATA)
+    assert all(size == 1000 for size in part_sizes[:-1])
+    assert not client.uploads
+
+
+def test_failed_upload_is_aborted(storage, client):
+    def chunks():
+        yield DATA
+        raise OSError("Connection reset")
+
+    content = ContentFile(b"")
+    content.chunks = chunks
+    with pytest.raises(OSError):
+        storage.save("dir/failed", content)
+
+    assert calls(client, "abort_multipart_upload")
+    assert not client.uploads
+    assert not storage.exists("dir/failed")
+
+
+def test_read_with_ranged_gets(storage, client):
+    storage.save("file", ContentFile(DATA))
+
+    with storage.open("file") as f:
+        f.seek(5000)
+        assert f.read(10) == DATA[5000:5010]
+        # Served from the buffer
+        assert f.read(10) == DATA[5010:5020]
+        f.seek(-10, 2)
+        assert f.read() == DATA[-10:]
+        assert f.read(10) == b""
+
+    ranges = [call["Range"] for call in calls(client, "get_object")]
+    assert ranges == ["bytes=5000-5099", f"bytes={len(DATA) - 10}-{len(DATA) - 1}"]
+
+
+def test_open_missing_file(storage):
+    with pytest.raises(FileNotFoundError):
+        storage.open("missing")
+
+
+def test_listdir_exists_and_delete(storage, client):
+    client.page_size = 2
+    for name in ("a/1", "a/2", "a/b/3", "a/c/4", "d/5"):
+        storage.save(name, ContentFile(b"x"))
+
+    assert storage.listdir("a") == (["b", "c"], ["1", "2"])
+    assert storage.listdir("") == (["a", "d"], [])
+    assert storage.listdir("missing") == ([], [])
+
+    assert storage.exists("a/1")
+    storage.delete("a/1")
+    assert not storage.exists("a/1")
+    assert storage.size("a/2") == 1
+
+
+def test_location(client):
+    storage = S3Storage("bucket", location="/prefix/", client=client)
+
+    storage.save("file", ContentFile(b"x"))
+
+    assert list(client.objects["bucket"]) == ["prefix/file"]
+    assert storage.listdir("") == ([], ["file"])
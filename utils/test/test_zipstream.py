@@ -0,0 +1,41 @@
+import zipfile
+from datetime import datetime
+from io import BytesIO
+
+from utils.zipstream import ZipEntry, iter_zip, unique_entry_names
+
+
+def test_unique_entry_names():
+    names = ["a.txt", "a.txt", "../b", "dir\\a.txt", "", "a (1).txt"]
+
+    assert list(unique_entry_names(names)) == [
+        "a.txt",
+        "a (1).txt",
+        "b",
+        "a (2).txt",
+        "file",
+        "a (1) (1).txt",
+    ]
+
+
+def test_iter_zip_is_lazy():
+    read = []
+
+    def chunks(name):
+        read.append(name)
+        yield name.encode() * 1000
+        yield b"end"
+
+    modified_at = datetime(2024, 1, 2, 3, 4, 6)
+    entries = (ZipEntry(name, modified_at, 3003, chunks(name)) for name in "abc")
+    stream = iter_zip(entries)
+
+    # Nothing is read before the archive reaches the entry
+    data = next(stream)
+    assert read == ["a"]
+    data += b"".join(stream)
+
+    with zipfile.ZipFile(BytesIO(data)) as archive:
+        assert archive.namelist() == ["a", "b", "c"]
+        assert archive.read("b") == b"b" * 1000 + b"end"
+        assert archive.getinfo("c").date_time == (2024, 1, 2, 3, 4, 6)
@@ -0,0 +1,79 @@
+"""Streaming of ZIP archives which are generated while they're being sent.
+
+The entries are stored without compression, and the archive is written to a
+stream which can't seek, so the sizes and checksums of the entries are written
+after their data. Only the chunk being written is held in memory, so the memory
+usage doesn't depend on the size of the archive.
+"""
+
+import posixpath
+import zipfile
+from datetime import datetime
+from io import RawIOBase
+from typing import Iterable, Iterator, NamedTuple
+
+
+class ZipEntry(NamedTuple):
+    name: str
+    modified_at: datetime
+    # Tells ZipFile whether the entry needs the ZIP64 extensions
+    size: int
+    # Iterated only when the entry is written
+    chunks: Iterable[bytes]
+
+
+class _ZipOutput(RawIOBase):
+    """Unseekable stream which collects the output of ZipFile until it's taken."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        # ZipFile needs the offsets of the entries, but not seeking
+        return self._position
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def unique_entry_names(names: Iterable[str]) -> Iterator[str]:
+    """Make the names of the entries safe to extract and unique by appending a
+    number to the repeated ones, e.g. "file (1).txt"."""
+    used = set()
+    for name in names:
+        name = posixpath.basename(name.replace("\\", "/")) or "file"
+        base, extension = posixpath.splitext(name)
+        unique_name, number = name, 0
+        while unique_name in used:
+            number += 1
+            unique_name = f"{base} ({number}){extension}"
+        used.add(unique_name)
+        yield unique_name
+
+
+def iter_zip(entries: Iterable[ZipEntry]) -> Iterator[bytes]:
+    """Generate a ZIP archive of the entries in store mode, piece by piece."""
+    output = _ZipOutput()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_STORED) as archive:
+        for entry in entries:
+            info = zipfile.ZipInfo(entry.name, entry.modified_at.timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            info.file_size = entry.size
+            with archive.open(info, "w") as f:
+                for chunk in entry.chunks:
+                    f.write(chunk)
+                    if data := output.take():
+                        yield data
+            yield output.take()
+    yield output.take()